@@ -0,0 +1,119 @@
+""" Benchmark of Monte Carlo variance reduction schemes for the area change CI """
+
+"""
+    mc_benchmark.py
+    Version: ArcGIS 9.3
+    For: Washington DNR, Submerged Vegetation Monitoring Program (SVMP)
+    Requires: Python 2.5.1, NumPy
+
+    Compares the precision and run time of the Monte Carlo 95% confidence
+    interval for the relative change with each variance reduction scheme
+    of the vectorized engine (plain, antithetic, sobol) and with the classic
+    engine (Python random module, one iteration at a time).
+
+    The interval is calculated for a number of replicate seeds with synthetic
+    site data.  For each scheme the report shows the mean interval, the
+    standard deviation of the interval between replicates, the time for one
+    replicate and the precision per second:
+
+        precision per second = 1 / (variance of the interval * seconds)
+
+    which does not depend on the number of iterations, so engines run with
+    different numbers of iterations can be compared.  The efficiency column
+    is the precision per second relative to the classic engine.
+
+    Usage:
+    python mc_benchmark.py [iterations] [replicates] [classic_iterations] [seed]
+    (defaults: 20000 20 2000 1)
+
+"""
+
+import sys
+import time
+import random
+import svmp_93 as svmp
+import svmp_mc_93 as mc
+
+def synthetic_site_data(rng,prefix,n,sample_area=False):
+    """ Year 1 and Year 2 site data lists for n synthetic sites """
+    y1 = []
+    y2 = []
+    for i in range(n):
+        site_id = "%s%03i" % (prefix,i)
+        a1 = rng.choice([0.0,rng.uniform(1e3,5e6)])
+        a2 = a1 * rng.uniform(0.7,1.3)
+        row1 = [site_id,a1,(a1 * rng.uniform(0.05,0.5)) ** 2 + rng.uniform(0,1e10)]
+        row2 = [site_id,a2,(a2 * rng.uniform(0.05,0.5)) ** 2 + rng.uniform(0,1e10)]
+        if sample_area:
+            a2j = rng.uniform(1e6,5e7)
+            row1.append(a2j)
+            row2.append(a2j)
+        y1.append(row1)
+        y2.append(row2)
+    return (y1,y2)
+
+def synthetic_strata(seed=1):
+    """ List of StratumMC objects for core, flats, fringe and wide fringe strata
+        with synthetic site data and stratum constants
+    """
+    rng = random.Random(seed)
+    strata = []
+    for (analysis,extrapolation,n) in (("core","none",12),("flats","area",15),
+                                       ("fringe","linear",30),("wide fringe","linear",9)):
+        stratum = svmp.BaseStratum(analysis,extrapolation)
+        if extrapolation == "area":
+            stratum.Ni = 60
+            stratum.A2 = 5e9
+        elif extrapolation == "linear":
+            stratum.Ni = n * 4
+            stratum.LT = n * 4 * 1000 * 0.9
+            stratum.LN = n * 4 * 1000.0
+        sample_area = (extrapolation == "area")
+        (y1m,y2m) = synthetic_site_data(rng,analysis,n,sample_area)
+        # Year 1 also has some sites that were not sampled in Year 2
+        (y1_only,y2_only) = synthetic_site_data(rng,analysis + "_y1",3,sample_area)
+        strata.append(mc.StratumMC(y1m + y1_only,y1m,y2m,stratum,"sf2m"))
+    return strata
+
+def benchmark(strata,engine,scheme,iterations,replicates,seed=1):
+    """ Confidence intervals for replicate seeds, with the mean time per replicate
+        Returns a tuple: (list of intervals, seconds per replicate)
+    """
+    cis = []
+    start = time.time()
+    for r in range(replicates):
+        accumulator = mc.mc_conf_int(strata,iterations,0.95,engine,mc.stream_seed(seed,r)[0],
+                                     scheme=scheme)
+        cis.append(accumulator.ci())
+    return (cis,(time.time() - start) / replicates)
+
+def mean_sd(values):
+    """ Mean and standard deviation of a list of values """
+    n = len(values)
+    mean = sum(values) / float(n)
+    var = sum([(v - mean) ** 2 for v in values]) / (n - 1)
+    return (mean,var ** 0.5)
+
+def main(iterations=20000,replicates=20,classic_iterations=2000,seed=1):
+    strata = synthetic_strata(seed)
+    runs = [("classic (random module)",mc.CLASSIC,mc.PLAIN,classic_iterations)]
+    for scheme in mc.SCHEMES:
+        runs.append(("vectorized %s" % scheme,mc.VECTORIZED,scheme,iterations))
+
+    print "Monte Carlo 95%% CI benchmark: %i replicates" % replicates
+    print "%-24s %10s %12s %12s %10s %14s %10s" % ("scheme","iterations","mean CI","SD of CI",
+                                                   "seconds","precision/s","efficiency")
+    baseline = None
+    for (label,engine,scheme,n) in runs:
+        (cis,seconds) = benchmark(strata,engine,scheme,n,replicates,seed)
+        (mean,sd) = mean_sd(cis)
+        precision_per_second = 1.0 / (sd ** 2 * seconds)
+        if baseline is None:
+            baseline = precision_per_second
+        print "%-24s %10i %12.6f %12.6f %10.4f %14.4g %10.2f" % (label,n,mean,sd,seconds,
+                                                                 precision_per_second,
+                                                                 precision_per_second / baseline)
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    main(*args)
@@ -246,6 +246,8 @@ AijCol = "Aij"
 RCol = "R"
 LTCol = "LT"
 LNCol = "LN"
+swCICol = "mc_95ci_m2"
+swCISECol = "mc_95ci_se_m2"
 
 svyyrCol1 = "survey_year1"
 svyyrCol2 = "survey_year2"
@@ -256,6 +258,18 @@ propChgCol = "prop_change"
 zmAreaChgCol = "zm_area_chg_m2"
 zmAreaChgSECol = "se_zm_area_chg"
 zmAreaChgCI = "mc_95ci"
+zmAreaChgCISE = "mc_95ci_se"
+mcIterationsCol = "mc_iterations"
+
+estimateCol = "estimate"
+estimateValueCol = "estimate_value"
+jkMeanCol = "jk_mean"
+jkBiasCol = "jk_bias"
+jkVarCol = "jk_var"
+jkSECol = "jk_se"
+influenceRankCol = "influence_rank"
+looValueCol = "leave_out_value"
+influenceCol = "influence"
 
 
 swAreaStratumCols = [
@@ -282,7 +296,10 @@ samplegroupCol,
 swareaCol,
 swvarCol,
 swseCol,
-swcvCol
+swcvCol,
+swCICol,
+swCISECol,
+mcIterationsCol
 ]
 
 swAreaChgStratumCols = [
@@ -305,7 +322,33 @@ samplegroupCol,
 propChgCol,
 zmAreaChgCol,
 zmAreaChgSECol,
-zmAreaChgCI
+zmAreaChgCI,
+zmAreaChgCISE,
+mcIterationsCol
+]
+
+swJackknifeCols = [
+svyyrCol1,
+svyyrCol2,
+samplegroupCol,
+estimateCol,
+estimateValueCol,
+sitecountCol,
+jkMeanCol,
+jkBiasCol,
+jkVarCol,
+jkSECol
+]
+
+swJackknifeSiteCols = [
+svyyrCol1,
+svyyrCol2,
+estimateCol,
+influenceRankCol,
+siteCol,
+stratumanalysisCol,
+looValueCol,
+influenceCol
 ]
 
 
@@ -14,7 +14,16 @@ import svmpUtils
 import math
 import svmp_spatial_93 as spatial
 import random
-import copy
+import array
+import heapq
+import bisect
+import sys
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 # Mapping of Geo and Sampling stratum to analysis stratum and extrapolation type
@@ -99,7 +108,134 @@ class Site(object):
         sim_zmArea = self.zmArea + ((self.zmAreaVar ** 0.5) * randNum)
         newSite = Site(self.id,sim_zmArea,self.zmAreaVar,self.a2j)
         return newSite
-        
+
+
+def conversion_factors(conversion):
+    """ Multipliers for converting site Zm areas and variances (as Site.convert_units)
+        Returns a tuple: (area multiplier, variance multiplier)
+    """
+    if conversion is None:
+        return (1.0,1.0)
+    elif conversion == "sf2m":
+        return (svmpUtils.sf_m ** 2, svmpUtils.sf_m ** 4)
+    else:
+        err_text = "Conversion type, %s, is not available" % conversion
+        raise ValueError(err_text)
+
+
+class SiteArray(object):
+    """ Represents the SVMP data for a list of sites, stored by column.
+    
+    Used by Sample in place of a list of Site objects.  Site ids are kept 
+    in a list, and the values in array('d') columns, with unit conversion
+    applied to each column as a whole.
+    
+    Attributes:
+    site_ids -- list of site identifiers
+    zm_areas -- array('d') of site Zostera marina areas
+    zm_vars -- array('d') of site Zostera marina area variances
+    a2js -- site sample areas (rotational flats only): array('d') if all
+            sites have a sample area, otherwise a list (None for no sample area)
+    conversion -- unit conversion flag that was applied to the values
+    
+    >>> sites = SiteArray([["s1",10.0,4.0,100.0],["s2",20.0,9.0,200.0]])
+    >>> len(sites), sites.site_ids, list(sites.zm_areas), list(sites.a2js)
+    (2, ['s1', 's2'], [10.0, 20.0], [100.0, 200.0])
+    >>> boot = sites.take([1,1])
+    >>> boot.site_ids, list(boot.zm_vars)
+    (['s2', 's2'], [9.0, 9.0])
+    >>> boot.rows()
+    [['s2', 20.0, 9.0, 200.0], ['s2', 20.0, 9.0, 200.0]]
+    
+    """
+    def __init__(self,sites_list=(),conversion=None):
+        self.site_ids = []
+        self.zm_areas = array.array('d')
+        self.zm_vars = array.array('d')
+        self.a2js = array.array('d')
+        self.conversion = conversion
+        self.extend(sites_list)
+    
+    def __len__(self):
+        return len(self.site_ids)
+    
+    def __repr__(self):
+        return repr(self.rows())
+    
+    def extend(self,sites_list):
+        """ Add sites from a list of site data, in the original units
+            [site id, Zm area, Zm area variance, (sample area)],
+            or from another SiteArray (values already converted)
+        """
+        if isinstance(sites_list,SiteArray):
+            self._add_columns(sites_list.site_ids,sites_list.zm_areas,
+                              sites_list.zm_vars,list(sites_list.a2js))
+            return
+        ids = []
+        areas = []
+        variances = []
+        a2js = []
+        for s in sites_list:
+            ids.append(s[0])
+            areas.append(s[1])
+            variances.append(s[2])
+            if len(s) == 4:
+                a2js.append(s[3])
+            else:
+                a2js.append(None)
+        if self.conversion is not None:
+            (area_factor,var_factor) = conversion_factors(self.conversion)
+            areas = [a * area_factor for a in areas]
+            variances = [v * var_factor for v in variances]
+            a2js = [a and a * area_factor for a in a2js]
+        self._add_columns(ids,areas,variances,a2js)
+    
+    def append_site(self,site):
+        """ Add a Site object (values already converted) """
+        self._add_columns([site.id],[site.zmArea],[site.zmAreaVar],[site.a2j])
+    
+    def _add_columns(self,ids,areas,variances,a2js):
+        self.site_ids.extend(ids)
+        self.zm_areas.extend(areas)
+        self.zm_vars.extend(variances)
+        if isinstance(self.a2js,array.array) and None not in a2js:
+            self.a2js.extend(a2js)
+        else:
+            self.a2js = list(self.a2js) + list(a2js)
+    
+    def take(self,indices):
+        """ New SiteArray with the sites at a list of positions (e.g. a bootstrap sample) """
+        new = SiteArray(conversion=self.conversion)
+        new.site_ids = [self.site_ids[i] for i in indices]
+        new.zm_areas = array.array('d',[self.zm_areas[i] for i in indices])
+        new.zm_vars = array.array('d',[self.zm_vars[i] for i in indices])
+        a2js = [self.a2js[i] for i in indices]
+        if isinstance(self.a2js,array.array):
+            new.a2js = array.array('d',a2js)
+        else:
+            new.a2js = a2js
+        return new
+    
+    def site(self,i):
+        """ Site object for the site at position i """
+        site = Site(self.site_ids[i],self.zm_areas[i],self.zm_vars[i],self.a2js[i])
+        site.conversion = self.conversion
+        return site
+    
+    def sites(self):
+        """ List of Site objects """
+        return [self.site(i) for i in xrange(len(self))]
+    
+    def rows(self):
+        """ List of site data: [site id, Zm area, Zm area variance, (sample area)] """
+        rows = []
+        for i in xrange(len(self)):
+            row = [self.site_ids[i],self.zm_areas[i],self.zm_vars[i]]
+            if self.a2js[i] is not None:
+                row.append(self.a2js[i])
+            rows.append(row)
+        return rows
+
     
 class BaseStratum(object):
     """ Represents an analysis stratum for grouping of SVMP sites.
@@ -124,41 +260,46 @@ class FlatsStratum(BaseStratum):
     gp -- ESRI ArcGIS Geoprocessing object
     stratum_fc -- full path to ArcGIS feature class representing the stratum
     conversion -- [optional] unit conversion flag
+    cache -- [optional] StratumConstants cache (default: stratum_constants)
     query_string -- an ArcGIS query string (the "where" clause)
     Ni -- count of sites in stratum
     A2 -- sum of stratum area
     
     """
-    def __init__(self,analysis,extrapolation,gp,stratum_fc,conversion=None):
+    def __init__(self,analysis,extrapolation,gp,stratum_fc,conversion=None,cache=None):
         BaseStratum.__init__(self,analysis,extrapolation)
         
         self.gp = gp 
         self.stratum_fc = stratum_fc
         self.conversion = conversion
+        self.cache = cache or stratum_constants
         self.query_string = '"NAME" <> \'\' and "focus_stra" not in (\'c\',\'pfl\')'
+        self._totals = None
         
-        self.Ni = self.get_Ni()
-        self.A2 = self.get_A2()
+        self.Ni = self.cache.value(stratum_fc,self.query_string,None,"Ni",self.get_Ni)
+        self.A2 = self.cache.value(stratum_fc,self.query_string,conversion,"A2",self.get_A2)
+
+    def _query_totals(self):
+        """ Count and area sum of the rotational flats, from one query """
+        if self._totals is None:
+            qry = spatial.FeatureQuery(self.gp,self.stratum_fc,self.query_string)
+            self._totals = qry.aggregate([(spatial.COUNT,),(spatial.SUM,qry.shape_field)])
+            del qry
+        return self._totals
 
     def get_Ni(self):
         """ count the number of rotational flats in the stratum """
-        qry = spatial.FeatureQuery(self.gp,self.stratum_fc,self.query_string)
-        count = qry.record_count
-        del qry
-        return count
+        return self._query_totals()[0]
         
     def get_A2(self):
         """ get the sum of the rotational flats stratum area """
-        qry = spatial.FeatureQuery(self.gp,self.stratum_fc,self.query_string)
+        area = self._query_totals()[1]
         if self.conversion:
             if self.conversion == "sf2m":
-                area = qry.geometry_sum * (svmpUtils.sf_m ** 2)
+                area = area * (svmpUtils.sf_m ** 2)
             else:
-                err_text = "Conversion type, %s, is not available" % conversion
+                err_text = "Conversion type, %s, is not available" % self.conversion
                 raise ValueError(err_text)
-        else:
-            area = qry.geometry_sum
-        del qry
         return area
     
   
@@ -173,134 +314,255 @@ class FringeStratum(BaseStratum):
     gp -- ESRI ArcGIS Geoprocessing object
     stratum_fc -- full path to ArcGIS feature class representing the stratum
     conversion -- [optional] unit conversion flag
+    cache -- [optional] StratumConstants cache (default: stratum_constants)
     Ni -- count of sites in stratum
     LT -- sum of stratum length
     LN -- length of sampling frame - 
           NOTE: units must be meters for LN calculation to be correct
     
     """
-    def __init__(self,analysis,extrapolation,gp,stratum_fc,conversion=None):
+    # Query strings by analysis stratum: sites in the stratum (Ni), 
+    #  and sites including "orphans" (LT)
+    Ni_queries = {"fringe":'"2002TYPE" = \'fr\' and "REGION" <> \'sps\'',
+                  "wide fringe":'"2002TYPE" = \'frw\' and "REGION" <> \'sps\''}
+    LT_queries = {"fringe":'"2002TYPE" in (\'fr\',\'fr-orphan<984m\') and "REGION" <> \'sps\'',
+                  "wide fringe":'"2002TYPE" in (\'frw\',\'frw-orphan<984m\') and "REGION" <> \'sps\''}
+    # Site type field, and the type counted for Ni 
+    #  (the LT query records are the Ni query records plus "orphans")
+    type_field = "2002TYPE"
+    Ni_types = {"fringe":"fr","wide fringe":"frw"}
+    
+    def __init__(self,analysis,extrapolation,gp,stratum_fc,conversion=None,cache=None):
         BaseStratum.__init__(self,analysis,extrapolation)
         
         self.gp = gp
         self.stratum_fc = stratum_fc
         self.conversion = conversion
-        self.Ni = self.get_Ni()
-        self.LT = self.get_LT()
+        self.cache = cache or stratum_constants
+        self._totals = None
+        self.Ni = self.cache.value(stratum_fc,self._query(self.Ni_queries),None,"Ni",self.get_Ni)
+        self.LT = self.cache.value(stratum_fc,self._query(self.LT_queries),conversion,"LT",self.get_LT)
         self.LN = float(self.Ni) * 1000
+    
+    def _query(self,queries):
+        """ Query for the correct set of sites, based on analysis stratum """
+        try:
+            return queries[self.analysis]
+        except KeyError:
+            err_text = "Analysis stratum type, %s, is not a valid fringe stratum" % self.analysis
+            raise ValueError(err_text)
+        
+    def _query_totals(self):
+        """ Count of each site type and length sum of the fringe sites 
+            including "orphans", from one query
+        """
+        if self._totals is None:
+            qry = spatial.FeatureQuery(self.gp,self.stratum_fc,self._query(self.LT_queries))
+            self._totals = qry.aggregate([(spatial.COUNT,None,self.type_field),(spatial.SUM,qry.shape_field)])
+            del qry
+        return self._totals
         
     def get_Ni(self):
         """ count the number of fringe sites in the stratum """
-        # Query for the correct set of sites, based on analysis stratum
-        if self.analysis == "fringe":
-            query_string = '"2002TYPE" = \'fr\' and "REGION" <> \'sps\''
-        elif self.analysis == "wide fringe":
-            query_string = '"2002TYPE" = \'frw\' and "REGION" <> \'sps\''
-        else:
-            err_text = "Analysis stratum type, %s, is not a valid fringe stratum" % self.analysis
-            raise ValueError(err_text)
-        qry = spatial.FeatureQuery(self.gp,self.stratum_fc,query_string)
-        count = qry.record_count
-        del qry
-        return count
+        self._query(self.Ni_queries)
+        return self._query_totals()[0].get(self.Ni_types[self.analysis],0)
        
     def get_LT(self):
         """ Sum of the Length of all fringe sites in the stratum """
-        # Query for the correct set of sites, based on analysis stratum - includes "orphans"
-        if self.analysis == "fringe":
-            query_string = '"2002TYPE" in (\'fr\',\'fr-orphan<984m\') and "REGION" <> \'sps\''
-        elif self.analysis == "wide fringe":
-            query_string = '"2002TYPE" in (\'frw\',\'frw-orphan<984m\') and "REGION" <> \'sps\''
-        else:
-            err_text = "Analysis stratum type, %s, is not a valid fringe stratum" % self.analysis
-            raise ValueError(err_text)
-        # spatial query object
-        qry = spatial.FeatureQuery(self.gp,self.stratum_fc,query_string)
+        length = self._query_totals()[1]
         # Calculate total length, with unit conversion if necessary
         if self.conversion:
             if self.conversion == "sf2m":
-                length = qry.geometry_sum * (svmpUtils.sf_m)
+                length = length * (svmpUtils.sf_m)
             else:
                 err_text = "Conversion type, %s, is not available" % self.conversion
                 raise ValueError(err_text)
-        else:
-            length = qry.geometry_sum
-        del qry
         return length
 
 
+# Sidecar file extension for saved stratum constants
+STRATUM_CACHE_EXT = ".svmpconst"
+
+class StratumConstants(object):
+    """ Cache of stratum constants (Ni, A2, LT) from feature class queries
+    
+    Values are kept for the life of the process, keyed by the feature class 
+    path, the modification time and size of its files, the query string, 
+    the unit conversion and the constant name.  When a feature class is 
+    changed its key changes, so out of date values are not used.  Feature 
+    classes without files to check (e.g. SDE) are always queried.
+    
+    With persist, the values are also saved in a small sidecar text file 
+    next to the shapefile or geodatabase (STRATUM_CACHE_EXT), and read by 
+    later runs.  The cache still works if the sidecar can't be written.
+    
+    Attributes:
+    persist -- flag to read and write sidecar files
+    values -- dictionary of constant values by key
+    hits -- count of values found in the cache
+    
+    """
+    def __init__(self,persist=False):
+        self.persist = persist
+        self.values = {}
+        self.hits = 0
+        self._sidecars = {}
+    
+    def value(self,fc,query,conversion,name,calculate):
+        """ Cached value of a constant, or the result of calculate() (then cached) """
+        stamp = feature_class_stamp(fc)
+        if stamp is None:
+            return calculate()
+        (container,mtime,size) = stamp
+        key = (os.path.abspath(fc),mtime,size,query,conversion or "",name)
+        if key not in self.values and self.persist:
+            self._load(container)
+        if key in self.values:
+            self.hits += 1
+            return self.values[key]
+        result = calculate()
+        self.values[key] = result
+        if self.persist:
+            self._save(container,mtime,size)
+        return result
+    
+    def _load(self,container):
+        """ Read the values saved in the sidecar file for a shapefile or geodatabase (once) """
+        if container in self._sidecars:
+            return
+        self._sidecars[container] = True
+        try:
+            sidecar = open(container + STRATUM_CACHE_EXT,'r')
+            try:
+                for line in sidecar:
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) != 7 or line.startswith("#"):
+                        continue
+                    (fc,mtime,size,conversion,name,value,query) = fields
+                    try:
+                        value = int(value)
+                    except ValueError:
+                        value = float(value)
+                    self.values[(fc,float(mtime),int(size),query,conversion,name)] = value
+            finally:
+                sidecar.close()
+        except (IOError,ValueError):
+            pass
+    
+    def _save(self,container,mtime,size):
+        """ Write the current values for a shapefile or geodatabase to its sidecar file """
+        lines = ["# SVMP stratum constants: feature class, modification time, size, "
+                 "conversion, name, value, query\n"]
+        fc_prefix = os.path.abspath(container)
+        for (key,value) in sorted(self.values.items()):
+            (fc,fc_mtime,fc_size,query,conversion,name) = key
+            if fc.startswith(fc_prefix) and (fc_mtime,fc_size) == (mtime,size):
+                lines.append("\t".join((fc,repr(fc_mtime),"%i" % fc_size,conversion,name,
+                                        repr(value),query)) + "\n")
+        path = container + STRATUM_CACHE_EXT
+        tmp_path = path + ".tmp"
+        try:
+            out = open(tmp_path,'w')
+            try:
+                out.writelines(lines)
+            finally:
+                out.close()
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path,path)
+        except (IOError,OSError):
+            pass
+
+# Stratum constants cache used by the stratum classes (in memory only)
+stratum_constants = StratumConstants()
+
+# Modification time and size of the files for a feature class (moved to svmp_spatial_93)
+feature_class_stamp = spatial.feature_class_stamp
+
 class Sample(object):
     """ Represents a sample of SVMP sites.
     
     A sample has Sites and a Stratum.
+    The site data are stored by column in a SiteArray.  Site objects
+    are only created when the sites attribute is used.
     
     Attributes:
+    data -- SiteArray of site data (unit conversion applied)
     sites -- a list of site objects
     stratum  -- a stratum object
     site_ids - list of individual site ids in sample
-    zm_areas -- list of individual site Zm Area values
-    zm_vars -- list of individual site Zm Variance values
+    zm_areas -- individual site Zm Area values (array, a view of data)
+    zm_vars -- individual site Zm Variance values (array, a view of data)
     ni -- count of sites in sample
 
     
     """    
     def __init__(self,sites_list,stratum,conversion=None):
-        """ Create a Sample from a list of sites. """
-        self.sites = []
+        """ Create a Sample from a list of site data, or a SiteArray """
         self.conversion = conversion
+        self.data = SiteArray(conversion=conversion)
+        self._sites = None
         # import all the sites and set the stratum
         self.importSites(sites_list) 
         self.set_stratum(stratum)
-        
-        # Properties of the Sample
-        # Lists of individual site values
-        self.site_ids = self._site_attrs('id')
-        self.zm_areas = self._site_attrs('zmArea')
-        self.zm_vars = self._site_attrs('zmAreaVar')
-        
-        self.ni = len(self.sites)
        
     def __repr__(self):
         return repr(self.sites)
+    
+    # Properties of the Sample
+    # Individual site values, from the SiteArray columns
+    site_ids = property(lambda self: self.data.site_ids)
+    zm_areas = property(lambda self: self.data.zm_areas)
+    zm_vars = property(lambda self: self.data.zm_vars)
+    ni = property(lambda self: len(self.data))
+    
+    def _get_sites(self):
+        if self._sites is None or len(self._sites) != len(self.data):
+            self._sites = self.data.sites()
+        return self._sites
+    
+    def _set_sites(self,sites):
+        self.data = SiteArray(conversion=self.conversion)
+        for site in sites:
+            self.data.append_site(site)
+        self._sites = None
+    
+    sites = property(_get_sites,_set_sites)
         
     def importSites(self,sites_list):
-        """Create Site objects from a list of site data.
+        """Add site data to the sample.
         
-        Append these sites objects to a sample
+        sites_list -- list of site data (converted to the sample's units), 
+                      or a SiteArray (already converted)
         
         """ 
-        for s in sites_list:
-            args = s[:3]
-            if len(s) == 4:
-                a2j = s[3]
-            else:
-                a2j = None
-            kwargs = {'a2j':a2j,'conversion':self.conversion}
-            mySite = Site(*args,**kwargs)
-            self._addSite(mySite)
+        self.data.extend(sites_list)
+        self._sites = None
     
     def _addSite(self,site):
         """ Adds individual site objects to the sample. """
-        self.sites.append(site)
+        self.data.append_site(site)
+        self._sites = None
 
     def set_stratum(self,stratum):
         """ Sets the stratum object for the sample """
         self.stratum = stratum
         
     def _site_attrs(self,attr):
+        columns = {'id':'site_ids','zmArea':'zm_areas','zmAreaVar':'zm_vars','a2j':'a2js'}
+        if attr in columns:
+            return getattr(self.data,columns[attr])
         return [getattr(site,attr) for site in self.sites]
     
     def bootstrap(self):
-        #def sample_wr(population, _choose=random.choice):
-            #while True: yield _choose(population)
-        # This would be easier if could just return a whole new Site object, using 
-        bootstrap_sites = [random.choice(self.sites) for i in range(self.ni)]
-        self.sites = bootstrap_sites
-        self.site_ids = self._site_attrs('id')
-        self.zm_areas = self._site_attrs('zmArea')
-        self.zm_vars = self._site_attrs('zmAreaVar')
-
-        return bootstrap_sites
+        """ Replace the sites with a bootstrap sample (random selection with
+            replacement) of the same size.  Returns the list of Site objects.
+        """
+        # Positions are chosen the same way as random.choice from the site list
+        positions = range(self.ni)
+        self.data = self.data.take([random.choice(positions) for i in positions])
+        self._sites = None
+        return self.sites
 
     
 class SampleStats(Sample):
@@ -309,18 +571,20 @@ class SampleStats(Sample):
     Subclass of Sample
   
     Attributes:
+    data -- SiteArray of site data (unit conversion applied)
     sites -- a list of site objects
     stratum  -- a stratum object
     ni -- count of sites in sample
     site_ids - list of individual site ids in sample
-    zm_areas -- list of individual site Zm Area values
-    zm_vars -- list of individual site Zm Variance values
+    zm_areas -- individual site Zm Area values (array, a view of data)
+    zm_vars -- individual site Zm Variance values (array, a view of data)
     zm_area -- Estimated Zm Area for the Sample (based on extrapolation type)
     zm_area_var -- Estimated Zm Area Variance for the Sample (based on extrapolation type)
     se -- Standard Error (same for all extrapolation types)
     cv -- Coefficient of variation (same for all extrapolation types)
     meanZmArea -- Mean Zm Area for the Sample
     variance -- Variance of the Sample's Zm site areas
+    accumulator -- SampleAccumulator with the sums for the statistics
     
     Example Doctest:
     >>> site1 = ["core001",318285957.367152,7.81016158406864E+14,"fl","core"]
@@ -345,13 +609,15 @@ class SampleStats(Sample):
 
         Sample.__init__(self,sites_list,stratum,conversion)
         
-        # Stats on entire Sample
-        self.meanZmArea = self.meanZmArea(self.sites)
-        self.variance = self.variance(self.sites,self.meanZmArea)
+        # Stats on entire Sample, from one pass over the sites
+        self.accumulator = SampleAccumulator(self.data)
+        self.meanZmArea = self.accumulator.sum_x / float(self.ni)
+        # Undefined (0.0) for a single site, which only a census stratum can have
+        self.variance = _divide(self.accumulator.ss_x,self.ni - 1)
         if self.stratum.extrapolation == "area":
-            self.a2js = self._site_attrs('a2j')
-            self.Aij = sum(self.a2js)
-            self.R = sum(self.zm_areas) / self.Aij
+            self.a2js = self.data.a2js
+            self.Aij = self.accumulator.sum_a2j
+            self.R = self.accumulator.sum_x / self.Aij
                
         # Soundwide Estimates
         self.zm_area = self.zm_area()
@@ -361,44 +627,13 @@ class SampleStats(Sample):
         
     def zm_area(self):
         """ Calculate Area of Zostera marina based on extrapolation type """
-        #-- NO EXTRAPOLATION
-        if self.stratum.extrapolation == "none":
-            zmArea = sum(self.zm_areas)
-        #-- AREA EXTRAPOLATION
-        #   Appendix L, Equation 9 (Skalski, 2003)
-        if self.stratum.extrapolation == "area":
-            zmArea = sum(self.zm_areas) * self.stratum.A2 / self.Aij
-        #-- LINEAR EXTRAPOLATION
-        #   Appendix L, Equation 7 (Skalski, 2003)
-        if self.stratum.extrapolation == "linear":
-            zmArea = self.stratum.LT / self.stratum.LN * self.meanZmArea * self.stratum.Ni
-        return zmArea
+        acc = self.accumulator
+        return zm_area_from_sums(self.stratum,acc.n,acc.sum_x,acc.sum_a2j)
     
     def zm_area_var(self):
         """ Calculate Variance of Zostera marina Area based on extrapolation type """
-        #-- NO EXTRAPOLATION
-        if self.stratum.extrapolation == "none":
-            zmAreaVar = sum(self.zm_vars)
-        #-- AREA EXTRAPOLATION
-        #   Appendix L, Equation 11 (Skalski, 2003)
-        if self.stratum.extrapolation == "area":
-            numerator1 = 0
-            for x2j,a2j,id,var in zip(self.zm_areas,self.a2js,self.site_ids,self.zm_vars):
-                site_calc = (x2j - a2j * float(self.R)) ** 2
-                numerator1 = numerator1 + site_calc                
-            term1 = (self.stratum.Ni ** 2)
-            term2 = 1 - (float(self.ni)/self.stratum.Ni)
-            term3 = numerator1 / (float(self.ni) * (self.ni - 1))
-            term4 = self.stratum.Ni * sum(self.zm_vars) / float(self.ni)
-            zmAreaVar = term1 * term2 * term3 + term4
-        #-- LINEAR EXTRAPOLATION
-        #   Appendix L, Equation 8 (Skalski, 2003)
-        if self.stratum.extrapolation == "linear":
-            term1 = (self.stratum.LT / float(self.stratum.LN)) ** 2 
-            term2 = ((self.stratum.Ni ** 2) * (1 - self.ni / float(self.stratum.Ni)) * self.variance) / self.ni
-            term3 = (self.stratum.Ni / float(self.ni)) * sum(self.zm_vars)
-            zmAreaVar = term1 * (term2 + term3)
-        return zmAreaVar
+        acc = self.accumulator
+        return zm_area_var_from_sums(self.stratum,acc.n,acc.sum_var,acc.ss_x,acc.ss_resid)
     
     def se(self,variance):
         """ Calculate the Standard Error """
@@ -413,26 +648,304 @@ class SampleStats(Sample):
         except ZeroDivisionError:
             return 0.0
         
-    def meanZmArea(self,sites):
-        """ Mean Z marina area for the Sample"""
-        sumArea = 0
-        for site in sites:
-            sumArea = sumArea + site.zmArea
-        meanArea = sumArea / float(len(sites))
-        return meanArea
-    
-    def variance(self,sites,meanZmArea):
-        """ Variance of Sample's Zm site areas """
-        sum_sqdif = 0 # initialize sum of squared differences
-        # Calculate sum of squared differences
-        for site in sites:
-            sqdif = (site.zmArea - meanZmArea) ** 2
-            sum_sqdif = sqdif + sum_sqdif  
-        # Standard Deviation
-        stddev = ((1 / ( float(len(sites)) - 1 )) * sum_sqdif ) ** 0.5
-        # Variance
-        var = stddev ** 2
-        return var
+
+class SampleAccumulator(object):
+    """ Accumulates the sums for a sample's statistics in one pass over the sites
+    
+    Sums of site Zm areas, variances and sample areas use compensated 
+    (Neumaier) summation, since site values reach about 1e14 ft4.
+    The sum of squared differences from the mean (Welford's method) and 
+    the sum of squared ratio residuals, (x - a2j * R) ** 2, are updated 
+    as each site is added, as the mean and the ratio R change.
+    
+    Accumulators for parts of a sample (e.g. regions, or sites read by
+    separate workers) can be merged, and finalize gives the same estimates
+    as SampleStats for the combined sites.
+    
+    Attributes:
+    n -- count of sites
+    mean -- mean of the site Zm areas
+    ss_x -- sum of squared differences of site Zm areas from the mean
+    ss_resid -- sum of squared ratio residuals, R = sum_x / sum_a2j
+                (None if any site has no sample area)
+    sum_x -- sum of site Zm areas
+    sum_var -- sum of site Zm area variances
+    sum_a2j -- sum of site sample areas (None if any site has no sample area)
+    
+    >>> acc = SampleAccumulator()
+    >>> for x,v,a in [(1200.0,9000.0,10.0),(0.0,0.0,20.0),(5400.0,40000.0,30.0)]:
+    ...     acc.add_values(x,v,a)
+    >>> acc.n, acc.sum_x, acc.sum_var, acc.sum_a2j, acc.mean
+    (3, 6600.0, 49000.0, 60.0, 2200.0)
+    >>> round(acc.ss_x,6), round(acc.ss_resid,6)
+    (16080000.0, 9260000.0)
+    
+    >>> flStratum = BaseStratum("flats","area")
+    >>> flStratum.Ni, flStratum.A2 = 12, 900.0
+    >>> data = [["fl01",1200.0,9000.0,10.0],["fl02",0.0,0.0,20.0],["fl03",5400.0,40000.0,30.0]]
+    >>> part1 = SampleAccumulator(SiteArray(data[:1]))
+    >>> part2 = SampleAccumulator(SiteArray(data[1:]))
+    >>> est = part1.merge(part2).finalize(flStratum)
+    >>> samp = SampleStats(data,flStratum)
+    >>> [abs(a - b) <= 1e-12 * abs(b) for a,b in zip(est,(samp.zm_area,samp.zm_area_var,samp.se,samp.cv))]
+    [True, True, True, True]
+    
+    """
+    def __init__(self,sites=None):
+        self.n = 0
+        self.mean = 0.0
+        self.ss_x = 0.0
+        self._sum_x = [0.0,0.0]
+        self._sum_var = [0.0,0.0]
+        self._sum_a2j = [0.0,0.0]
+        self._has_a2j = True
+        # ratio residual terms at the current ratio:
+        #  sum of residuals * a2j, and sum of a2j squared
+        self._ss_resid = 0.0
+        self._ratio = 0.0
+        self._resid_a2j = 0.0
+        self._ss_a2j = 0.0
+        if sites is not None:
+            self.extend(sites)
+    
+    sum_x = property(lambda self: _compensated_total(self._sum_x))
+    sum_var = property(lambda self: _compensated_total(self._sum_var))
+    
+    def _get_sum_a2j(self):
+        if self._has_a2j:
+            return _compensated_total(self._sum_a2j)
+    sum_a2j = property(_get_sum_a2j)
+    
+    def _get_ss_resid(self):
+        if self._has_a2j:
+            return self._ss_resid
+    ss_resid = property(_get_ss_resid)
+    
+    def add(self,site):
+        """ Add a Site object """
+        self.add_values(site.zmArea,site.zmAreaVar,site.a2j)
+    
+    def extend(self,sites):
+        """ Add the sites in a SiteArray or a list of Site objects """
+        if isinstance(sites,SiteArray):
+            for (x,var,a2j) in zip(sites.zm_areas,sites.zm_vars,sites.a2js):
+                self.add_values(x,var,a2j)
+        else:
+            for site in sites:
+                self.add_values(site.zmArea,site.zmAreaVar,site.a2j)
+    
+    def add_values(self,zm_area,zm_var,a2j=None):
+        """ Add one site's Zm area, Zm area variance and sample area """
+        self.n += 1
+        _compensated_add(self._sum_x,zm_area)
+        _compensated_add(self._sum_var,zm_var)
+        delta = zm_area - self.mean
+        self.mean += delta / self.n
+        self.ss_x += delta * (zm_area - self.mean)
+        if a2j is None:
+            self._has_a2j = False
+        if self._has_a2j:
+            self._add_ratio_residual(zm_area,a2j)
+    
+    def remove_values(self,zm_area,zm_var,a2j=None):
+        """ Remove one site's Zm area, Zm area variance and sample area 
+            (values that were added before)
+        """
+        if self.n == 1:
+            self.__init__()
+            return
+        n = self.n - 1
+        delta = zm_area - self.mean
+        self.mean -= delta / n
+        self.ss_x = max(self.ss_x - delta * (zm_area - self.mean),0.0)
+        self.n = n
+        _compensated_add(self._sum_x,-zm_area)
+        _compensated_add(self._sum_var,-zm_var)
+        if self._has_a2j:
+            resid = zm_area - a2j * self._ratio
+            self._ss_resid -= resid * resid
+            self._resid_a2j -= a2j * resid
+            self._ss_a2j -= a2j * a2j
+            _compensated_add(self._sum_a2j,-a2j)
+            self._move_ratio()
+            self._ss_resid = max(self._ss_resid,0.0)
+    
+    def copy(self):
+        """ New SampleAccumulator with the same sites """
+        new = SampleAccumulator()
+        new.__dict__.update(self.__dict__)
+        for name in ('_sum_x','_sum_var','_sum_a2j'):
+            setattr(new,name,list(getattr(self,name)))
+        return new
+    
+    def _add_ratio_residual(self,x,a2j):
+        _compensated_add(self._sum_a2j,a2j)
+        self._move_ratio()
+        resid = x - a2j * self._ratio
+        self._ss_resid += resid * resid
+        self._resid_a2j += a2j * resid
+        self._ss_a2j += a2j * a2j
+    
+    def _move_ratio(self):
+        """ Update the ratio, R = sum_x / sum_a2j, and move the residuals to it """
+        sum_a2j = _compensated_total(self._sum_a2j)
+        if sum_a2j:
+            ratio = self.sum_x / sum_a2j
+        else:
+            ratio = 0.0
+        d = ratio - self._ratio
+        self._ss_resid += d * (d * self._ss_a2j - 2 * self._resid_a2j)
+        self._resid_a2j -= d * self._ss_a2j
+        self._ratio = ratio
+    
+    def merge(self,other):
+        """ Add the sites accumulated by another SampleAccumulator 
+            Returns this accumulator (updated)
+        """
+        if other.n == 0:
+            return self
+        n = self.n + other.n
+        # Combined sum of squared differences (Chan et al.)
+        delta = other.mean - self.mean
+        self.ss_x += other.ss_x + delta * delta * self.n * other.n / float(n)
+        self.mean += delta * other.n / float(n)
+        self.n = n
+        for (acc,other_acc) in ((self._sum_x,other._sum_x),(self._sum_var,other._sum_var),
+                                (self._sum_a2j,other._sum_a2j)):
+            _compensated_add(acc,other_acc[0])
+            acc[1] += other_acc[1]
+        self._has_a2j = self._has_a2j and other._has_a2j
+        if self._has_a2j:
+            # Move the ratio residuals of both parts to the combined ratio
+            sum_a2j = self.sum_a2j
+            if sum_a2j:
+                ratio = self.sum_x / sum_a2j
+            else:
+                ratio = 0.0
+            ss_resid = 0.0
+            resid_a2j = 0.0
+            for part in (self,other):
+                d = ratio - part._ratio
+                ss_resid += part._ss_resid + d * (d * part._ss_a2j - 2 * part._resid_a2j)
+                resid_a2j += part._resid_a2j - d * part._ss_a2j
+            self._ss_resid = ss_resid
+            self._resid_a2j = resid_a2j
+            self._ss_a2j += other._ss_a2j
+            self._ratio = ratio
+        return self
+    
+    def finalize(self,stratum):
+        """ Zm area, variance, standard error and coefficient of variation 
+            for the accumulated sites, as SampleStats
+            
+            stratum -- stratum object with the constants for the extrapolation type
+            Returns (zm_area, zm_area_var, se, cv)
+        """
+        zm_area = zm_area_from_sums(stratum,self.n,self.sum_x,self.sum_a2j)
+        zm_area_var = zm_area_var_from_sums(stratum,self.n,self.sum_var,self.ss_x,self.ss_resid)
+        se = zm_area_var ** 0.5
+        return (zm_area,zm_area_var,se,_divide(se,zm_area))
+
+class IncrementalSampleStats(SampleStats):
+    """ SampleStats that can be updated one site at a time, for what-if analysis
+    
+    Subclass of SampleStats
+    
+    add_site and remove_site update the sums and all of the statistics 
+    (meanZmArea, variance, Aij, R, zm_area, zm_area_var, se, cv) without 
+    going through the other sites.  Removing a site moves the last site 
+    into its position.  An AnnualEstimate with IncrementalSampleStats 
+    samples reflects the updates.
+    
+    >>> frStratum = BaseStratum("fringe","linear")
+    >>> frStratum.Ni, frStratum.LT, frStratum.LN = 40, 35000.0, 40000.0
+    >>> data = [["fr01",1200.0,9000.0],["fr02",0.0,0.0],["fr03",5400.0,40000.0],["fr04",800.0,100.0]]
+    >>> samp = IncrementalSampleStats(data,frStratum)
+    >>> site = samp.remove_site("fr02")
+    >>> samp.site_ids, samp.ni
+    (['fr01', 'fr04', 'fr03'], 3)
+    >>> check = SampleStats([data[0],data[2],data[3]],frStratum)
+    >>> [abs(a - b) <= 1e-12 * abs(b) for a,b in zip((samp.zm_area,samp.zm_area_var,samp.se,samp.cv),
+    ...                                              (check.zm_area,check.zm_area_var,check.se,check.cv))]
+    [True, True, True, True]
+    >>> samp.add_site(site)
+    >>> samp.ni, samp.site_ids[-1]
+    (4, 'fr02')
+    >>> [r[0] for r in samp.leave_one_out()]
+    ['fr01', 'fr04', 'fr03', 'fr02']
+    
+    """
+    def __init__(self,sites_list,stratum,conversion=None):
+        SampleStats.__init__(self,sites_list,stratum,conversion)
+        self._positions = {}
+        for (i,site_id) in enumerate(self.site_ids):
+            if site_id in self._positions:
+                raise ValueError("Site, %s, is in the sample more than once" % site_id)
+            self._positions[site_id] = i
+    
+    def add_site(self,site):
+        """ Add a Site object (units already converted) and update the statistics """
+        if site.id in self._positions:
+            raise ValueError("Site, %s, is already in the sample" % site.id)
+        self._positions[site.id] = len(self.data)
+        self._addSite(site)
+        self.accumulator.add(site)
+        self._update()
+    
+    def remove_site(self,site_id):
+        """ Remove a site and update the statistics.  Returns the Site object """
+        try:
+            i = self._positions.pop(site_id)
+        except KeyError:
+            raise ValueError("Site, %s, is not in the sample" % site_id)
+        data = self.data
+        site = data.site(i)
+        # Move the last site into the removed site's position
+        last = len(data) - 1
+        for column in (data.site_ids,data.zm_areas,data.zm_vars,data.a2js):
+            column[i] = column[last]
+            column.pop()
+        if i < last:
+            self._positions[data.site_ids[i]] = i
+        self._sites = None
+        self.accumulator.remove_values(site.zmArea,site.zmAreaVar,site.a2j)
+        self._update()
+        return site
+    
+    def leave_one_out(self):
+        """ Estimates for the sample without each site in turn 
+            Returns a list of (site id, zm_area, zm_area_var, se, cv)
+        """
+        data = self.data
+        estimates = []
+        for i in xrange(len(data)):
+            acc = self.accumulator.copy()
+            acc.remove_values(data.zm_areas[i],data.zm_vars[i],data.a2js[i])
+            estimates.append((data.site_ids[i],) + acc.finalize(self.stratum))
+        return estimates
+    
+    def _update(self):
+        """ Statistics from the accumulated sums (as SampleStats) """
+        acc = self.accumulator
+        self.meanZmArea = acc.sum_x / float(acc.n)
+        self.variance = _divide(acc.ss_x,acc.n - 1)
+        if self.stratum.extrapolation == "area":
+            self.a2js = self.data.a2js
+            self.Aij = acc.sum_a2j
+            self.R = acc.sum_x / self.Aij
+        (self.zm_area,self.zm_area_var,self.se,self.cv) = acc.finalize(self.stratum)
+
+def _compensated_add(acc,x):
+    """ Add x to a compensated sum, [sum, compensation] (Neumaier summation) """
+    total = acc[0] + x
+    if abs(acc[0]) >= abs(x):
+        acc[1] += (acc[0] - total) + x
+    else:
+        acc[1] += (x - total) + acc[0]
+    acc[0] = total
+
+def _compensated_total(acc):
+    return acc[0] + acc[1]
 
 class AnnualEstimate(object):
     """ Represents the annual Zostera marina area estimate and associated error estimates.
@@ -628,6 +1141,349 @@ class ChangeStatsTotal(object):
         return (term1 + term2) ** 0.5
 
 
+##------------------------------------------------------------------------------
+## ------------- KERNEL FUNCTIONS: Statistics from Sums -------------------------
+##------------------------------------------------------------------------------
+""" The same calculations as SampleStats, ChangeStats and ChangeStatsTotal, 
+   working directly from flat lists of site values (or sums of them), 
+   without creating Site or Sample objects.  Used inside Monte Carlo loops.
+   Functions named *_from_sums work with numbers or with NumPy arrays 
+   (one value per iteration).  Units must already be converted.
+"""
+
+def _divide(num,den):
+    """ num / den, or 0.0 where den is zero (numbers or NumPy arrays) """
+    if numpy is not None and isinstance(den,numpy.ndarray):
+        zero = (den == 0)
+        return numpy.where(zero,0.0,num / numpy.where(zero,1.0,den))
+    try:
+        return float(num) / den
+    except ZeroDivisionError:
+        return 0.0
+
+def zm_area_from_sums(stratum,n,sum_x,sum_a2j=None):
+    """ Zm area estimate for a sample, based on extrapolation type (SampleStats.zm_area)
+    
+    n -- count of sites
+    sum_x -- sum of site Zm areas
+    sum_a2j -- sum of site sample areas (area extrapolation only)
+    
+    """
+    #-- NO EXTRAPOLATION
+    if stratum.extrapolation == "none":
+        return sum_x
+    #-- AREA EXTRAPOLATION
+    #   Appendix L, Equation 9 (Skalski, 2003)
+    elif stratum.extrapolation == "area":
+        return sum_x * stratum.A2 / sum_a2j
+    #-- LINEAR EXTRAPOLATION
+    #   Appendix L, Equation 7 (Skalski, 2003)
+    elif stratum.extrapolation == "linear":
+        return stratum.LT / stratum.LN * (sum_x / float(n)) * stratum.Ni
+    else:
+        err_text = "Extrapolation type, %s, is not available" % stratum.extrapolation
+        raise ValueError(err_text)
+
+def zm_area_var_from_sums(stratum,n,sum_var,ss_x=None,ss_resid=None):
+    """ Zm area variance for a sample, based on extrapolation type (SampleStats.zm_area_var)
+    
+    n -- count of sites
+    sum_var -- sum of site Zm area variances
+    ss_x -- sum of squared differences of site Zm areas from their mean (linear only)
+    ss_resid -- sum of squared ratio residuals, (x - a2j * R) ** 2 (area only)
+    
+    """
+    #-- NO EXTRAPOLATION
+    if stratum.extrapolation == "none":
+        return sum_var
+    #-- AREA EXTRAPOLATION
+    #   Appendix L, Equation 11 (Skalski, 2003)
+    elif stratum.extrapolation == "area":
+        term1 = (stratum.Ni ** 2)
+        term2 = 1 - (float(n) / stratum.Ni)
+        term3 = ss_resid / (float(n) * (n - 1))
+        term4 = stratum.Ni * sum_var / float(n)
+        return term1 * term2 * term3 + term4
+    #-- LINEAR EXTRAPOLATION
+    #   Appendix L, Equation 8 (Skalski, 2003)
+    elif stratum.extrapolation == "linear":
+        variance = ss_x / (float(n) - 1)
+        term1 = (stratum.LT / float(stratum.LN)) ** 2
+        term2 = ((stratum.Ni ** 2) * (1 - n / float(stratum.Ni)) * variance) / n
+        term3 = (stratum.Ni / float(n)) * sum_var
+        return term1 * (term2 + term3)
+    else:
+        err_text = "Extrapolation type, %s, is not available" % stratum.extrapolation
+        raise ValueError(err_text)
+
+def sample_stats_kernel(stratum,areas,variances,a2js=None):
+    """ Zm area, variance, standard error and coefficient of variation for a sample
+    
+    stratum -- stratum object with the constants for the extrapolation type
+    areas -- list of site Zm areas
+    variances -- list of site Zm area variances
+    a2js -- [optional] list of site sample areas (area extrapolation only)
+    
+    Returns (zm_area, zm_area_var, se, cv), the same values as SampleStats
+    
+    >>> frStratum = BaseStratum("fringe","linear")
+    >>> frStratum.Ni, frStratum.LT, frStratum.LN = 40, 35000.0, 40000.0
+    >>> data = [["fr01",1200.0,9000.0],["fr02",0.0,0.0],["fr03",5400.0,40000.0]]
+    >>> samp = SampleStats(data,frStratum)
+    >>> k = sample_stats_kernel(frStratum,[1200.0,0.0,5400.0],[9000.0,0.0,40000.0])
+    >>> [abs(a - b) <= 1e-9 * abs(b) for a,b in zip(k,(samp.zm_area,samp.zm_area_var,samp.se,samp.cv))]
+    [True, True, True, True]
+    
+    """
+    n = len(areas)
+    sum_x = sum(areas)
+    sum_var = sum(variances)
+    ss_x = None
+    ss_resid = None
+    sum_a2j = None
+    if stratum.extrapolation == "linear":
+        mean = sum_x / float(n)
+        ss_x = sum([(x - mean) ** 2 for x in areas])
+    elif stratum.extrapolation == "area":
+        sum_a2j = sum(a2js)
+        R = sum_x / sum_a2j
+        ss_resid = sum([(x - a * R) ** 2 for x,a in zip(areas,a2js)])
+    zm_area = zm_area_from_sums(stratum,n,sum_x,sum_a2j)
+    zm_area_var = zm_area_var_from_sums(stratum,n,sum_var,ss_x,ss_resid)
+    se = zm_area_var ** 0.5
+    return (zm_area,zm_area_var,se,_divide(se,zm_area))
+
+def slope_from_sums(x2sum,xysum):
+    """ Slope of the regression line through the origin (ChangeStats.slope) """
+    return _divide(xysum,x2sum)
+
+def change_from_sums(n,x2sum,y2sum,xysum,y1_area,y1_var):
+    """ Change statistics for a stratum from sums of matching site Zm areas
+    
+    n -- count of matching sites
+    x2sum -- sum of squared Year 1 matching site Zm areas
+    y2sum -- sum of squared Year 2 matching site Zm areas
+    xysum -- sum of the products of Year 1 and Year 2 matching site Zm areas
+    y1_area -- Year 1 Zm area estimate (all sites)
+    y1_var -- Year 1 Zm area variance estimate (all sites)
+    
+    Returns (m, m_se, change_prop, area_change, area_change_se),
+    the same values as ChangeStats
+    
+    """
+    m = slope_from_sums(x2sum,xysum)
+    # Standard error of the slope
+    slope_var = _divide(_divide(y2sum - _divide(xysum ** 2,x2sum),n - 1),x2sum)
+    # Capture situations where value is essentially zero, but somehow ends up as a small negative number
+    if numpy is not None and isinstance(slope_var,numpy.ndarray):
+        slope_var = numpy.where((slope_var < 0) & (abs(slope_var) < 0.0001),0.0,slope_var)
+    elif slope_var < 0 and abs(slope_var) < 0.0001:
+        slope_var = 0.0
+    m_se = slope_var ** 0.5
+    change_prop = m - 1
+    area_change = change_prop * y1_area
+    variance = y1_var * (change_prop ** 2) + ((m_se * y1_area) ** 2) - y1_var * (m_se ** 2)
+    return (m,m_se,change_prop,area_change,variance ** 0.5)
+
+def change_stats_kernel(xs,ys,y1_area,y1_var):
+    """ Change statistics for a stratum from lists of matching site Zm areas
+    
+    xs -- Year 1 matching site Zm areas
+    ys -- Year 2 matching site Zm areas (same order as xs)
+    y1_area, y1_var -- Year 1 Zm area and variance estimates (all sites)
+    
+    Returns (m, m_se, change_prop, area_change, area_change_se)
+    
+    >>> core = BaseStratum("core","none")
+    >>> y1 = SampleStats([["c1",10.0,4.0],["c2",20.0,9.0],["c3",5.0,1.0]],core)
+    >>> y1m = SampleStats([["c1",10.0,4.0],["c2",20.0,9.0]],core)
+    >>> y2m = SampleStats([["c1",12.0,4.0],["c2",17.0,9.0]],core)
+    >>> chg = ChangeStats(y1m,y2m,y1)
+    >>> k = change_stats_kernel(y1m.zm_areas,y2m.zm_areas,y1.zm_area,y1.zm_area_var)
+    >>> k == (chg.m,chg.m_se,chg.change_prop,chg.area_change,chg.area_change_se)
+    True
+    
+    """
+    x2sum = sum([x ** 2 for x in xs])
+    y2sum = sum([y ** 2 for y in ys])
+    xysum = sum([x * y for x,y in zip(xs,ys)])
+    return change_from_sums(len(xs),x2sum,y2sum,xysum,y1_area,y1_var)
+
+def change_total_kernel(y1_areas,y1_vars,changes):
+    """ Change statistics for all strata combined (ChangeStatsTotal)
+    
+    y1_areas -- list of stratum Year 1 Zm area estimates
+    y1_vars -- list of stratum Year 1 Zm area variance estimates
+    changes -- list of stratum change statistics tuples (change_stats_kernel)
+    
+    Works with numbers or NumPy arrays (one value per iteration)
+    Returns (area_change, area_change_se, change_prop, change_prop_se)
+    
+    """
+    y1area = sum(y1_areas)
+    area_change = sum([c[3] for c in changes])
+    area_change_se = sum([c[4] ** 2 for c in changes]) ** 0.5
+    change_prop = area_change / y1area
+    term1 = sum([(c[1] * area) ** 2 for area,c in zip(y1_areas,changes)]) / (y1area ** 2)
+    term2 = sum([var * (c[2] * y1area - area_change) ** 2 
+                 for var,c in zip(y1_vars,changes)]) / (y1area ** 4)
+    return (area_change,area_change_se,change_prop,(term1 + term2) ** 0.5)
+
+
+
+##------------------------------------------------------------------------------
+## ------------- JACKKNIFE: Leave-One-Site-Out Estimates ------------------------
+##------------------------------------------------------------------------------
+""" Soundwide estimates with each site left out in turn.  Leaving a site
+   out only changes its own stratum, so each leave-one-out estimate is the
+   full estimate updated with the stratum's sums without that site
+   (SampleAccumulator, and the ChangeStats sums), rather than a complete 
+   recalculation.
+   The estimates are stratified, so the jackknife variance and bias are
+   summed over the strata, each with its own sample size.  Strata with
+   no extrapolation (core, persistent flats) are a census, not a sample,
+   and are fixed: their sites are not left out.
+"""
+
+class Jackknife(object):
+    """ Represents the leave-one-site-out jackknife for a soundwide estimate
+    
+    Attributes:
+    estimate -- estimate with all sites
+    site_ids -- list of site ids
+    strata -- analysis stratum of each site
+    values -- estimate with each site left out
+    influence -- change in the estimate when each site is left out (value - estimate)
+    n -- count of sites
+    mean -- mean of the leave-one-out estimates
+    variance -- stratified jackknife variance, 
+                sum over strata of (n_h - 1) / n_h * sum((value - mean_h) ** 2)
+    se -- jackknife standard error
+    bias -- jackknife bias estimate, sum over strata of (n_h - 1) * (mean_h - estimate)
+    
+    >>> jk = Jackknife(10.0,["s1","s2","s3"],["fringe"] * 3,[9.0,10.5,11.0])
+    >>> jk.n, round(jk.mean,6), round(jk.variance,6), round(jk.bias,6)
+    (3, 10.166667, 1.444444, 0.333333)
+    >>> [r[:3] for r in jk.ranked()]
+    [(1, 's1', 'fringe'), (2, 's3', 'fringe'), (3, 's2', 'fringe')]
+    >>> jk = Jackknife(10.0,["s1","s2","s3","s4"],["flats","flats","fringe","fringe"],[9.0,11.0,9.5,10.0])
+    >>> round(jk.variance,6), round(jk.bias,6)
+    (1.0625, -0.25)
+    
+    """
+    def __init__(self,estimate,site_ids,strata,values):
+        self.estimate = estimate
+        self.site_ids = site_ids
+        self.strata = strata
+        self.values = values
+        self.influence = [v - estimate for v in values]
+        self.n = len(values)
+        if self.n:
+            self.mean = sum(values) / float(self.n)
+        else:
+            self.mean = estimate
+        # Leave-one-out estimates of each stratum
+        stratum_values = {}
+        for (stratum,value) in zip(strata,values):
+            stratum_values.setdefault(stratum,[]).append(value)
+        self.variance = 0.0
+        self.bias = 0.0
+        for vals in stratum_values.values():
+            n_h = len(vals)
+            mean_h = sum(vals) / float(n_h)
+            self.variance += (n_h - 1) / float(n_h) * sum([(v - mean_h) ** 2 for v in vals])
+            self.bias += (n_h - 1) * (mean_h - estimate)
+        self.se = self.variance ** 0.5
+    
+    def __repr__(self):
+        return repr((self.estimate,self.n,self.mean,self.variance,self.se))
+    
+    def ranked(self):
+        """ Sites ranked by the size of their influence (largest first)
+            Returns a list of (rank, site id, stratum, value, influence)
+        """
+        order = sorted(range(self.n),key=lambda i: (-abs(self.influence[i]),self.site_ids[i]))
+        return [(rank + 1,self.site_ids[i],self.strata[i],self.values[i],self.influence[i])
+                for (rank,i) in enumerate(order)]
+
+def annual_jackknife(samples):
+    """ Jackknife for the soundwide Zm area (AnnualEstimate.zm_area)
+    
+    samples -- list of SampleStats objects, one for each stratum
+    Sites in strata with no extrapolation (a census) are not left out.
+    Returns a Jackknife object
+    
+    """
+    estimate = AnnualEstimate(samples).zm_area
+    site_ids = []
+    strata = []
+    values = []
+    for sample in samples:
+        if sample.stratum.extrapolation == "none":
+            continue
+        others = estimate - sample.zm_area
+        for area in _leave_one_out_areas(sample):
+            values.append(others + area)
+        site_ids.extend(sample.site_ids)
+        strata.extend([sample.stratum.analysis] * sample.ni)
+    return Jackknife(estimate,site_ids,strata,values)
+
+def change_jackknife(changes):
+    """ Jackknife for the soundwide proportion change (ChangeStatsTotal.change_prop)
+    
+    changes -- list of ChangeStats objects, one for each stratum
+    Each site in a stratum's Year 1 sample is left out of the Year 1 sample,
+    and out of the matching site samples if it was sampled in both years.
+    Sites in strata with no extrapolation (a census) are not left out.
+    Returns a Jackknife object
+    
+    """
+    y1area = sum([c.y1.zm_area for c in changes])
+    area_change = sum([c.area_change for c in changes])
+    site_ids = []
+    strata = []
+    values = []
+    for c in changes:
+        if c.y1.stratum.extrapolation == "none":
+            continue
+        # Slope without each matching site
+        x2sums = _leave_one_out_sums([x * x for x in c.xs])
+        xysums = _leave_one_out_sums([x * y for (x,y) in zip(c.xs,c.ys)])
+        slopes = {}
+        for (j,site_id) in enumerate(c.y1m.site_ids):
+            slopes[site_id] = slope_from_sums(x2sums[j],xysums[j])
+        other_y1area = y1area - c.y1.zm_area
+        other_change = area_change - c.area_change
+        for (site_id,y1_area) in zip(c.y1.site_ids,_leave_one_out_areas(c.y1)):
+            m = slopes.get(site_id,c.m)
+            values.append((other_change + (m - 1) * y1_area) / (other_y1area + y1_area))
+        site_ids.extend(c.y1.site_ids)
+        strata.extend([c.y1.stratum.analysis] * c.y1.ni)
+    return Jackknife(area_change / y1area,site_ids,strata,values)
+
+def _leave_one_out_areas(sample):
+    """ Zm area estimate for a sample (SampleStats) without each site in turn """
+    if sample.ni < 2:
+        raise ValueError("The %s stratum needs at least two sites for the jackknife" % sample.stratum.analysis)
+    data = sample.data
+    areas = []
+    for i in xrange(len(data)):
+        acc = sample.accumulator.copy()
+        acc.remove_values(data.zm_areas[i],data.zm_vars[i],data.a2js[i])
+        areas.append(zm_area_from_sums(sample.stratum,acc.n,acc.sum_x,acc.sum_a2j))
+    return areas
+
+def _leave_one_out_sums(values):
+    """ Sum of the values without each value in turn (from running sums in both directions) """
+    n = len(values)
+    before = [0.0] * (n + 1)
+    after = [0.0] * (n + 1)
+    for i in xrange(n):
+        before[i + 1] = before[i] + values[i]
+        after[n - i - 1] = after[n - i] + values[n - i - 1]
+    return [before[i] + after[i + 1] for i in xrange(n)]
+
+
 ##------------------------------------------------------------------------------
 ## ------------- FUNCTIONS for Monte Carlo Confidence Intervals-----------------
 ##------------------------------------------------------------------------------
@@ -663,8 +1519,10 @@ def measurement_error(data,i=None,grp=None,outfile=None):
     each interior list representing a site, and for each site, containing
     site_id, Zm Area, and Zm Area Variance (in that order)
     
-    If simulated Zm Area is less than zero, generate new random number(s)
-    until it is greater than zero
+    Simulated Zm Area must not be less than zero.  The random number is drawn
+    directly from the normal distribution truncated at that point (see
+    truncated_normal), which is the same distribution as generating new 
+    random numbers until the simulated area is >= 0
     
     These three parameters are for optional output logging file
     i - the iteration
@@ -672,22 +1530,17 @@ def measurement_error(data,i=None,grp=None,outfile=None):
     outfile - output file handle (opened and closed outside of this function)
     
     """
-    newdata = copy.deepcopy(data)
+    # Site data values are numbers and strings, so copying each list is enough
+    newdata = [site[:] for site in data]
             
     for site in newdata:
         site_id = site[0]
         zmArea = site[1]
         zmAreaVar = site[2]
         # Generate the random number and calculate the simulated Zm area
-        randNum = random.normalvariate(0,1)
         se = zmAreaVar ** 0.5
+        randNum = truncated_normal(zmArea,se,random.random())
         sim_zmArea = zmArea + (se * randNum)
-        # If simulated area is less than zero, 
-        # continue generating values until it is > 0
-        while sim_zmArea < 0:
-            randNum = random.normalvariate(0,1)
-            se = zmAreaVar ** 0.5
-            sim_zmArea = zmArea + (se * randNum)
         site[1] = sim_zmArea
         
         # If output file wanted, create output string and write to file
@@ -699,8 +1552,292 @@ def measurement_error(data,i=None,grp=None,outfile=None):
         
     return newdata
 
+def simulate_areas(areas,ses,out,rand=random.random):
+    """ Simulated Zm areas for a list of sites, written into a buffer
+    
+    areas -- sequence of site Zm areas
+    ses -- sequence of site Zm area standard errors (square root of variance)
+    out -- preallocated sequence (e.g. array('d')) for the simulated areas
+    rand -- [optional] function returning uniform random numbers in [0,1)
+    
+    """
+    for j in xrange(len(areas)):
+        out[j] = areas[j] + ses[j] * truncated_normal(areas[j],ses[j],rand())
+    return out
+
+##------------- Normal distribution, truncated at zero Zm area -----------------
+
+# Largest probability below 1.0, keeps the inverse normal finite
+MAX_P = 1.0 - 2.0 ** -53
+
+# Coefficients for the inverse normal approximation
+#  Source: Acklam, Peter J.  An algorithm for computing the inverse normal
+#  cumulative distribution function.  (relative error < 1.15e-9)
+_ppf_a = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+          1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+_ppf_b = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+          6.680131188771972e+01, -1.328068155288572e+01)
+_ppf_c = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+          -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+_ppf_d = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+          3.754408661907416e+00)
+_ppf_low = 0.02425
+
+def _erfc(x):
+    """ Complementary error function 
+        (Python 2.7+ math.erfc, otherwise Numerical Recipes erfcc, 
+        fractional error < 1.2e-7)
+    """
+    z = abs(x)
+    t = 1.0 / (1.0 + 0.5 * z)
+    ans = t * math.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 +
+          t * (-0.18628806 + t * (0.27886807 + t * (-1.13520398 + t * (1.48851587 +
+          t * (-0.82215223 + t * 0.17087277)))))))))
+    if x >= 0:
+        return ans
+    return 2.0 - ans
+    
+def _erfc_array(x):
+    """ Complementary error function of a NumPy array 
+        (the same calculation as _erfc without math.erfc)
+    """
+    z = numpy.abs(x)
+    t = 1.0 / (1.0 + 0.5 * z)
+    ans = t * numpy.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 +
+          t * (-0.18628806 + t * (0.27886807 + t * (-1.13520398 + t * (1.48851587 +
+          t * (-0.82215223 + t * 0.17087277)))))))))
+    return numpy.where(x >= 0,ans,2.0 - ans)
+    
+# Coefficients for the complementary error function of arrays, when math.erfc
+#  is available.  Source: Cody, W. J.  Rational Chebyshev approximations for
+#  the error function.  Math. Comp. 23 (1969): 631-637.  (netlib specfun calerf)
+_erfc_a = (3.16112374387056560e00, 1.13864154151050156e02, 3.77485237685302021e02,
+           3.20937758913846947e03, 1.85777706184603153e-1)
+_erfc_b = (2.36012909523441209e01, 2.44024637934444173e02, 1.28261652607737228e03,
+           2.84423683343917062e03)
+_erfc_c = (5.64188496988670089e-1, 8.88314979438837594e00, 6.61191906371416295e01,
+           2.98635138197400131e02, 8.81952221241769090e02, 1.71204761263407058e03,
+           2.05107837782607147e03, 1.23033935479799725e03, 2.15311535474403846e-8)
+_erfc_d = (1.57449261107098347e01, 1.17693950891312499e02, 5.37181101862009858e02,
+           1.62138957456669019e03, 3.29079923573345963e03, 4.36261909014324716e03,
+           3.43936767414372164e03, 1.23033935480374942e03)
+_erfc_p = (3.05326634961232344e-1, 3.60344899949804439e-1, 1.25781726111229246e-1,
+           1.60837851487422766e-2, 6.58749161529837803e-4, 1.63153871373020978e-2)
+_erfc_q = (2.56852019228982242e00, 1.87295284992346725e00, 5.27905102951428412e-1,
+           6.05183413124413191e-2, 2.33520497626869185e-3)
+
+def _erfc_cody_array(x):
+    """ Complementary error function of a NumPy array (Cody's rational 
+        approximations, agrees with math.erfc to about 1e-14)
+    """
+    y = numpy.abs(x)
+    # 0.46875 < |x| <= 4 (calculated for all values, with fewer array
+    #  copies than selecting the values in each range)
+    out = _erfc_ratio(y,_erfc_c,_erfc_d)
+    out *= _exp_minus_square(y)
+    tail = y > 4.0
+    if tail.any():
+        ys = y[tail]
+        z = 1.0 / (ys * ys)
+        r = _erfc_ratio(z,_erfc_p,_erfc_q)
+        r *= z
+        numpy.subtract(1.0 / math.sqrt(math.pi),r,r)
+        r /= ys
+        r *= _exp_minus_square(ys)
+        out[tail] = r
+    out = numpy.where(x < 0,2.0 - out,out)
+    # |x| <= 0.46875: 1 - erf(x)
+    small = _erfc_ratio(x * x,_erfc_a,_erfc_b)
+    small *= x
+    numpy.subtract(1.0,small,small)
+    return numpy.where(y <= 0.46875,small,out)
+
+def _erfc_ratio(y,num,den):
+    """ Rational function of a NumPy array, with Cody's coefficients (Horner's rule) """
+    last = len(num) - 1
+    xnum = num[last] * y
+    xden = y.copy()
+    for i in range(last - 1):
+        xnum += num[i]
+        xnum *= y
+        xden += den[i]
+        xden *= y
+    xnum += num[last - 1]
+    xden += den[last - 1]
+    xnum /= xden
+    return xnum
+
+def _exp_minus_square(y):
+    """ exp(-y * y) (relative error below 1e-14 for the |y| < 6 of norm_ppf_array) """
+    e = y * y
+    numpy.negative(e,e)
+    return numpy.exp(e,e)
+
+if hasattr(math,'erfc'):
+    _erfc = math.erfc
+    _erfc_array = _erfc_cody_array
+
+def norm_cdf(x):
+    """ Standard normal cumulative distribution function """
+    return 0.5 * _erfc(-x / 2 ** 0.5)
+
+def _ppf_tail(q):
+    """ Inverse normal, lower tail, from q = sqrt(-2 log(p)) """
+    c = _ppf_c
+    d = _ppf_d
+    return ((((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) /
+            ((((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1))
+
+def _ppf_central(q):
+    """ Inverse normal, central region, from q = p - 0.5 """
+    a = _ppf_a
+    b = _ppf_b
+    r = q * q
+    return ((((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) * q /
+            (((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1))
+
+def norm_ppf(p):
+    """ Inverse of the standard normal cumulative distribution function 
+        (one Halley refinement step is applied to the approximation)
+    """
+    if p <= 0 or p >= 1:
+        raise ValueError("Probability, %r, must be between 0 and 1" % p)
+    if p < _ppf_low:
+        x = _ppf_tail(math.sqrt(-2 * math.log(p)))
+    elif p > 1 - _ppf_low:
+        x = -_ppf_tail(math.sqrt(-2 * math.log(1 - p)))
+    else:
+        x = _ppf_central(p - 0.5)
+    e = norm_cdf(x) - p
+    u = e * math.sqrt(2 * math.pi) * math.exp(x * x / 2)
+    return x - u / (1 + x * u / 2)
+
+def norm_ppf_array(p,out=None):
+    """ Inverse of the standard normal cumulative distribution function 
+        for a NumPy array of probabilities (with the same refinement 
+        step as norm_ppf)
+    """
+    if out is None:
+        out = numpy.empty(p.shape)
+    low = p < _ppf_low
+    high = p > 1 - _ppf_low
+    mid = ~(low | high)
+    out[mid] = _ppf_central(p[mid] - 0.5)
+    out[low] = _ppf_tail(numpy.sqrt(-2 * numpy.log(p[low])))
+    out[high] = -_ppf_tail(numpy.sqrt(-2 * numpy.log(1 - p[high])))
+    # Halley refinement step, as in norm_ppf (in place, the arrays are large)
+    u = _erfc_array(out * (-1 / 2 ** 0.5))
+    u *= 0.5
+    u -= p
+    w = out * out
+    w *= 0.5
+    numpy.exp(w,w)
+    w *= math.sqrt(2 * math.pi)
+    u *= w
+    numpy.multiply(out,u,w)
+    w *= 0.5
+    w += 1
+    u /= w
+    out -= u
+    return out
+
+def truncation_mass(zmArea,se):
+    """ Probability that a simulated Zm area, zmArea + se * z, is not negative """
+    if se == 0:
+        if zmArea >= 0:
+            return 1.0
+        return 0.0
+    return norm_cdf(zmArea / se)
+
+def truncated_normal(zmArea,se,u):
+    """ Random number with a standard normal distribution truncated so that the
+        simulated Zm area, zmArea + se * z, is not negative
+    
+    zmArea -- site Zm area
+    se -- site Zm area standard error
+    u -- uniform random number in [0,1)
+    
+    Uses the inverse cumulative distribution function, so each simulated 
+    area needs exactly one uniform random number
+    
+    """
+    p0 = truncation_mass(zmArea,se)
+    if p0 == 0:
+        raise ValueError("Simulated Zm area can not be >= 0 for area %r, s.e. %r" % (zmArea,se))
+    # z >= -zmArea/se, upper tail probabilities are in (0,p0]
+    return -norm_ppf(min((1.0 - u) * p0,MAX_P))
+
+def truncated_normal_areas(areas,ses,p0s,uniforms,out=None):
+    """ Simulated Zm areas for NumPy arrays of sites (see truncated_normal)
+    
+    areas -- array of site Zm areas
+    ses -- array of site Zm area standard errors
+    p0s -- array of truncation_mass values for the sites
+    uniforms -- array of uniform random numbers in [0,1)
+    out -- [optional] preallocated array for the simulated areas
+    
+    """
+    v = (1.0 - uniforms) * p0s
+    numpy.minimum(v,MAX_P,v)
+    z = norm_ppf_array(v,out)
+    numpy.multiply(z,-ses,z)
+    numpy.add(z,areas,z)
+    return z
+
+class MatchedSites(object):
+    """ Represents the site data for sites sampled in both years of a change analysis
+    
+    The Year 1 and Year 2 data are aligned once, by site id, into parallel lists.
+    A bootstrap draw is a single list of indices, applied to both years, 
+    so pairing is kept without searching for matching sites.
+    
+    Attributes:
+    site_ids -- list of site ids, in the order of the Year 1 data
+    y1 -- list of Year 1 site data
+    y2 -- list of Year 2 site data, aligned with y1
+    n -- count of matching sites
+    
+    Site data lists contain site_id, Zm Area, Zm Area Variance and
+    (rotational flats only) sample area
+    
+    """
+    def __init__(self,data1,data2):
+        lookup = dict([(site[0],site) for site in data2])
+        self.site_ids = [site[0] for site in data1]
+        unmatched = set(self.site_ids).symmetric_difference(lookup)
+        if unmatched or len(data1) != len(data2):
+            err_text = "Year 1 and Year 2 matching site data do not match.  Unmatched site(s): "
+            err_text += ",".join([str(site_id) for site_id in sorted(unmatched)])
+            raise ValueError(err_text)
+        self.y1 = data1
+        self.y2 = [lookup[site_id] for site_id in self.site_ids]
+        self.n = len(self.site_ids)
+        
+    def __repr__(self):
+        return repr(zip(self.y1,self.y2))
+        
+    def bootstrap_indices(self):
+        """ Randomly selected site indices, with replacement (sampling error) """
+        indices = range(self.n)
+        return [random.choice(indices) for i in xrange(self.n)]
+    
+    def take(self,indices):
+        """ Copies of the Year 1 and Year 2 site data at the specified indices """
+        y1 = [self.y1[i][:] for i in indices]
+        y2 = [self.y2[i][:] for i in indices]
+        return (y1,y2)
+        
+    def bootstrap(self):
+        """ A paired bootstrap sample of the Year 1 and Year 2 data """
+        return self.take(self.bootstrap_indices())
+
 def match_sites(data1,data2):
-    """ Finds the data from the year 2 that match the bootstrapped year 1 data """
+    """ Finds the data from the year 2 that match the bootstrapped year 1 data 
+    
+    Searches all of the Year 2 data for every Year 1 site.  
+    MatchedSites does the pairing once, by index, and is used by the Monte Carlo engines
+    
+    """
     data2_match = []
     for site in data1:
         site_id = site[0]
@@ -722,18 +1859,264 @@ def conf_int(rel_changes,pct_ci):
     are within the Mean of rel_changes plus or minus the CI/2
     
     """
-    mean_rc = sum(rel_changes) / len(rel_changes)
-    conf_intervals = [abs(mean_rc - rc) for rc in rel_changes]
-    cis_sorted = sorted(conf_intervals)
-    # Find the index within the sorted list
-    #   that corresponds the specified pct_ci
-    idx_ci = int(len(cis_sorted) * pct_ci)
-    # pct_ci values must be within the range
-    #  and 100 - pct_ci values must be outside of the range.
-    #  The confidence interval is calculated as a mean between the two postions
-    #  in the sorted list of confidence interval values
-    ci = (cis_sorted[(idx_ci - 1)] + cis_sorted[idx_ci]) / 2
-    return ci
+    accumulator = ConfIntAccumulator(pct_ci)
+    accumulator.extend(rel_changes)
+    return accumulator.ci()
+
+def _ci_position(count,pct_ci):
+    """ Index within the sorted list of deviations from the mean
+        that corresponds to the specified pct_ci
+    """
+    return int(count * pct_ci)
+
+def _upper_order_stats(values,idx_ci):
+    """ The values at sorted positions idx_ci - 1 and idx_ci, without a full sort
+    
+    values -- absolute deviations from the mean (list or NumPy array)
+    Uses numpy.partition (introselect) for NumPy arrays, when available,
+    otherwise a heap of the largest values
+    
+    """
+    if hasattr(numpy,'partition') and isinstance(values,numpy.ndarray):
+        part = numpy.partition(values,(idx_ci - 1,idx_ci))
+        return (float(part[idx_ci - 1]),float(part[idx_ci]))
+    # The (n - idx_ci + 1) largest values, in descending order
+    largest = heapq.nlargest(len(values) - idx_ci + 1,values)
+    return (largest[-1],largest[-2])
+
+
+class ConfIntAccumulator(object):
+    """ Accumulates Monte Carlo relative change values for a confidence interval
+    
+    Values are added as the Monte Carlo loop produces them.  
+    
+    Exact mode (default) keeps the values in a compact array('d') and 
+    finds the confidence interval by selection rather than sorting.
+    Sketch mode keeps only a fixed-size histogram, so memory stays the same
+    for millions of iterations.  The interval is then approximate, to within
+    about one histogram bin width.
+    
+    Attributes:
+    pct_ci -- confidence interval value (usually 0.95)
+    sketch -- flag for streaming histogram mode
+    count -- number of values added
+    total -- sum of values added
+    values -- array('d') of all values added (exact mode only)
+    
+    """
+    def __init__(self,pct_ci=0.95,sketch=False,bins=4096):
+        self.pct_ci = pct_ci
+        self.sketch = sketch
+        self.count = 0
+        self.total = 0
+        if sketch:
+            self.values = None
+            self.histogram = StreamingHistogram(bins)
+        else:
+            self.values = array.array('d')
+            self.histogram = None
+            
+    def add(self,rc):
+        """ Add one relative change value """
+        self.extend((rc,))
+        
+    def extend(self,rcs):
+        """ Add a sequence of relative change values """
+        if hasattr(rcs,'tolist'):
+            rcs = rcs.tolist()
+        # Sum in order, the same as sum() over the complete list
+        self.total = sum(rcs,self.total)
+        self.count += len(rcs)
+        if self.sketch:
+            for rc in rcs:
+                self.histogram.add(rc)
+        else:
+            self.values.extend(rcs)
+    
+    def __getstate__(self):
+        """ Pickle the values as raw bytes (for Monte Carlo checkpoints) """
+        state = self.__dict__.copy()
+        state['values'] = _pack_array(self.values)
+        return state
+    
+    def __setstate__(self,state):
+        state['values'] = _unpack_array(state['values'])
+        self.__dict__.update(state)
+    
+    @property
+    def mean(self):
+        """ Mean of the relative change values """
+        return self.total / self.count
+            
+    def ci(self):
+        """ Calculate the confidence interval (see conf_int) """
+        mean_rc = self.mean
+        idx_ci = _ci_position(self.count,self.pct_ci)
+        if self.sketch:
+            return self.histogram.deviation_quantile(mean_rc,idx_ci)
+        if numpy is not None:
+            deviations = abs(mean_rc - numpy.frombuffer(self.values,dtype=float))
+        else:
+            deviations = [abs(mean_rc - rc) for rc in self.values]
+        # pct_ci values must be within the range
+        #  and 100 - pct_ci values must be outside of the range.
+        #  The confidence interval is calculated as a mean between the two postions
+        #  in the sorted list of confidence interval values
+        (lower,upper) = _upper_order_stats(deviations,idx_ci)
+        return (lower + upper) / 2
+
+
+class StreamingHistogram(object):
+    """ Fixed-size histogram of a stream of values, for approximate quantiles
+    
+    The first values are kept exactly until the bins are set up.  The range of
+    the bins doubles (merging pairs of bins) whenever a value falls outside it,
+    so the bin width adapts to the spread of the values.
+    
+    Attributes:
+    bins -- number of histogram bins (even)
+    lo -- lower edge of the histogram
+    width -- width of each bin
+    counts -- count of values in each bin
+    
+    """
+    def __init__(self,bins=4096):
+        self.bins = bins + (bins % 2)
+        self.buffer = array.array('d')
+        self.counts = None
+        self.lo = None
+        self.width = None
+        
+    def add(self,value):
+        """ Add one value to the histogram
+            Raises ValueError for an infinite or NaN value, which has no bin
+
+        >>> h = StreamingHistogram(4)
+        >>> for v in (1.0,2.0,3.0,4.0,10.0): h.add(v)
+        >>> h.add(1e308 * 10)   # doctest: +ELLIPSIS
+        Traceback (most recent call last):
+        ValueError: Value, ..., is not finite (relative change with a Year 1 area of 0?)
+
+        """
+        # inf - inf and nan - nan are nan (no isinf or isnan in Python 2.5)
+        if value - value != 0.0:
+            raise ValueError("Value, %s, is not finite (relative change with a Year 1 area of 0?)" % value)
+        if self.counts is None:
+            self.buffer.append(value)
+            if len(self.buffer) == self.bins:
+                self._setup()
+            return
+        while value < self.lo:
+            self._grow_down()
+        while value >= self.lo + self.width * self.bins:
+            self._grow_up()
+        i = int((value - self.lo) / self.width)
+        self.counts[min(i,self.bins - 1)] += 1
+        
+    def __getstate__(self):
+        """ Pickle the buffer and counts as raw bytes """
+        state = self.__dict__.copy()
+        state['buffer'] = _pack_array(self.buffer)
+        state['counts'] = _pack_array(self.counts)
+        return state
+    
+    def __setstate__(self,state):
+        state['buffer'] = _unpack_array(state['buffer'])
+        state['counts'] = _unpack_array(state['counts'])
+        self.__dict__.update(state)
+        
+    def _setup(self):
+        """ Set the histogram range from the buffered values """
+        lo = min(self.buffer)
+        hi = max(self.buffer)
+        span = (hi - lo) or abs(lo) or 1.0
+        # leave some room on either side of the buffered values
+        self.lo = lo - span * 0.25
+        self.width = span * 1.5 / self.bins
+        self.counts = array.array('d',[0.0]) * self.bins
+        values = self.buffer
+        self.buffer = None
+        for v in values:
+            self.add(v)
+
+    def _merged_pairs(self):
+        """ Counts of adjacent pairs of bins """
+        c = self.counts
+        return [c[2*i] + c[2*i + 1] for i in xrange(self.bins / 2)]
+        
+    def _grow_up(self):
+        """ Double the histogram range, keeping the lower edge """
+        half = self._merged_pairs()
+        self.counts = array.array('d',half + [0.0] * len(half))
+        self.width = self.width * 2
+        
+    def _grow_down(self):
+        """ Double the histogram range, keeping the upper edge """
+        half = self._merged_pairs()
+        self.counts = array.array('d',[0.0] * len(half) + half)
+        self.lo = self.lo - self.width * self.bins
+        self.width = self.width * 2
+
+    def _cdf_function(self):
+        """ Function giving the (interpolated) count of values below x """
+        if self.counts is None:
+            values = sorted(self.buffer)
+            def cdf(x):
+                return bisect.bisect_left(values,x)
+            return cdf
+        cum = [0.0]
+        for c in self.counts:
+            cum.append(cum[-1] + c)
+        lo = self.lo
+        width = self.width
+        nbins = self.bins
+        def cdf(x):
+            pos = (x - lo) / width
+            if pos <= 0:
+                return 0.0
+            if pos >= nbins:
+                return cum[-1]
+            i = int(pos)
+            return cum[i] + (pos - i) * (cum[i + 1] - cum[i])
+        return cdf
+
+    def deviation_quantile(self,center,position):
+        """ Deviation d from center such that about position values are 
+            within center - d and center + d (compare conf_int)
+        """
+        if self.counts is None:
+            deviations = sorted([abs(center - v) for v in self.buffer])
+            return (deviations[position - 1] + deviations[position]) / 2
+        cdf = self._cdf_function()
+        lower = 0.0
+        upper = max(center - self.lo, self.lo + self.width * self.bins - center)
+        # Bisection on the count of values within the interval
+        for i in xrange(100):
+            d = (lower + upper) / 2
+            if cdf(center + d) - cdf(center - d) < position:
+                lower = d
+            else:
+                upper = d
+            if upper - lower <= self.width * 1e-6:
+                break
+        return (lower + upper) / 2
+
+def _pack_array(a):
+    """ Array contents as a (typecode, byte order, bytes) tuple, for pickling """
+    if a is None:
+        return None
+    return (a.typecode,sys.byteorder,a.tostring())
+
+def _unpack_array(packed):
+    """ Array from a _pack_array tuple """
+    if packed is None:
+        return None
+    typecode,byteorder,data = packed
+    a = array.array(typecode)
+    a.fromstring(data)
+    if byteorder != sys.byteorder:
+        a.byteswap()
+    return a
 
 if __name__ == '__main__':
     import doctest
@@ -0,0 +1,2000 @@
+""" Monte Carlo Engines for SVMP Area Change Confidence Intervals """
+
+"""
+    svmp_mc_93.py
+    Version: ArcGIS 9.3
+    For: Washington DNR, Submerged Vegetation Monitoring Program (SVMP)
+    Requires: Python 2.5.1
+              NumPy (optional -- required for the vectorized engine)
+
+    Source:  Dowty, Pete.  2005.  Assessment of Sound-Wide Change Estimates
+    from Paired-Site Analysis.  (white paper). Washington DNR, Olympia, WA.
+
+    Two engines are available for calculating the Monte Carlo
+    relative change values used for the area change confidence interval:
+
+    classic -- one iteration at a time, building SampleStats, ChangeStats
+               and ChangeStatsTotal objects from simulated site data
+    vectorized -- draws all bootstrap indices and measurement error values
+               for a block of iterations as (iterations, n_sites) arrays and
+               computes slope, area change and relative change with
+               column reductions (requires NumPy)
+    kernel -- one iteration at a time, like the classic engine, but computes
+               the change statistics directly from sums of the simulated site
+               values (svmp sufficient-statistics kernels), without building
+               site or sample objects (pure Python)
+
+    The same engines calculate Monte Carlo soundwide Zm area values for the
+    confidence interval of an annual area estimate (mc_estimate_conf_int)
+
+    The vectorized engine can also use a variance reduction scheme for its
+    bootstrap and measurement error draws (antithetic pairs or randomized
+    Sobol points), for a more precise interval from the same number of
+    iterations (see SCHEMES and draw_sources)
+"""
+
+import os
+import sys
+import time
+import array
+import random
+import struct
+import hashlib
+import tempfile
+import cPickle as pickle
+import svmp_93 as svmp
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+# Peak memory for progress messages (resource on Unix, ctypes on Windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import ctypes
+except ImportError:
+    ctypes = None
+
+# Monte Carlo engine names
+#  vectorized-legacy uses the vectorized calculations, but takes its random
+#  numbers from the Python random module in the same order as the classic
+#  engine, so both engines give the same results for the same seed
+CLASSIC = "classic"
+VECTORIZED = "vectorized"
+VECTORIZED_LEGACY = "vectorized-legacy"
+KERNEL = "kernel"
+ENGINES = (CLASSIC, VECTORIZED, VECTORIZED_LEGACY, KERNEL)
+
+# Variance reduction schemes for the vectorized engine's random draws
+#  plain -- independent pseudo-random numbers (default)
+#  antithetic -- the second half of each block mirrors the first (u, 1 - u)
+#  sobol -- randomized (digitally shifted) Sobol low-discrepancy points
+PLAIN = "plain"
+ANTITHETIC = "antithetic"
+SOBOL = "sobol"
+SCHEMES = (PLAIN, ANTITHETIC, SOBOL)
+
+# Bits of precision in Sobol points
+SOBOL_BITS = 32
+
+# Number of iterations calculated at once by the vectorized engine
+BLOCK_SIZE = 2000
+
+# Adaptive stopping -- minimum number of blocks (batches) before stopping
+MIN_BATCHES = 5
+
+# Strata with fewer sites than this are not bootstrapped
+MIN_BOOTSTRAP_SITES = 8
+
+# Engines that take their random numbers from the Python random module
+#  (the module state is saved in checkpoints)
+RANDOM_MODULE_ENGINES = (CLASSIC, VECTORIZED_LEGACY, KERNEL)
+
+# Checkpoint file -- identifying string and file name extension
+CHECKPOINT_MAGIC = "SVMPMCK2"
+CHECKPOINT_EXT = ".mcchk"
+
+# Result cache files -- identifying string, file name extension and the
+#  default limit on the total size of the cache folder
+CACHE_MAGIC = "SVMPMCR1"
+CACHE_EXT = ".mcres"
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Seconds between Monte Carlo progress messages (see MCProgress)
+PROGRESS_INTERVAL = 10.0
+
+# Binary relative change output (NumPy .npy format, version 1.0)
+NPY_MAGIC = "\x93NUMPY\x01\x00"
+NPY_EXT = ".npy"
+NPY_MAX_ROWS = 10 ** 15
+
+
+class StratumMC(object):
+    """ Represents the site data for one analysis stratum in a Monte Carlo run
+
+    Attributes:
+    stratum -- stratum object (BaseStratum, FlatsStratum or FringeStratum)
+    y1_data -- list of site data for all sites sampled in Year 1
+    y1m_data -- list of site data for matching sites, Year 1
+                (empty for an annual area estimate, see estimate_stratum_mc)
+    y2m_data -- list of site data for matching sites, Year 2
+    matched -- svmp.MatchedSites object for the matching sites
+    conversion -- [optional] unit conversion flag
+    resample -- flag for bootstrap resampling (not done for small strata or
+                strata without extrapolation, where all sites are sampled)
+    n1 -- count of sites in Year 1
+    nm -- count of matching sites
+
+    Site data lists contain site_id, Zm Area, Zm Area Variance and
+    (rotational flats only) sample area, in the original units
+
+    """
+    def __init__(self,y1_data,y1m_data,y2m_data,stratum,conversion=None):
+        self.y1_data = y1_data
+        self.y1m_data = y1m_data
+        self.y2m_data = y2m_data
+        self.stratum = stratum
+        self.conversion = conversion
+        self.analysis = stratum.analysis
+        self.extrapolation = stratum.extrapolation
+        self.n1 = len(y1_data)
+        self.nm = len(y1m_data)
+        # Don't do bootstrap for core sites and persistent flats (non-subsampled) 
+        #  or strata with < 8 sites
+        self.resample = not (self.n1 < MIN_BOOTSTRAP_SITES or self.extrapolation == "none")
+        # Unit conversion multipliers for areas and variances
+        self.area_factor, self.var_factor = conversion_factors(conversion)
+
+        # Flat lists of site values, original units
+        self.y1_index = range(self.n1)
+        self.m_index = range(self.nm)
+        self.y1_areas = [s[1] for s in y1_data]
+        self.y1_ses = [s[2] ** 0.5 for s in y1_data]
+        # Year 1 and Year 2 matching sites, aligned by site id
+        self.matched = svmp.MatchedSites(y1m_data,y2m_data)
+        self.y1m_areas = [s[1] for s in self.matched.y1]
+        self.y1m_ses = [s[2] ** 0.5 for s in self.matched.y1]
+        self.y2m_areas = [s[1] for s in self.matched.y2]
+        self.y2m_ses = [s[2] ** 0.5 for s in self.matched.y2]
+        if self.extrapolation == "area":
+            self.y1_a2js = [s[3] * self.area_factor for s in y1_data]
+        else:
+            self.y1_a2js = None
+
+        if numpy is not None:
+            self._make_arrays()
+
+    def __getstate__(self):
+        """ Pickle with a copy of the stratum constants (for worker processes)
+            The stratum object itself may hold the geoprocessor
+        """
+        state = self.__dict__.copy()
+        state['stratum'] = stratum_constants(self.stratum)
+        if '_buffers' in state:
+            state['_buffers'] = {}
+        return state
+
+    def _make_arrays(self):
+        """ NumPy versions of the site value lists for the vectorized engine """
+        self.a_y1_areas = numpy.array(self.y1_areas,dtype=float)
+        self.a_y1_ses = numpy.array(self.y1_ses,dtype=float)
+        self.a_y1m_areas = numpy.array(self.y1m_areas,dtype=float)
+        self.a_y1m_ses = numpy.array(self.y1m_ses,dtype=float)
+        self.a_y2m_areas = numpy.array(self.y2m_areas,dtype=float)
+        self.a_y2m_ses = numpy.array(self.y2m_ses,dtype=float)
+        if self.y1_a2js is not None:
+            self.a_y1_a2js = numpy.array(self.y1_a2js,dtype=float)
+        # Probability that each site's simulated area is >= 0 (truncated normal)
+        self.a_y1_p0s = self._truncation_masses(self.y1_areas,self.y1_ses)
+        self.a_y1m_p0s = self._truncation_masses(self.y1m_areas,self.y1m_ses)
+        self.a_y2m_p0s = self._truncation_masses(self.y2m_areas,self.y2m_ses)
+        # Buffers for simulated areas, reused from block to block
+        self._buffers = {}
+
+    def _truncation_masses(self,areas,ses):
+        p0s = numpy.array([svmp.truncation_mass(a,se) for a,se in zip(areas,ses)],dtype=float)
+        if (p0s == 0).any():
+            err_text = "Simulated Zm area can not be >= 0 for a site in the %s stratum" % self.analysis
+            raise ValueError(err_text)
+        return p0s
+
+    def buffer(self,name,shape):
+        """ Preallocated array of the specified shape, reused between blocks """
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = numpy.empty(shape)
+            self._buffers[name] = buf
+        return buf
+
+
+def estimate_stratum_mc(data,stratum,conversion=None):
+    """ StratumMC object for the sites sampled in one year (annual area estimate) """
+    return StratumMC(data,[],[],stratum,conversion)
+
+def stratum_constants(stratum):
+    """ Copy of the constants from a stratum object, without the geoprocessor """
+    constants = svmp.BaseStratum(stratum.analysis,stratum.extrapolation)
+    for attr in ("Ni","A2","LT","LN"):
+        if hasattr(stratum,attr):
+            setattr(constants,attr,getattr(stratum,attr))
+    return constants
+
+def conversion_factors(conversion):
+    """ Multipliers for converting site Zm areas and variances (same as Site) """
+    return svmp.conversion_factors(conversion)
+
+
+def mc_options(mc_engine,mc_seed,mc_workers,mc_tolerance,mc_max_iterations,msg=None):
+    """ Monte Carlo options from tool parameter text, with defaults
+
+    msg -- [optional] function for messages about options that were changed
+           (e.g. gp.AddMessage)
+
+    Raises ValueError for an engine that is not available
+    Returns a tuple: (engine, seed, workers, tolerance, max_iterations)
+
+    """
+    if msg is None:
+        def msg(text):
+            pass
+    # Monte Carlo engine -- vectorized if NumPy is available
+    if not mc_engine or mc_engine == "#":
+        if numpy is None:
+            mc_engine = KERNEL
+        else:
+            mc_engine = VECTORIZED
+    if mc_engine not in ENGINES:
+        raise ValueError("Monte Carlo engine, %s, must be one of: %s" % (mc_engine,", ".join(ENGINES)))
+    if mc_engine in (VECTORIZED,VECTORIZED_LEGACY) and numpy is None:
+        msg("NumPy is not available, using the %s Monte Carlo engine" % KERNEL)
+        mc_engine = KERNEL
+    # Random number seed for repeatable Monte Carlo results
+    if not mc_seed or mc_seed == "#":
+        mc_seed = new_seed()
+    else:
+        mc_seed = int(mc_seed)
+    # Worker processes -- vectorized engine only
+    if not mc_workers or mc_workers == "#":
+        mc_workers = 1
+    else:
+        mc_workers = int(mc_workers)
+    if mc_workers == 0 and multiprocessing is not None:
+        mc_workers = multiprocessing.cpu_count()
+    if mc_workers > 1 and (mc_engine != VECTORIZED or multiprocessing is None):
+        msg("Worker processes are only available with the %s engine (Python 2.6+), using 1" % VECTORIZED)
+        mc_workers = 1
+    mc_workers = max(mc_workers,1)
+    # Adaptive stopping tolerance and maximum number of iterations
+    if not mc_tolerance or mc_tolerance == "#":
+        mc_tolerance = 0
+    else:
+        mc_tolerance = float(mc_tolerance)
+    if not mc_max_iterations or mc_max_iterations == "#":
+        mc_max_iterations = 20000
+    else:
+        mc_max_iterations = int(mc_max_iterations)
+    return (mc_engine,mc_seed,mc_workers,mc_tolerance,mc_max_iterations)
+
+def scheme_option(mc_scheme,mc_engine,msg=None):
+    """ Variance reduction scheme from tool parameter text (default plain)
+
+    mc_engine -- Monte Carlo engine name (from mc_options)
+    msg -- [optional] function for messages about options that were changed
+
+    Raises ValueError for a scheme that is not available
+    Returns the scheme name
+
+    """
+    if not mc_scheme or mc_scheme == "#":
+        return PLAIN
+    if mc_scheme not in SCHEMES:
+        raise ValueError("Variance reduction scheme, %s, must be one of: %s" % (mc_scheme,", ".join(SCHEMES)))
+    if mc_scheme != PLAIN and mc_engine != VECTORIZED:
+        if msg is not None:
+            msg("Variance reduction is only available with the %s engine, using %s" % (VECTORIZED,PLAIN))
+        return PLAIN
+    return mc_scheme
+
+def rc_file_option(outFile):
+    """ Checks the relative change output file name for mc_conf_int_adaptive,
+        which only writes binary RCWriter files (raises ValueError otherwise)
+    """
+    if outFile and not outFile.lower().endswith(NPY_EXT):
+        raise ValueError("Relative change output file, %s, must be a NumPy %s file" % (outFile,NPY_EXT))
+    return outFile
+
+def mc_relative_change(strata,iterations,engine=VECTORIZED,seed=None,outFile=None,workers=1,detail=False,
+                       scheme=PLAIN,progress=None):
+    """ Calculates relative change values using Monte Carlo analysis
+
+    strata -- list of StratumMC objects (core, flats, fringe, wide fringe)
+    iterations -- number of Monte Carlo iterations (usually 20,000)
+    engine -- name of the Monte Carlo engine (classic, vectorized, vectorized-legacy, kernel)
+    seed -- [optional] random number seed, for repeatable results
+    outFile -- [optional] output file for list of Relative change values
+               A file name ending in .npy is written as a binary RCWriter file,
+               otherwise as a text file
+    workers -- [optional] number of worker processes (vectorized engine only)
+    detail -- [optional] include the slope and area change for each stratum
+              in a .npy output file
+    scheme -- [optional] variance reduction scheme (vectorized engine only)
+    progress -- [optional] MCProgress object for progress messages
+
+    Returns a list of relative change values, one for each iteration
+
+    """
+    binary = outFile and outFile.lower().endswith(NPY_EXT)
+    writer = None
+    if binary:
+        writer = RCWriter(outFile,strata,detail)
+    else:
+        detail = False
+    rel_changes = []
+    def running_ci():
+        return svmp.conf_int(rel_changes,0.95)
+    if progress is not None:
+        progress.start()
+    try:
+        for block in iter_relative_change(strata,iterations,engine,seed,workers,detail=detail,scheme=scheme):
+            columns = block_columns(block,detail)
+            if writer is not None:
+                writer.write(columns)
+            rel_changes.extend(columns[0])
+            if progress is not None:
+                progress.update(len(columns[0]),running_ci)
+    finally:
+        if writer is not None:
+            writer.close()
+        if progress is not None:
+            progress.finish(running_ci)
+
+    if outFile and not binary:
+        output = open(outFile,'w')
+        output.write("run,RC\n")
+        for i,rc in enumerate(rel_changes):
+            output.write("%i,%r\n" % (i,rc))
+        output.close()
+
+    return rel_changes
+
+def mc_conf_int(strata,iterations,pct_ci=0.95,engine=VECTORIZED,seed=None,workers=1,sketch=False,
+                scheme=PLAIN,progress=None):
+    """ Monte Carlo confidence interval for the relative change
+
+    Relative change values are passed to a svmp.ConfIntAccumulator as they
+    are calculated, instead of being kept in a list.  Other parameters are
+    the same as mc_relative_change.
+
+    sketch -- [optional] use a fixed-size histogram (approximate interval)
+
+    Returns the ConfIntAccumulator object -- use its ci() method for the interval
+
+    """
+    accumulator = svmp.ConfIntAccumulator(pct_ci,sketch)
+    if progress is not None:
+        progress.start()
+    try:
+        for rcs in iter_relative_change(strata,iterations,engine,seed,workers,scheme=scheme):
+            accumulator.extend(rcs)
+            if progress is not None:
+                progress.update(len(rcs),accumulator.ci)
+    finally:
+        if progress is not None:
+            progress.finish(accumulator.ci)
+    return accumulator
+
+def mc_conf_int_adaptive(strata,tolerance,max_iterations,pct_ci=0.95,engine=VECTORIZED,
+                         seed=None,workers=1,sketch=False,min_batches=MIN_BATCHES,
+                         checkpoint=None,resume=False,outFile=None,detail=False,scheme=PLAIN,
+                         progress=None,cache=None):
+    """ Monte Carlo confidence interval, stopping once the interval is stable
+
+    Iterations are run in blocks (batches) of BLOCK_SIZE.  The precision of the
+    confidence interval is tracked with the batch means method: the standard
+    error of the interval is estimated from the spread of the intervals
+    calculated from each batch on its own.  If max_iterations isn't a multiple
+    of BLOCK_SIZE, the short last block is used for the interval, but not as
+    a batch for the standard error.
+
+    tolerance -- stop when the standard error of the interval, relative to the
+                 interval, is at or below this value (e.g. 0.01).  Use 0 to
+                 always run max_iterations.
+    max_iterations -- maximum number of Monte Carlo iterations
+    min_batches -- [optional] minimum number of batches before stopping
+    checkpoint -- [optional] Checkpoint object -- the state of the run is saved
+                 to the checkpoint file as blocks are completed
+    resume -- [optional] if True, continue from the state in the checkpoint
+                 file (if there is one).  The seed saved in the checkpoint is
+                 used, and the result is the same as an uninterrupted run.
+    outFile -- [optional] binary (.npy) output file for the relative change
+                 values (see RCWriter).  When resuming, the values after
+                 the checkpoint are replaced.  Other file names raise 
+                 ValueError (see rc_file_option).
+    detail -- [optional] include the slope and area change for each stratum
+                 in the output file
+    scheme -- [optional] variance reduction scheme (vectorized engine only).
+                 With antithetic or sobol, the blocks are still independent,
+                 so the batch means standard error stays valid.
+    progress -- [optional] MCProgress object for progress messages
+    cache -- [optional] ResultCache object.  A run with a seed, and without
+                 an output file, uses the cached result for the same inputs
+                 if there is one, and otherwise saves its result.
+
+    Other parameters are the same as mc_conf_int
+
+    Returns a tuple of the ConfIntAccumulator object (its count is the number
+    of iterations used) and the standard error of the confidence interval
+
+    """
+    rc_file_option(outFile)
+    state = None
+    # Without a seed, each run is a new random sample, so it is not cached
+    use_cache = (cache is not None and seed is not None and not outFile)
+    if checkpoint is not None or use_cache:
+        fingerprint = run_fingerprint(strata,engine,tolerance,max_iterations,
+                                      pct_ci,sketch,min_batches,BLOCK_SIZE,scheme)
+    if checkpoint is not None:
+        if resume:
+            state = checkpoint.load(fingerprint)
+        # The seed is needed to resume the run, so always set one
+        if seed is None:
+            seed = new_seed()
+    if state is not None:
+        seed = state['seed']
+        accumulator = state['accumulator']
+        batch_cis = state['batch_cis']
+        rng_state = state['rng_state']
+        completed = state['blocks']
+    else:
+        accumulator = svmp.ConfIntAccumulator(pct_ci,sketch)
+        batch_cis = []
+        rng_state = None
+        completed = 0
+    if use_cache:
+        cache_key = cache.key(fingerprint,seed)
+        result = cache.get(cache_key)
+        if result is not None:
+            return result
+    ci_se = batch_means_se(batch_cis)
+    if ci_is_stable(accumulator,batch_cis,ci_se,tolerance,min_batches):
+        return (accumulator,ci_se)
+
+    writer = None
+    if outFile:
+        writer = RCWriter(outFile,strata,detail,accumulator.count)
+    blocks = iter_relative_change(strata,max_iterations,engine,seed,workers,
+                                  completed,rng_state,detail,scheme)
+    if progress is not None:
+        progress.start(accumulator.count)
+    # Blocks completed since the last checkpoint save
+    unsaved = []
+    try:
+        for block in blocks:
+            columns = block_columns(block,detail)
+            rcs = columns[0]
+            accumulator.extend(rcs)
+            completed += 1
+            # Batch means needs equal size batches, so a short last block
+            #  (max_iterations not a multiple of BLOCK_SIZE) isn't a batch
+            batch_ci = None
+            if len(rcs) == BLOCK_SIZE:
+                batch_ci = svmp.conf_int(rcs,pct_ci)
+                batch_cis.append(batch_ci)
+            ci_se = batch_means_se(batch_cis)
+            if progress is not None:
+                progress.update(len(rcs),accumulator.ci)
+            if writer is not None:
+                writer.write(columns)
+                writer.flush()
+            if checkpoint is not None:
+                # Copied, as an engine may reuse its block buffers
+                unsaved.append((array.array('d',rcs),batch_ci))
+                if completed % checkpoint.interval == 0:
+                    if engine in RANDOM_MODULE_ENGINES:
+                        rng_state = random.getstate()
+                    checkpoint.save(fingerprint,{'seed':seed,'pct_ci':pct_ci,'sketch':sketch,
+                                                 'blocks':completed,'rng_state':rng_state},unsaved)
+                    unsaved = []
+            if ci_is_stable(accumulator,batch_cis,ci_se,tolerance,min_batches):
+                break
+    finally:
+        # Stop the engine (and any worker processes) if ending early
+        blocks.close()
+        if writer is not None:
+            writer.close()
+        if progress is not None:
+            progress.finish(accumulator.ci)
+    if use_cache:
+        cache.put(cache_key,(accumulator,ci_se))
+    return (accumulator,ci_se)
+
+def ci_is_stable(accumulator,batch_cis,ci_se,tolerance,min_batches=MIN_BATCHES):
+    """ Adaptive stopping test -- True if the confidence interval standard error,
+        relative to the interval, is at or below the tolerance
+    """
+    return bool(tolerance and ci_se is not None and len(batch_cis) >= min_batches
+                and ci_se <= tolerance * accumulator.ci())
+
+def batch_means_se(batch_values):
+    """ Standard error of an estimate from the values of independent batches
+        (standard deviation of the batch values divided by the square root of
+        the number of batches)
+    """
+    k = len(batch_values)
+    if k < 2:
+        return None
+    mean = sum(batch_values) / float(k)
+    var = sum([(v - mean) ** 2 for v in batch_values]) / (k - 1)
+    return (var / k) ** 0.5
+
+def iter_relative_change(strata,iterations,engine=VECTORIZED,seed=None,workers=1,
+                         start=0,rng_state=None,detail=False,scheme=PLAIN):
+    """ Generates relative change values, one block of iterations at a time
+
+    start -- [optional] number of blocks already completed (resuming a run)
+    rng_state -- [optional] random module state after the completed blocks
+                 (engines in RANDOM_MODULE_ENGINES only)
+    detail -- [optional] if True, each block is a list of columns: relative
+                 change, then slope and area change for each stratum
+                 (see rc_fields)
+    scheme -- [optional] variance reduction scheme (vectorized engine only)
+
+    Engines that use the random module leave it in the state for the next
+    block each time they generate a block, so random.getstate() can be saved
+    between blocks
+
+    """
+    if scheme not in SCHEMES:
+        raise ValueError("Variance reduction scheme, %s, is not available" % scheme)
+    if scheme != PLAIN and engine != VECTORIZED:
+        raise ValueError("Variance reduction is only available with the %s engine" % VECTORIZED)
+    if engine == CLASSIC:
+        return classic_blocks(strata,iterations,seed,start,rng_state,detail)
+    elif engine == KERNEL:
+        return kernel_blocks(strata,iterations,seed,start,rng_state,detail)
+    elif engine in (VECTORIZED,VECTORIZED_LEGACY):
+        legacy = (engine == VECTORIZED_LEGACY)
+        return vectorized_blocks(strata,iterations,seed,legacy,workers,start,rng_state,detail,scheme)
+    else:
+        err_text = "Monte Carlo engine, %s, is not available" % engine
+        raise ValueError(err_text)
+
+def start_random(seed=None,rng_state=None):
+    """ Seed the random module, or restore its state when resuming a run """
+    if rng_state is not None:
+        random.setstate(rng_state)
+    elif seed is not None:
+        random.seed(seed)
+
+def remaining_iterations(iterations,start):
+    """ Number of iterations left after start blocks are completed """
+    return max(iterations - start * BLOCK_SIZE,0)
+
+def rc_fields(strata,detail=False):
+    """ Column names for relative change output
+        rc, then (detail only) <stratum>_slope and <stratum>_area_change for each stratum
+    """
+    fields = ["rc"]
+    if detail:
+        for sd in strata:
+            name = str(sd.analysis).replace(" ","_")
+            fields.extend([name + "_slope",name + "_area_change"])
+    return fields
+
+def block_columns(block,detail):
+    """ List of columns for a block generated by iter_relative_change """
+    if detail:
+        return block
+    return [block]
+
+def _new_columns(strata,detail):
+    """ Empty value lists for one block of iterations (see rc_fields) """
+    return [[] for field in rc_fields(strata,detail)]
+
+def _block_output(columns,detail):
+    """ Block of iterations in the form generated by iter_relative_change """
+    if detail:
+        return columns
+    return columns[0]
+
+#-------------------------------------------------------------------------------
+#---------------------------- BINARY RC OUTPUT ---------------------------------
+
+class RCWriter(object):
+    """ Writes Monte Carlo relative change values to a binary file
+
+    The file is in NumPy .npy format: a short text header, then the values
+    as little-endian float64 records, one per iteration, with a field for
+    each column (see rc_fields).  Values are written a block of iterations
+    at a time, and the header is updated with the number of records each
+    time the file is flushed, so the file can be read at any point with
+    read_relative_changes (a memory map).  NumPy is not needed for writing.
+
+    Attributes:
+    path -- output file name (full path)
+    fields -- list of column names
+    rows -- number of records written
+
+    """
+    def __init__(self,path,strata,detail=False,rows=0):
+        self.path = path
+        self.fields = rc_fields(strata,detail)
+        self.row_size = 8 * len(self.fields)
+        self.header_size = len(self._header(NPY_MAX_ROWS))
+        self.rows = rows
+        if rows:
+            # Resuming -- keep the existing records, up to rows
+            if not os.path.exists(path):
+                raise ValueError("Relative change file, %s, from the run being resumed was not found" % path)
+            self.file = open(path,'r+b')
+            existing = self.file.read(self.header_size)
+            prefix = self._header(0)
+            prefix = prefix[:prefix.index("'shape'")]
+            self.file.seek(0,2)
+            if (not existing.startswith(prefix) or
+                self.file.tell() < self.header_size + rows * self.row_size):
+                self.file.close()
+                raise ValueError("Relative change file, %s, does not match the run being resumed" % path)
+            self.file.seek(self.header_size + rows * self.row_size)
+            self.file.truncate()
+        else:
+            self.file = open(path,'wb')
+            self.file.write(self._header(0))
+
+    def _header(self,rows):
+        """ .npy header for the number of records, padded to a fixed size """
+        descr = [(f,'<f8') for f in self.fields]
+        text = "{'descr': %r, 'fortran_order': False, 'shape': (%i,), }" % (descr,rows)
+        # room for the largest record count, total size a multiple of 64
+        size = len(NPY_MAGIC) + 2 + len(text.replace("(%i," % rows,"(%i," % NPY_MAX_ROWS)) + 1
+        size = size + (-size % 64)
+        text = text.ljust(size - len(NPY_MAGIC) - 3) + "\n"
+        return NPY_MAGIC + struct.pack("<H",len(text)) + text
+
+    def write(self,columns):
+        """ Write a block of iterations (list of value sequences, one per field) """
+        if numpy is not None:
+            data = numpy.column_stack(columns).astype('<f8').tostring()
+        else:
+            values = array.array('d')
+            for row in zip(*columns):
+                values.extend(row)
+            if sys.byteorder != "little":
+                values.byteswap()
+            data = values.tostring()
+        self.file.write(data)
+        self.rows += len(columns[0])
+
+    def flush(self):
+        """ Update the record count in the header and flush the file """
+        self.file.seek(0)
+        self.file.write(self._header(self.rows))
+        self.file.seek(0,2)
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+def read_relative_changes(path):
+    """ Relative change values from a RCWriter file, as a read-only memory map
+        (NumPy record array -- e.g. values["rc"], values["core_slope"])
+    """
+    if numpy is None:
+        raise ImportError("NumPy is required to read relative change files")
+    return numpy.load(path,mmap_mode='r')
+
+#-------------------------------------------------------------------------------
+#------------------------------- CHECKPOINTS -----------------------------------
+
+def checkpoint_path(outFile):
+    """ Checkpoint file name for a run, next to its output file """
+    return os.path.splitext(outFile)[0] + CHECKPOINT_EXT
+
+def run_fingerprint(strata,*settings):
+    """ Hash identifying the stratum data and settings of a Monte Carlo run
+        (a checkpoint can only be resumed by a run with the same fingerprint)
+    """
+    digest = hashlib.md5()
+    for sd in strata:
+        constants = stratum_constants(sd.stratum)
+        digest.update(repr((sd.analysis,sd.extrapolation,sd.conversion,
+                            sorted(constants.__dict__.items()))))
+        digest.update(repr(sd.y1_data))
+        digest.update(repr(sd.matched.y1))
+        digest.update(repr(sd.matched.y2))
+    digest.update(repr(settings))
+    return digest.hexdigest()
+
+# Record file header -- identifying string, MD5 checksum and length of the data
+RECORD_HEADER = "<8s16sI"
+
+def write_record(path,magic,obj):
+    """ Write an object to a record file: header, then a binary pickle
+
+    A temporary file is written and then renamed, so a crash while writing
+    leaves any previous file in place
+
+    """
+    tmp_path = path + ".tmp"
+    f = open(tmp_path,'wb')
+    try:
+        f.write(pack_record(magic,obj))
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    # os.rename does not replace an existing file on Windows
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path,path)
+
+def pack_record(magic,obj):
+    """ Record header and binary pickle of an object, as a string """
+    data = pickle.dumps(obj,2)
+    return struct.pack(RECORD_HEADER,magic,hashlib.md5(data).digest(),len(data)) + data
+
+def read_record(path,magic,description):
+    """ Object saved in a record file by write_record
+        Raises ValueError if the file is incomplete, damaged or not a
+        record with this identifying string (description is used in the message)
+    """
+    f = open(path,'rb')
+    try:
+        head = f.read(struct.calcsize(RECORD_HEADER))
+        data = f.read()
+    finally:
+        f.close()
+    if len(head) != struct.calcsize(RECORD_HEADER):
+        raise ValueError("%s file, %s, is not complete" % (description,path))
+    file_magic,checksum,length = struct.unpack(RECORD_HEADER,head)
+    if file_magic != magic:
+        raise ValueError("%s is not a %s file" % (path,description))
+    if len(data) != length or hashlib.md5(data).digest() != checksum:
+        raise ValueError("%s file, %s, is damaged" % (description,path))
+    return pickle.loads(data)
+
+def read_records(path,magic):
+    """ Objects saved one after another in a file (pack_record)
+        Reading stops at the first record that is incomplete or damaged
+        (e.g. cut short by a crash).  Returns a tuple of the list of objects
+        and the length of the file up to the end of the last good record.
+    """
+    f = open(path,'rb')
+    try:
+        contents = f.read()
+    finally:
+        f.close()
+    objects = []
+    head_size = struct.calcsize(RECORD_HEADER)
+    pos = 0
+    while pos + head_size <= len(contents):
+        file_magic,checksum,length = struct.unpack(RECORD_HEADER,contents[pos:pos + head_size])
+        data = contents[pos + head_size:pos + head_size + length]
+        if file_magic != magic or len(data) != length or hashlib.md5(data).digest() != checksum:
+            break
+        objects.append(pickle.loads(data))
+        pos += head_size + length
+    return (objects,pos)
+
+class Checkpoint(object):
+    """ Saved state of a Monte Carlo run, so an interrupted run can be resumed
+
+    The file is a series of records (see pack_record).  The first record has
+    the run settings: fingerprint, seed and the confidence interval settings.
+    Each save appends one record with the relative change values and batch
+    confidence intervals of the blocks completed since the previous save,
+    and the random module state.  So each save only writes the new blocks,
+    and the file grows in proportion to the number of iterations.  When the
+    checkpoint is loaded, the ConfIntAccumulator is rebuilt by adding the
+    blocks in order, which gives the same state as the interrupted run.
+    A record cut short by a crash while saving is ignored when loading, and
+    replaced by the next save.
+
+    Attributes:
+    path -- checkpoint file name (full path)
+    interval -- number of blocks between saves
+    seed -- seed of the run, once a checkpoint is loaded
+    blocks -- number of completed blocks, once a checkpoint is loaded
+
+    """
+    def __init__(self,path,interval=1):
+        self.path = path
+        self.interval = max(int(interval),1)
+        self.seed = None
+        self.blocks = 0
+        # Length of the good records in the file, None to start a new file
+        self._length = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def save(self,fingerprint,state,new_blocks):
+        """ Save the run state for a run with this fingerprint
+
+        state -- dictionary of the seed, pct_ci, sketch, number of completed
+                 blocks and random module state (rng_state)
+        new_blocks -- list of (relative change values array, batch confidence
+                 interval) tuples for the blocks completed since the last save
+                 (the interval is None for a short last block)
+
+        """
+        records = []
+        if self._length is None:
+            records.append(pack_record(CHECKPOINT_MAGIC,{'fingerprint':fingerprint,
+                                                         'seed':state['seed'],
+                                                         'pct_ci':state['pct_ci'],
+                                                         'sketch':state['sketch']}))
+            f = open(self.path,'wb')
+            self._length = 0
+        else:
+            f = open(self.path,'r+b')
+        records.append(pack_record(CHECKPOINT_MAGIC,{'blocks':state['blocks'],
+                                                     'values':[svmp._pack_array(rcs) for (rcs,ci) in new_blocks],
+                                                     'batch_cis':[ci for (rcs,ci) in new_blocks],
+                                                     'rng_state':state['rng_state']}))
+        data = "".join(records)
+        try:
+            # Write over any record cut short by a crash
+            f.seek(self._length)
+            f.truncate()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        self._length += len(data)
+
+    def load(self,fingerprint):
+        """ Run state saved in the checkpoint file
+
+        Returns None if there is no checkpoint file, otherwise a dictionary of
+        the seed, number of completed blocks, ConfIntAccumulator, batch confidence
+        intervals and random module state.  Raises ValueError if the file is not
+        a valid checkpoint, or is from a run with different stratum data or settings.
+
+        """
+        if not os.path.exists(self.path):
+            return None
+        (records,length) = read_records(self.path,CHECKPOINT_MAGIC)
+        if not records or 'fingerprint' not in records[0]:
+            raise ValueError("%s is not a Monte Carlo checkpoint file" % self.path)
+        settings = records[0]
+        if settings['fingerprint'] != fingerprint:
+            raise ValueError("Checkpoint file, %s, is from a run with different data or settings" % self.path)
+        accumulator = svmp.ConfIntAccumulator(settings['pct_ci'],settings['sketch'])
+        batch_cis = []
+        state = {'seed':settings['seed'],'blocks':0,'accumulator':accumulator,
+                 'batch_cis':batch_cis,'rng_state':None}
+        for record in records[1:]:
+            for (values,batch_ci) in zip(record['values'],record['batch_cis']):
+                accumulator.extend(svmp._unpack_array(values))
+                if batch_ci is not None:
+                    batch_cis.append(batch_ci)
+            state['blocks'] = record['blocks']
+            state['rng_state'] = record['rng_state']
+        self.seed = state['seed']
+        self.blocks = state['blocks']
+        self._length = length
+        return state
+
+    def remove(self):
+        """ Delete the checkpoint file (once the run is complete) """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def default_cache_folder():
+    """ Folder for the Monte Carlo result cache, in the user's temporary folder """
+    return os.path.join(tempfile.gettempdir(),"svmp_mc_cache")
+
+def code_version():
+    """ Hash of the Monte Carlo source code (svmp_93 and this module), so
+        cached results are not used after the calculations change
+    """
+    digest = hashlib.md5()
+    for module in (svmp,sys.modules[__name__]):
+        path = os.path.splitext(module.__file__)[0] + ".py"
+        try:
+            f = open(path,'rb')
+            try:
+                digest.update(f.read())
+            finally:
+                f.close()
+        except IOError:
+            # Compiled module only -- use the compiled file
+            f = open(module.__file__,'rb')
+            try:
+                digest.update(f.read())
+            finally:
+                f.close()
+    return digest.hexdigest()
+
+class ResultCache(object):
+    """ On-disk cache of Monte Carlo confidence interval results
+
+    Results are saved in a folder, one record file (see write_record) per
+    run, named by a hash of the run fingerprint (stratum site data, stratum
+    constants and settings, see run_fingerprint), the seed and the code
+    version.  A later run with the same inputs gets the saved
+    ConfIntAccumulator and CI standard error without running any iterations.
+
+    Reading a result updates its file time, and the least recently used
+    files are deleted when the folder is larger than max_bytes.
+
+    folder -- [optional] cache folder (default_cache_folder)
+    max_bytes -- [optional] maximum total size of the cached results
+    bypass -- [optional] if True, cached results are not used, but new
+              results are still saved (replacing any old result)
+
+    Attributes:
+    hit -- True if the last get found a cached result
+
+    """
+    def __init__(self,folder=None,max_bytes=CACHE_MAX_BYTES,bypass=False):
+        if folder is None:
+            folder = default_cache_folder()
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self.hit = False
+        self._code_version = None
+
+    def key(self,fingerprint,seed):
+        """ Cache key for a run """
+        if self._code_version is None:
+            self._code_version = code_version()
+        return hashlib.md5(repr((fingerprint,seed,self._code_version))).hexdigest()
+
+    def path(self,key):
+        return os.path.join(self.folder,key + CACHE_EXT)
+
+    def get(self,key):
+        """ Cached result for a key, or None """
+        self.hit = False
+        path = self.path(key)
+        if self.bypass or not os.path.exists(path):
+            return None
+        try:
+            result = read_record(path,CACHE_MAGIC,"Monte Carlo result cache")
+        except (ValueError,EnvironmentError,pickle.UnpicklingError,EOFError):
+            # Damaged file -- calculate the result again
+            self._remove(path)
+            return None
+        # Most recently used
+        os.utime(path,None)
+        self.hit = True
+        return result
+
+    def put(self,key,result):
+        """ Save a result, then delete old results if the cache is too large """
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        write_record(self.path(key),CACHE_MAGIC,result)
+        self.evict(self.path(key))
+
+    def evict(self,keep=None):
+        """ Delete the least recently used results until the cache is no
+            larger than max_bytes (the file keep is not deleted)
+        """
+        files = []
+        total = 0
+        for name in os.listdir(self.folder):
+            if not name.endswith(CACHE_EXT):
+                continue
+            path = os.path.join(self.folder,name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            files.append((info.st_mtime,path,info.st_size))
+            total += info.st_size
+        files.sort()
+        for (mtime,path,size) in files:
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                self._remove(path)
+                total -= size
+
+    def clear(self):
+        """ Delete all cached results """
+        if os.path.isdir(self.folder):
+            for name in os.listdir(self.folder):
+                if name.endswith(CACHE_EXT):
+                    self._remove(os.path.join(self.folder,name))
+
+    def _remove(self,path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+#-------------------------------------------------------------------------------
+#---------------------------------- PROGRESS -----------------------------------
+
+class MCProgress(object):
+    """ Progress and throughput messages for a Monte Carlo run
+
+    The Monte Carlo functions (mc_relative_change, mc_conf_int,
+    mc_conf_int_adaptive, mc_estimate_conf_int) call update after each
+    block of iterations, whatever the engine.  A message with the iterations
+    completed, iterations per second, estimated time remaining, running
+    confidence interval and peak memory is sent at most once every interval
+    seconds, and once more when the run is finished.
+
+    msg -- function for messages (e.g. gp.AddMessage)
+    total -- total (maximum) number of iterations
+    interval -- [optional] minimum seconds between messages
+    log_file -- [optional] timing log file (full path).  A comma-delimited
+                line is written for every block (see LOG_COLUMNS).
+    timer -- [optional] function that returns the time in seconds
+
+    Attributes:
+    iterations -- number of iterations completed
+    start_iterations -- iterations completed before this run (resumed runs)
+    elapsed -- seconds since the run started
+
+    """
+    LOG_COLUMNS = ["elapsed_s","block_s","iterations","iterations_per_s","ci","peak_memory_mb"]
+
+    def __init__(self,msg,total,interval=PROGRESS_INTERVAL,log_file=None,timer=time.time):
+        self.msg = msg
+        self.total = total
+        self.interval = interval
+        self.log_file = log_file
+        self.timer = timer
+        self.log = None
+        self.iterations = 0
+        self.start_iterations = 0
+        self.elapsed = 0.0
+        self.started = None
+
+    def start(self,iterations=0):
+        """ Start timing the run
+            iterations -- iterations already completed (resumed run)
+        """
+        self.iterations = iterations
+        self.start_iterations = iterations
+        self.started = self.timer()
+        self.last_block = self.started
+        self.last_message = self.started
+        if self.log_file:
+            self.log = open(self.log_file,'w')
+            self.log.write(",".join(self.LOG_COLUMNS) + "\n")
+
+    def update(self,n,ci=None):
+        """ Record a completed block of n iterations
+
+        ci -- [optional] function that returns the running confidence
+              interval.  It is only called for messages and log lines.
+
+        """
+        if self.started is None:
+            self.start()
+        now = self.timer()
+        self.iterations += n
+        self.elapsed = now - self.started
+        block_time = now - self.last_block
+        self.last_block = now
+        due = (now - self.last_message >= self.interval)
+        if not (due or self.log):
+            return
+        ci_value = None
+        if ci is not None:
+            ci_value = ci()
+        if self.log:
+            self.log.write("%r,%r,%i,%r,%s,%s\n" % (self.elapsed,block_time,self.iterations,self.rate(),
+                                                   _text(ci_value),_text(_megabytes(peak_memory()))))
+            self.log.flush()
+        if due:
+            self.last_message = now
+            self.msg(self.message(ci_value))
+
+    def finish(self,ci=None):
+        """ Final message, and close the timing log """
+        if self.started is None:
+            return
+        ci_value = None
+        if ci is not None and self.iterations > self.start_iterations:
+            ci_value = ci()
+        self.elapsed = self.timer() - self.started
+        self.msg(self.message(ci_value,True))
+        self.started = None
+        if self.log:
+            self.log.close()
+            self.log = None
+
+    def rate(self):
+        """ Iterations per second for this run """
+        if self.elapsed <= 0:
+            return 0.0
+        return (self.iterations - self.start_iterations) / self.elapsed
+
+    def eta(self):
+        """ Estimated seconds to finish all iterations (None if unknown) """
+        rate = self.rate()
+        if rate <= 0:
+            return None
+        return max(self.total - self.iterations,0) / rate
+
+    def message(self,ci_value=None,finished=False):
+        """ Progress message text """
+        if finished:
+            text = " Monte Carlo finished: %i iterations in %.1f s" % (self.iterations,self.elapsed)
+        else:
+            text = " Monte Carlo progress: %i of %i iterations" % (self.iterations,self.total)
+            if self.total:
+                text += " (%i%%)" % (100 * self.iterations // self.total)
+        text += ", %.0f iterations/s" % self.rate()
+        eta = self.eta()
+        if not finished and eta is not None:
+            text += ", time remaining %s" % _hms(eta)
+        if ci_value is not None:
+            text += ", CI %.6g" % ci_value
+        memory = _megabytes(peak_memory())
+        if memory is not None:
+            text += ", peak memory %.0f MB" % memory
+        return text
+
+def _text(value):
+    """ Log file text for a value that may be None (blank) """
+    if value is None:
+        return ""
+    return repr(value)
+
+def _hms(seconds):
+    """ h:mm:ss text for a number of seconds """
+    seconds = int(round(seconds))
+    return "%i:%02i:%02i" % (seconds // 3600,(seconds // 60) % 60,seconds % 60)
+
+def _megabytes(nbytes):
+    if nbytes is None:
+        return None
+    return nbytes / 1048576.0
+
+def peak_memory():
+    """ Peak memory use (bytes) of this process, or None if it is not available
+        Worker processes are not included.
+    """
+    if sys.platform == "win32":
+        if ctypes is None:
+            return None
+        counters = _ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        try:
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            if not ctypes.windll.psapi.GetProcessMemoryInfo(process,ctypes.byref(counters),counters.cb):
+                return None
+        except (AttributeError,OSError):
+            return None
+        return counters.PeakWorkingSetSize
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, Mac OS X bytes
+    if sys.platform == "darwin":
+        return maxrss
+    return maxrss * 1024
+
+if ctypes is not None:
+    class _ProcessMemoryCounters(ctypes.Structure):
+        """ PROCESS_MEMORY_COUNTERS structure (Windows psapi) """
+        _fields_ = [("cb",ctypes.c_ulong),
+                    ("PageFaultCount",ctypes.c_ulong),
+                    ("PeakWorkingSetSize",ctypes.c_size_t),
+                    ("WorkingSetSize",ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage",ctypes.c_size_t),
+                    ("QuotaPagedPoolUsage",ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage",ctypes.c_size_t),
+                    ("QuotaNonPagedPoolUsage",ctypes.c_size_t),
+                    ("PagefileUsage",ctypes.c_size_t),
+                    ("PeakPagefileUsage",ctypes.c_size_t)]
+
+#-------------------------------------------------------------------------------
+#------------------------------- CLASSIC ENGINE --------------------------------
+
+def mc_stratum(sd):
+    """
+    Perform sampling error (bootstrap) and measurement error simulations
+    to calculate area change statistics with simulated data from a single stratum
+
+    sd -- StratumMC object
+
+    """
+    # Bootstrap Sample (Sampling Error)
+    #  matching sites are resampled in pairs, with the same indices for both years
+    if sd.resample:
+        y1 = svmp.bootstrap(sd.y1_data)
+        (y1m,y2m) = sd.matched.bootstrap()
+    else:
+        y1 = sd.y1_data[:]
+        y1m = sd.matched.y1[:]
+        y2m = sd.matched.y2[:]
+    # Measurement Error - Simulated Zm area
+    me1 = svmp.measurement_error(y1)
+    me1m = svmp.measurement_error(y1m)
+    me2m = svmp.measurement_error(y2m)
+    # Calculate Change Analysis stats with Simulated Data
+    y1Samp  = svmp.SampleStats(me1,sd.stratum,sd.conversion)
+    y1mSamp = svmp.SampleStats(me1m,sd.stratum,sd.conversion)
+    y2mSamp = svmp.SampleStats(me2m,sd.stratum,sd.conversion)
+    change = svmp.ChangeStats(y1mSamp,y2mSamp,y1Samp)
+    return (y1Samp,y1mSamp,y2mSamp,change)
+
+def classic_blocks(strata,iterations,seed=None,start=0,rng_state=None,detail=False):
+    """ Relative change values, one iteration at a time, using the svmp classes
+        Generates lists of values for blocks of iterations
+    """
+    start_random(seed,rng_state)
+    columns = _new_columns(strata,detail)
+    for i in xrange(remaining_iterations(iterations,start)):
+        #--------- Monte Carlo Change calculations by Stratum
+        results = [mc_stratum(sd) for sd in strata]
+        #-- Monte Carlo All strata calculations - annual estimate and area change
+        # Annual Estimate for Year 1, All strata combined
+        y1_mcAnnualCalc = svmp.AnnualEstimate([r[0] for r in results])
+        # Area Change for all strata combined, Year 1 to Year 2
+        mc_zmChangeAll = svmp.ChangeStatsTotal([r[3] for r in results],y1_mcAnnualCalc)
+        #--- Store Relative Change value for each iteration
+        row = [mc_zmChangeAll.change_prop]
+        if detail:
+            for r in results:
+                row.extend([r[3].m,r[3].area_change])
+        for col,v in zip(columns,row):
+            col.append(v)
+        if len(columns[0]) == BLOCK_SIZE:
+            yield _block_output(columns,detail)
+            columns = _new_columns(strata,detail)
+    if columns[0]:
+        yield _block_output(columns,detail)
+
+#-------------------------------------------------------------------------------
+#------------------------------ VECTORIZED ENGINE ------------------------------
+
+def vectorized_blocks(strata,iterations,seed=None,legacy=False,workers=1,start=0,rng_state=None,detail=False,
+                      scheme=PLAIN):
+    """ Relative change values, calculated in blocks of iterations with NumPy arrays
+        Generates arrays of values, one for each block
+
+    legacy -- if True, random numbers come from the Python random module,
+              drawn in the same order as the classic engine.  The relative
+              changes then match the classic engine to within floating point
+              rounding (site areas are squared with a multiply instead of pow)
+    workers -- number of worker processes (1 calculates all blocks in this process)
+    start -- number of blocks already completed (resuming a run)
+    rng_state -- random module state after the completed blocks (legacy only)
+    scheme -- variance reduction scheme, not legacy (see draw_sources)
+
+    Otherwise, each block and stratum gets its own random number stream,
+    derived from the seed, so the results are the same for any number of workers.
+    With worker processes, each stratum of each block is a separate task
+    (run_stratum_block), so the strata are simulated at the same time, and
+    the stratum results for a block are combined in this process
+    (block_results).  A block then takes about as long as its slowest
+    stratum, and even a single block is shared between workers.
+
+    """
+    if numpy is None:
+        raise ImportError("NumPy is required for the vectorized Monte Carlo engine")
+    if legacy:
+        if workers > 1:
+            raise ValueError("The vectorized-legacy engine uses a single random number stream and cannot use worker processes")
+        start_random(seed,rng_state)
+        for (k,nb) in block_list(iterations)[start:]:
+            draws = legacy_block_draws(strata,nb,random)
+            results = [block_change(sd,d) for sd,d in zip(strata,draws)]
+            yield block_results(results,detail)
+        return
+
+    if seed is None:
+        seed = new_seed()
+    blocks = block_list(iterations)[start:]
+    if workers > 1:
+        tasks = [(j,k,nb,seed,scheme) for (k,nb) in blocks for j in range(len(strata))]
+        results = []
+        for result in parallel_blocks(strata,run_stratum_block,tasks,workers):
+            results.append(result)
+            if len(results) == len(strata):
+                yield block_results(results,detail)
+                results = []
+    else:
+        for (k,nb) in blocks:
+            yield run_block(strata,k,nb,seed,detail,scheme)
+
+def block_list(iterations):
+    """ List of (block number, number of iterations) covering all iterations """
+    blocks = []
+    done = 0
+    while done < iterations:
+        nb = min(BLOCK_SIZE,iterations - done)
+        blocks.append((len(blocks),nb))
+        done += nb
+    return blocks
+
+def new_seed():
+    """ A random seed, for runs where no seed is specified """
+    return random.SystemRandom().randint(0,2**31 - 1)
+
+def stream_seed(seed,*keys):
+    """ Seed for an independent random number stream
+
+    Derived from the run's seed and keys (block number, stratum number)
+    by hashing, so the same stream is produced wherever it is calculated
+
+    Returns a list of four 32-bit integers (numpy.random.RandomState seed)
+
+    """
+    text = ":".join([str(k) for k in (seed,) + keys])
+    return list(struct.unpack("<4I",hashlib.md5(text).digest()))
+
+def run_block(strata,k,nb,seed,detail=False,scheme=PLAIN):
+    """ Relative change values for block number k, with nb iterations """
+    results = []
+    for sd,source in zip(strata,draw_sources(strata,k,nb,seed,scheme)):
+        results.append(block_change(sd,block_draws(sd,nb,source)))
+    return block_results(results,detail)
+
+def run_stratum_block(strata,j,k,nb,seed,scheme=PLAIN):
+    """ Year 1 Zm area, slope and area change arrays (see block_change) for
+        stratum number j in block number k -- the same values as run_block
+    """
+    sd = strata[j]
+    source = draw_sources(strata,k,nb,seed,scheme)[j]
+    return block_change(sd,block_draws(sd,nb,source))
+
+#-------------------------------------------------------------------------------
+#--------------------------- PARALLEL (WORKER POOL) ----------------------------
+
+# Stratum data for a worker process, set once when the worker starts
+_worker_strata = None
+
+def _init_worker(strata):
+    """ Receive the stratum data (and constants) in a worker process """
+    global _worker_strata
+    _worker_strata = strata
+
+def _worker_block(args):
+    """ Calculate one block of iterations in a worker process """
+    function = args[0]
+    return function(_worker_strata,*args[1:])
+
+def parallel_blocks(strata,function,block_args,workers):
+    """ Values for a list of blocks, using a pool of worker processes
+
+    function -- block function, called as function(strata,*args)
+                (run_stratum_block or run_estimate_block)
+    block_args -- list of argument tuples, one for each block
+
+    The stratum data are sent to each worker once, when the pool is created.
+    Generates the value arrays, in block order
+
+    Only a few tasks per worker are queued at a time.  If the caller ends
+    early (adaptive stopping), the queued tasks are finished and the pool is
+    closed; workers are not terminated, since a worker stopped while sending
+    a result can leave the pool waiting forever.
+
+    """
+    if multiprocessing is None:
+        raise ImportError("The multiprocessing module (Python 2.6+) is required for worker processes")
+    # Inside ArcGIS, sys.executable is the ArcGIS application, not python
+    if sys.platform == "win32":
+        python_exe = os.path.join(sys.exec_prefix,"python.exe")
+        if os.path.exists(python_exe):
+            multiprocessing.set_executable(python_exe)
+    pool = multiprocessing.Pool(workers,_init_worker,(strata,))
+    pending = []
+    try:
+        for args in block_args:
+            pending.append(pool.apply_async(_worker_block,((function,) + args,)))
+            if len(pending) >= 2 * workers:
+                yield pending.pop(0).get()
+        while pending:
+            yield pending.pop(0).get()
+    finally:
+        pool.close()
+        pool.join()
+
+#-------------------------------------------------------------------------------
+#------------------------------- BLOCK FUNCTIONS -------------------------------
+
+def block_draws(sd,nb,rs):
+    """ Bootstrap indices and simulated Zm areas for a block of iterations
+
+    sd -- StratumMC object
+    nb -- number of iterations in the block
+    rs -- numpy.random.RandomState object, or a draw source (see draw_sources)
+
+    Returns a tuple of (iterations, n_sites) arrays, original units:
+    (y1 site indices, y1 simulated areas, y1m simulated areas, y2m simulated areas)
+    The simulated area arrays are buffers that are reused for the next block
+
+    """
+    if sd.resample:
+        idx1 = rs.randint(0,sd.n1,size=(nb,sd.n1))
+        idxm = rs.randint(0,sd.nm,size=(nb,sd.nm))
+    else:
+        idx1 = numpy.arange(sd.n1).reshape(1,sd.n1).repeat(nb,axis=0)
+        idxm = numpy.arange(sd.nm).reshape(1,sd.nm).repeat(nb,axis=0)
+    sim1 = svmp.truncated_normal_areas(sd.a_y1_areas[idx1],sd.a_y1_ses[idx1],sd.a_y1_p0s[idx1],
+                                       rs.random_sample(idx1.shape),sd.buffer('y1',idx1.shape))
+    sim1m = svmp.truncated_normal_areas(sd.a_y1m_areas[idxm],sd.a_y1m_ses[idxm],sd.a_y1m_p0s[idxm],
+                                        rs.random_sample(idxm.shape),sd.buffer('y1m',idxm.shape))
+    sim2m = svmp.truncated_normal_areas(sd.a_y2m_areas[idxm],sd.a_y2m_ses[idxm],sd.a_y2m_p0s[idxm],
+                                        rs.random_sample(idxm.shape),sd.buffer('y2m',idxm.shape))
+    return (idx1,sim1,sim1m,sim2m)
+
+def legacy_block_draws(strata,nb,rng):
+    """ Bootstrap indices and simulated Zm areas for a block of iterations,
+        drawn from a random.Random object (or the random module) in the same
+        order as the classic engine
+
+    Returns a list with one tuple per stratum, in the same form as block_draws
+
+    """
+    blocks = [([],[],[],[]) for sd in strata]
+    for i in xrange(nb):
+        for sd,blk in zip(strata,blocks):
+            idx1,sim1,sim1m,sim2m = iteration_draws(sd,rng)
+            blk[0].append(idx1)
+            blk[1].append(sim1)
+            blk[2].append(sim1m)
+            blk[3].append(sim2m)
+    return [tuple([numpy.array(a,dtype=d).reshape(nb,n) for a,d,n in
+                   zip(blk,(int,float,float,float),(sd.n1,sd.n1,sd.nm,sd.nm))])
+            for sd,blk in zip(strata,blocks)]
+
+def iteration_draws(sd,rng):
+    """ Bootstrap indices and simulated Zm areas for one stratum and iteration,
+        in the same order as the classic engine (mc_stratum)
+
+    sd -- StratumMC object
+    rng -- random.Random object (or the random module)
+
+    Returns a tuple of lists:
+    (Year 1 site indices, Year 1 simulated areas,
+     matching sites Year 1 simulated areas, matching sites Year 2 simulated areas)
+
+    """
+    if sd.resample:
+        idx1 = [rng.choice(sd.y1_index) for j in sd.y1_index]
+        idxm = [rng.choice(sd.m_index) for j in sd.m_index]
+    else:
+        idx1 = sd.y1_index
+        idxm = sd.m_index
+    sim1 = [_legacy_measurement_error(sd.y1_areas[j],sd.y1_ses[j],rng) for j in idx1]
+    sim1m = [_legacy_measurement_error(sd.y1m_areas[j],sd.y1m_ses[j],rng) for j in idxm]
+    sim2m = [_legacy_measurement_error(sd.y2m_areas[j],sd.y2m_ses[j],rng) for j in idxm]
+    return (idx1,sim1,sim1m,sim2m)
+
+def _legacy_measurement_error(zmArea,se,rng):
+    """ Simulated Zm area for one site, same as svmp.measurement_error """
+    return zmArea + (se * svmp.truncated_normal(zmArea,se,rng.random()))
+
+def _colsum(a):
+    """ Sum across the columns of a 2-d array, one column at a time
+        (same order of addition as the built-in sum of a site list)
+    """
+    total = numpy.zeros(a.shape[0])
+    for j in xrange(a.shape[1]):
+        total = total + a[:,j]
+    return total
+
+def block_change(sd,draws):
+    """ Slope and Year 1 Zm area estimate for a block of iterations
+
+    sd -- StratumMC object
+    draws -- tuple of arrays from block_draws
+
+    Returns a tuple of arrays, one value per iteration:
+    (Year 1 Zm area, slope, area change)
+
+    """
+    idx1,sim1,sim1m,sim2m = draws
+    x1 = sim1 * sd.area_factor
+    xs = sim1m * sd.area_factor
+    ys = sim2m * sd.area_factor
+    y1_area = _block_zm_area(sd,idx1,x1)
+    m = svmp.slope_from_sums(_colsum(xs ** 2),_colsum(xs * ys))
+    area_change = (m - 1) * y1_area
+    return (y1_area,m,area_change)
+
+def _block_zm_area(sd,idx,x):
+    """ Zm area estimate for each iteration, based on extrapolation type (SampleStats.zm_area) """
+    if sd.extrapolation == "area":
+        sum_a2j = _colsum(sd.a_y1_a2js[idx])
+    else:
+        sum_a2j = None
+    return svmp.zm_area_from_sums(sd.stratum,x.shape[1],_colsum(x),sum_a2j)
+
+def block_results(results,detail=False):
+    """ Relative change values for a block, with (detail only) the slope and
+        area change for each stratum, in the form generated by iter_relative_change
+    """
+    rc = block_relative_change(results)
+    if not detail:
+        return rc
+    columns = [rc]
+    for (s_area,m,s_change) in results:
+        columns.extend([m,s_change])
+    return columns
+
+def block_relative_change(results):
+    """ Soundwide relative change for each iteration (ChangeStatsTotal.change_prop)
+
+    results -- list of block_change tuples, one for each stratum
+
+    """
+    area_change = 0
+    y1_area = 0
+    for (s_area,m,s_change) in results:
+        area_change = area_change + s_change
+        y1_area = y1_area + s_area
+    return area_change / y1_area
+
+#-------------------------------------------------------------------------------
+#------------------------------ VARIANCE REDUCTION -----------------------------
+
+def draw_sources(strata,k,nb,seed,scheme=PLAIN):
+    """ Random number sources for block number k, one for each stratum
+
+    Each source has the two numpy.random.RandomState methods used by
+    block_draws (randint and random_sample), so it can be used in place of
+    a RandomState object:
+
+    plain -- the stratum's RandomState stream (see stream_seed)
+    antithetic -- AntitheticSource on the stratum's stream
+    sobol -- SobolSource with the stratum's columns of the block's Sobol points.
+             Each block gets its own random digital shift, so the blocks are
+             independent replicates of the same point set.
+
+    """
+    if scheme == SOBOL:
+        dims = [stratum_dimensions(sd) for sd in strata]
+        points = sobol_block(sum(dims),k,nb,seed)
+        sources = []
+        col = 0
+        for d in dims:
+            sources.append(SobolSource(points[:,col:col + d]))
+            col += d
+        return sources
+    sources = []
+    for j,sd in enumerate(strata):
+        rs = numpy.random.RandomState(stream_seed(seed,k,j))
+        if scheme == ANTITHETIC:
+            sources.append(AntitheticSource(rs))
+        elif scheme == PLAIN:
+            sources.append(rs)
+        else:
+            raise ValueError("Variance reduction scheme, %s, is not available" % scheme)
+    return sources
+
+def stratum_dimensions(sd):
+    """ Number of uniform random numbers used by block_draws for each
+        iteration of a stratum (the stratum's Sobol dimensions)
+    """
+    dims = sd.n1 + 2 * sd.nm
+    if sd.resample:
+        dims += sd.n1 + sd.nm
+    return dims
+
+def uniform_indices(u,n):
+    """ Site indices (0 to n - 1) from an array of uniform values in [0,1) """
+    return numpy.minimum((u * n).astype(int),n - 1)
+
+class AntitheticSource(object):
+    """ Antithetic uniform random numbers for a block of iterations
+
+    The first half of the rows of each array are drawn from a RandomState
+    object, and the second half are their mirror images (1 - u), so each
+    simulated area above its expected value is paired with one below it.
+    Bootstrap indices are taken from the uniform values, so resampled sites
+    are paired in the same way.
+
+    """
+    def __init__(self,rs):
+        self.rs = rs
+
+    def random_sample(self,shape):
+        nb = shape[0]
+        u = self.rs.random_sample(((nb + 1) // 2,) + tuple(shape[1:]))
+        # u may be 0, so keep 1 - u below 1 (see svmp.truncated_normal_areas)
+        mirror = numpy.minimum(1.0 - u,svmp.MAX_P)
+        return numpy.concatenate((u,mirror))[:nb]
+
+    def randint(self,low,high,size):
+        return low + uniform_indices(self.random_sample(size),high - low)
+
+class SobolSource(object):
+    """ Uniform values from a stratum's columns of a block of Sobol points
+
+    Each call to random_sample or randint takes the next columns (dimensions),
+    in the order used by block_draws
+
+    """
+    def __init__(self,points):
+        self.points = points
+        self.col = 0
+
+    def random_sample(self,shape):
+        ncols = shape[1]
+        u = self.points[:shape[0],self.col:self.col + ncols]
+        self.col += ncols
+        return u
+
+    def randint(self,low,high,size):
+        return low + uniform_indices(self.random_sample(size),high - low)
+
+# Sobol point sets (before the digital shift), saved for the blocks of a run
+_sobol_cache = {}
+
+def sobol_block(dims,k,nb,seed):
+    """ Randomized Sobol points for block number k, as an (nb, dims) array
+        of uniform values in (0,1)
+
+    All blocks of a run use the first nb points of the same Sobol sequence,
+    with direction numbers chosen at random from the seed.  Each block
+    applies its own random digital shift (XOR with a random integer for
+    each dimension), which makes the blocks independent.
+
+    """
+    key = (seed,dims,nb)
+    points = _sobol_cache.get(key)
+    if points is None:
+        if len(_sobol_cache) > 4:
+            _sobol_cache.clear()
+        rs = numpy.random.RandomState(stream_seed(seed,"sobol"))
+        points = sobol_points(sobol_directions(dims,rs),nb)
+        _sobol_cache[key] = points
+    rs = numpy.random.RandomState(stream_seed(seed,k,"sobol"))
+    shift = numpy.floor(rs.random_sample(dims) * 2.0 ** SOBOL_BITS).astype(points.dtype)
+    return (numpy.bitwise_xor(points,shift) + 0.5) / 2.0 ** SOBOL_BITS
+
+def sobol_points(directions,n):
+    """ First n points of a Sobol sequence (Gray code order), as an (n, dims)
+        array of SOBOL_BITS-bit integers
+
+    directions -- (SOBOL_BITS, dims) array of direction numbers
+
+    """
+    i = numpy.arange(n)
+    gray = i ^ (i >> 1)
+    points = numpy.zeros((n,directions.shape[1]),dtype=directions.dtype)
+    b = 0
+    while (1 << b) < n:
+        rows = ((gray >> b) & 1).astype(bool)
+        points[rows] ^= directions[b]
+        b += 1
+    return points
+
+def sobol_directions(dims,rs):
+    """ Direction numbers for a Sobol sequence, as a (SOBOL_BITS, dims) array
+
+    The first dimension is the van der Corput sequence.  Each other
+    dimension uses the next primitive polynomial over GF(2), with initial
+    direction numbers m_1 ... m_s (odd, m_k < 2 ** k) chosen at random
+    with the numpy.random.RandomState object rs.
+
+    """
+    directions = numpy.zeros((SOBOL_BITS,dims),dtype=numpy.uint32)
+    if dims == 0:
+        return directions
+    for kb in xrange(SOBOL_BITS):
+        directions[kb,0] = 1 << (SOBOL_BITS - 1 - kb)
+    for j,(s,poly) in enumerate(primitive_polynomials(dims - 1)):
+        m = []
+        for kb in xrange(1,SOBOL_BITS + 1):
+            if kb <= s:
+                mk = 2 * int(rs.random_sample() * 2 ** (kb - 1)) + 1
+            else:
+                # m_k = 2 a_1 m_(k-1) ^ 4 a_2 m_(k-2) ^ ... ^ 2**s m_(k-s) ^ m_(k-s)
+                mk = m[kb - s - 1] ^ (m[kb - s - 1] << s)
+                for i in xrange(1,s):
+                    if (poly >> (s - i)) & 1:
+                        mk ^= m[kb - i - 1] << i
+            m.append(mk)
+            directions[kb - 1,j + 1] = mk << (SOBOL_BITS - kb)
+    return directions
+
+# Primitive polynomials found so far, in order: (degree, polynomial)
+_primitive_polynomials = []
+
+def primitive_polynomials(count):
+    """ The first count primitive polynomials over GF(2), in order of degree
+        Returns a list of (degree, polynomial) tuples.  Bit i of a polynomial
+        is the coefficient of x ** i.
+
+    >>> primitive_polynomials(6)
+    [(1, 3), (2, 7), (3, 11), (3, 13), (4, 19), (4, 25)]
+
+    """
+    if _primitive_polynomials:
+        s,poly = _primitive_polynomials[-1]
+    else:
+        s,poly = (1,1)
+    while len(_primitive_polynomials) < count:
+        poly += 2
+        if poly >> (s + 1):
+            s += 1
+        if _gf2_is_primitive(poly,s):
+            _primitive_polynomials.append((s,poly))
+    return _primitive_polynomials[:count]
+
+def _gf2_is_primitive(poly,s):
+    """ True if x has order 2 ** s - 1 modulo poly (degree s, constant term 1) """
+    order = 2 ** s - 1
+    # x, reduced modulo poly
+    x = 2
+    if s == 1:
+        x = 1
+    if _gf2_pow(x,order,poly,s) != 1:
+        return False
+    for q in _prime_factors(order):
+        if _gf2_pow(x,order // q,poly,s) == 1:
+            return False
+    return True
+
+def _gf2_pow(a,e,poly,s):
+    """ a ** e modulo poly, for polynomials over GF(2) """
+    result = 1
+    while e:
+        if e & 1:
+            result = _gf2_mul(result,a,poly,s)
+        a = _gf2_mul(a,a,poly,s)
+        e >>= 1
+    return result
+
+def _gf2_mul(a,b,poly,s):
+    """ a * b modulo poly (degree s), for polynomials over GF(2) """
+    result = 0
+    while b:
+        if b & 1:
+            result ^= a
+        b >>= 1
+        a <<= 1
+        if (a >> s) & 1:
+            a ^= poly
+    return result
+
+def _prime_factors(n):
+    """ List of the distinct prime factors of n """
+    factors = []
+    q = 2
+    while q * q <= n:
+        if n % q == 0:
+            factors.append(q)
+            while n % q == 0:
+                n //= q
+        q += 1
+    if n > 1:
+        factors.append(n)
+    return factors
+
+#-------------------------------------------------------------------------------
+#-------------------------------- KERNEL ENGINE --------------------------------
+
+def kernel_stratum(sd,rng=random):
+    """ Year 1 Zm area estimate, slope and area change for one stratum and
+        iteration, calculated from sums of the simulated site values
+
+    sd -- StratumMC object
+    rng -- [optional] random.Random object (default is the random module)
+
+    Random numbers are used in the same order as mc_stratum
+
+    """
+    idx1,sim1,sim1m,sim2m = iteration_draws(sd,rng)
+    f = sd.area_factor
+    y1_area = _kernel_zm_area(sd,idx1,sim1)
+    xs = [x * f for x in sim1m]
+    ys = [y * f for y in sim2m]
+    x2sum = sum([x ** 2 for x in xs])
+    xysum = sum([x * y for x,y in zip(xs,ys)])
+    m = svmp.slope_from_sums(x2sum,xysum)
+    return (y1_area,m,(m - 1) * y1_area)
+
+def _kernel_zm_area(sd,idx,sim):
+    """ Zm area estimate from one iteration's simulated areas (original units) """
+    f = sd.area_factor
+    if sd.extrapolation == "area":
+        sum_a2j = sum([sd.y1_a2js[j] for j in idx])
+    else:
+        sum_a2j = None
+    return svmp.zm_area_from_sums(sd.stratum,len(idx),sum([x * f for x in sim]),sum_a2j)
+
+def kernel_blocks(strata,iterations,seed=None,start=0,rng_state=None,detail=False):
+    """ Relative change values, one iteration at a time, using the svmp
+        sufficient-statistics kernels.  Gives the same values as the classic
+        engine for the same seed, to within floating point rounding.
+        Generates lists of values for blocks of iterations
+    """
+    start_random(seed,rng_state)
+    columns = _new_columns(strata,detail)
+    for i in xrange(remaining_iterations(iterations,start)):
+        y1_area = 0
+        area_change = 0
+        row = [None]
+        for sd in strata:
+            s_area,m,s_change = kernel_stratum(sd)
+            y1_area += s_area
+            area_change += s_change
+            if detail:
+                row.extend([m,s_change])
+        row[0] = area_change / y1_area
+        for col,v in zip(columns,row):
+            col.append(v)
+        if len(columns[0]) == BLOCK_SIZE:
+            yield _block_output(columns,detail)
+            columns = _new_columns(strata,detail)
+    if columns[0]:
+        yield _block_output(columns,detail)
+
+#-------------------------------------------------------------------------------
+#------------------------ ANNUAL AREA ESTIMATE ENGINES -------------------------
+
+def mc_estimate_conf_int(strata,tolerance,max_iterations,pct_ci=0.95,engine=VECTORIZED,
+                         seed=None,workers=1,sketch=False,min_batches=MIN_BATCHES,progress=None):
+    """ Monte Carlo confidence interval for a soundwide Zm area estimate
+
+    Each iteration simulates sampling error (bootstrap, except strata without
+    extrapolation) and measurement error for every stratum, and adds up the
+    stratum Zm area estimates.  The confidence interval is calculated from
+    the simulated soundwide areas, in the same way as the change interval
+    (conf_int), so it is +/- a Zm area (square meters).
+
+    strata -- list of StratumMC objects, one for each stratum (estimate_stratum_mc)
+
+    Other parameters are the same as mc_conf_int_adaptive.  Adaptive
+    stopping is used if tolerance is not 0.
+
+    Returns a tuple of the ConfIntAccumulator object (its count is the number
+    of iterations used) and the standard error of the confidence interval
+
+    """
+    accumulator = svmp.ConfIntAccumulator(pct_ci,sketch)
+    batch_cis = []
+    ci_se = None
+    blocks = iter_area_estimate(strata,max_iterations,engine,seed,workers)
+    if progress is not None:
+        progress.start()
+    try:
+        for areas in blocks:
+            accumulator.extend(areas)
+            # Only full blocks are batches (see mc_conf_int_adaptive)
+            if len(areas) == BLOCK_SIZE:
+                batch_cis.append(svmp.conf_int(areas,pct_ci))
+            ci_se = batch_means_se(batch_cis)
+            if progress is not None:
+                progress.update(len(areas),accumulator.ci)
+            if ci_is_stable(accumulator,batch_cis,ci_se,tolerance,min_batches):
+                break
+    finally:
+        # Stop the engine (and any worker processes) if ending early
+        blocks.close()
+        if progress is not None:
+            progress.finish(accumulator.ci)
+    return (accumulator,ci_se)
+
+def iter_area_estimate(strata,iterations,engine=VECTORIZED,seed=None,workers=1):
+    """ Generates simulated soundwide Zm area values, one block of iterations at a time """
+    if engine == CLASSIC:
+        return iteration_blocks(classic_estimate,strata,iterations,seed)
+    elif engine == KERNEL:
+        return iteration_blocks(kernel_estimate,strata,iterations,seed)
+    elif engine in (VECTORIZED,VECTORIZED_LEGACY):
+        legacy = (engine == VECTORIZED_LEGACY)
+        return vectorized_estimate_blocks(strata,iterations,seed,legacy,workers)
+    else:
+        err_text = "Monte Carlo engine, %s, is not available" % engine
+        raise ValueError(err_text)
+
+def iteration_blocks(function,strata,iterations,seed=None):
+    """ Values of function(strata), calculated one iteration at a time
+        Generates lists of values for blocks of iterations
+    """
+    start_random(seed)
+    values = []
+    for i in xrange(iterations):
+        values.append(function(strata))
+        if len(values) == BLOCK_SIZE:
+            yield values
+            values = []
+    if values:
+        yield values
+
+def classic_estimate(strata):
+    """ Simulated soundwide Zm area for one iteration, using the svmp classes """
+    samples = []
+    for sd in strata:
+        # Bootstrap Sample (Sampling Error)
+        if sd.resample:
+            y1 = svmp.bootstrap(sd.y1_data)
+        else:
+            y1 = sd.y1_data[:]
+        # Measurement Error - Simulated Zm area
+        me1 = svmp.measurement_error(y1)
+        samples.append(svmp.SampleStats(me1,sd.stratum,sd.conversion))
+    return svmp.AnnualEstimate(samples).zm_area
+
+def kernel_estimate(strata):
+    """ Simulated soundwide Zm area for one iteration, from sums of the 
+        simulated site values.  Random numbers are used in the same order
+        as classic_estimate.
+    """
+    zm_area = 0
+    for sd in strata:
+        idx1,sim1,sim1m,sim2m = iteration_draws(sd,random)
+        zm_area += _kernel_zm_area(sd,idx1,sim1)
+    return zm_area
+
+def vectorized_estimate_blocks(strata,iterations,seed=None,legacy=False,workers=1):
+    """ Simulated soundwide Zm area values, calculated in blocks of iterations
+        with NumPy arrays.  Generates arrays of values, one for each block
+
+    Parameters are the same as vectorized_blocks
+
+    """
+    if numpy is None:
+        raise ImportError("NumPy is required for the vectorized Monte Carlo engine")
+    if legacy:
+        if workers > 1:
+            raise ValueError("The vectorized-legacy engine uses a single random number stream and cannot use worker processes")
+        start_random(seed)
+        for (k,nb) in block_list(iterations):
+            draws = legacy_block_draws(strata,nb,random)
+            yield block_area_estimate(strata,[d[:2] for d in draws])
+        return
+
+    if seed is None:
+        seed = new_seed()
+    blocks = block_list(iterations)
+    if workers > 1:
+        for areas in parallel_blocks(strata,run_estimate_block,[(k,nb,seed) for (k,nb) in blocks],workers):
+            yield areas
+    else:
+        for (k,nb) in blocks:
+            yield run_estimate_block(strata,k,nb,seed)
+
+def run_estimate_block(strata,k,nb,seed):
+    """ Simulated soundwide Zm area values for block number k, with nb iterations """
+    draws = []
+    for j,sd in enumerate(strata):
+        rs = numpy.random.RandomState(stream_seed(seed,k,j))
+        draws.append(block_sample_draws(sd,nb,rs))
+    return block_area_estimate(strata,draws)
+
+def block_sample_draws(sd,nb,rs):
+    """ Bootstrap indices and simulated Zm areas of the Year 1 sites (all sites)
+        for a block of iterations -- see block_draws
+
+    Returns a tuple of (iterations, n_sites) arrays: (site indices, simulated areas)
+
+    """
+    if sd.resample:
+        idx1 = rs.randint(0,sd.n1,size=(nb,sd.n1))
+    else:
+        idx1 = numpy.arange(sd.n1).reshape(1,sd.n1).repeat(nb,axis=0)
+    sim1 = svmp.truncated_normal_areas(sd.a_y1_areas[idx1],sd.a_y1_ses[idx1],sd.a_y1_p0s[idx1],
+                                       rs.random_sample(idx1.shape),sd.buffer('y1',idx1.shape))
+    return (idx1,sim1)
+
+def block_area_estimate(strata,draws):
+    """ Soundwide Zm area for each iteration (AnnualEstimate.zm_area)
+
+    draws -- list of (site indices, simulated areas) tuples, one for each stratum
+
+    """
+    zm_area = 0
+    for sd,(idx1,sim1) in zip(strata,draws):
+        zm_area = zm_area + _block_zm_area(sd,idx1,sim1 * sd.area_factor)
+    return zm_area
@@ -0,0 +1,1100 @@
+""" Shapefile and dBASE Table Reader for SVMP Tools Module """
+"""
+    svmp_shapefile.py
+    For: Washington DNR, Submerged Vegetation Monitoring Program (SVMP)
+    Requires: Python 2.5.1
+
+    Reads shapefiles (.shp, .shx, .dbf) and dBASE tables (.dbf) directly,
+    without the ArcGIS geoprocessor.  ShapefileReader has the parts of the
+    geoprocessor interface used by svmp_spatial_93 queries (ListFields,
+    Describe, SearchCursor), and supports the query ("where" clause)
+    expressions used by the SVMP tools.  HeadlessGP also provides tool
+    parameters and messages, so the tools can run where ArcGIS is not
+    available (with shapefile and dBASE inputs).
+
+    Files are memory mapped.  dBASE records are fixed width, so when a
+    cursor is given a list of fields, only those fields (and the fields
+    in the query) are decoded, by column, into typed arrays (Columns).
+
+    Geometry sizes are calculated from the shapefile coordinates:
+    polygon area by the shoelace formula (holes subtracted), and polyline
+    length as the sum of the segment lengths.
+"""
+
+import os
+import re
+import sys
+import math
+import mmap
+import itertools
+import array
+import struct
+import datetime
+
+# File extensions read directly
+SHAPEFILE_EXTS = (".shp",".dbf")
+
+# Shape types (shapefile specification), by the ArcGIS shape type name
+SHAPE_TYPES = {0:None,1:"Point",11:"Point",21:"Point",8:"Multipoint",18:"Multipoint",28:"Multipoint",
+               3:"Polyline",13:"Polyline",23:"Polyline",5:"Polygon",15:"Polygon",25:"Polygon",
+               31:"MultiPatch"}
+
+# Names of the fields added to the dBASE fields
+SHAPE_FIELD = "Shape"
+SHAPEFILE_OID = "FID"
+TABLE_OID = "OID"
+
+def is_shapefile(path):
+    """ True if path is an existing shapefile or dBASE table """
+    return os.path.splitext(path)[1].lower() in SHAPEFILE_EXTS and os.path.isfile(path)
+
+def _read_file(path):
+    f = open(path,'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def _map_file(path):
+    """ Read-only memory map of a file (or its contents, if it can't be mapped) """
+    f = open(path,'rb')
+    try:
+        try:
+            return mmap.mmap(f.fileno(),os.fstat(f.fileno()).st_size,access=mmap.ACCESS_READ)
+        except (EnvironmentError,ValueError):
+            # e.g. empty file
+            return f.read()
+    finally:
+        f.close()
+
+
+##------------------------------------------------------------------------------
+## ------------- TABLES ---------------------------------------------------------
+##------------------------------------------------------------------------------
+class DbfField(object):
+    """ Represents a dBASE field
+
+    Attributes:
+    Name -- field name
+    Type -- field type (ArcGIS name: String, Double, Integer, Date ...)
+    dbf_type -- dBASE type character (C, N, F, D, L ...)
+    offset -- position of the field in a record
+    length -- field width
+    decimals -- number of decimal places
+
+    """
+    def __init__(self,name,dbf_type,offset,length,decimals):
+        self.Name = name
+        self.dbf_type = dbf_type
+        self.offset = offset
+        self.length = length
+        self.decimals = decimals
+        if dbf_type in "NF":
+            if decimals or dbf_type == "F":
+                self.Type = "Double"
+            else:
+                self.Type = "Integer"
+        else:
+            self.Type = {"C":"String","D":"Date","L":"SmallInteger"}.get(dbf_type,"String")
+
+    def __repr__(self):
+        return repr((self.Name,self.dbf_type,self.length,self.decimals))
+
+    def value(self,record):
+        """ Value of the field in a record (string of the record's bytes) """
+        return self.decode(record[self.offset:self.offset + self.length])
+
+    def decode(self,text):
+        """ Value of the field from its text in a record """
+        dbf_type = self.dbf_type
+        if dbf_type == "C":
+            return text.rstrip(" \0")
+        text = text.strip(" \0")
+        if dbf_type in "NF":
+            if not text or text[0] == "*":
+                return None
+            if self.decimals == 0 and dbf_type == "N" and "." not in text:
+                try:
+                    return int(text)
+                except ValueError:
+                    pass
+            return float(text)
+        elif dbf_type == "D":
+            if not text.strip("0"):
+                return None
+            return datetime.datetime(int(text[:4]),int(text[4:6]),int(text[6:8]))
+        elif dbf_type == "L":
+            if text in ("Y","y","T","t"):
+                return True
+            elif text in ("N","n","F","f"):
+                return False
+            return None
+        return text
+
+    def column(self,texts):
+        """ Values of the field from a list of texts:
+            array('l') of integers or array('d') of doubles for a numeric
+            field with no missing values, otherwise a list
+        """
+        if self.dbf_type == "C":
+            return [t.rstrip(" \0") for t in texts]
+        if self.Type == "Integer" and self.length <= 9:
+            # int and float accept the space-padded text; blank values raise ValueError
+            try:
+                return array.array('l',map(int,texts))
+            except ValueError:
+                pass
+        elif self.Type == "Double":
+            try:
+                return array.array('d',map(float,texts))
+            except ValueError:
+                pass
+        values = [self.decode(t) for t in texts]
+        if self.Type in ("Integer","Double") and None not in values:
+            # int values wider than 9 digits may not fit in a C long
+            if self.Type == "Integer" and self.length <= 9:
+                try:
+                    return array.array('l',values)
+                except TypeError:
+                    pass
+            return array.array('d',values)
+        return values
+
+class DbfTable(object):
+    """ Represents a dBASE (.dbf) table, memory mapped
+
+    Records are read from their fixed-width positions in the file, so
+    reading a few fields (columns) only touches the bytes of those fields.
+
+    Attributes:
+    path -- full path to the .dbf file
+    fields -- list of DbfField objects
+    count -- number of records (including records marked as deleted)
+
+    """
+    def __init__(self,path):
+        self.path = path
+        self.data = _map_file(path)
+        (version,yy,mm,dd,self.count,self.header_length,
+         self.record_length) = struct.unpack("<BBBBIHH20x",self.data[:32])
+        # Don't read past the end of a truncated file
+        if self.record_length:
+            self.count = min(self.count,(len(self.data) - self.header_length) // self.record_length)
+        self.fields = []
+        offset = 1   # deletion flag
+        pos = 32
+        while pos + 32 <= self.header_length and self.data[pos] != "\r":
+            (name,dbf_type,length,decimals) = struct.unpack("<11sc4xBB14x",self.data[pos:pos + 32])
+            name = name.split("\0")[0]
+            self.fields.append(DbfField(name,dbf_type,offset,length,decimals))
+            offset += length
+            pos += 32
+
+    def record(self,i):
+        """ Bytes of record i (the first byte is the deletion flag) """
+        start = self.header_length + i * self.record_length
+        return self.data[start:start + self.record_length]
+
+    def deleted(self,record):
+        return record[:1] == "*"
+
+    def columns(self,fields):
+        """ Values of some fields for all records (not marked as deleted)
+
+        fields -- list of DbfField objects
+
+        Returns a tuple of the list of record numbers and a list of
+        the columns of values (DbfField.column), in the order of fields.
+
+        """
+        # Unpack only the projected fields from each record,
+        #  in record order, skipping the bytes in between
+        order = sorted([(f.offset,i) for (i,f) in enumerate(fields)])
+        fmt = "<c"
+        pos = 1
+        positions = {}
+        for (offset,i) in order:
+            field = fields[i]
+            if offset not in positions:
+                if offset > pos:
+                    fmt += "%ix" % (offset - pos)
+                fmt += "%is" % field.length
+                positions[offset] = len(positions) + 1
+                pos = offset + field.length
+        if self.record_length > pos:
+            fmt += "%ix" % (self.record_length - pos)
+        unpack = struct.Struct(fmt).unpack_from
+        data = self.data
+        start = self.header_length
+        size = self.record_length
+        records = [unpack(data,start + i * size) for i in xrange(self.count)]
+        # Skip deleted records
+        numbers = [i for (i,r) in enumerate(records) if r[0] != "*"]
+        if len(numbers) < len(records):
+            records = [records[i] for i in numbers]
+        if records:
+            texts = zip(*records)
+        else:
+            texts = [()] * (len(positions) + 1)
+        return (numbers,[f.column(texts[positions[f.offset]]) for f in fields])
+
+
+class ShapeFile(object):
+    """ Represents the geometry (.shp and .shx files) of a shapefile, memory mapped
+
+    Attributes:
+    path -- full path to the .shp file
+    shape_type -- ArcGIS shape type name (Polygon, Polyline, Point ...)
+    offsets -- list of the byte positions of the records (from the .shx file
+               or by reading through the .shp file)
+
+    """
+    def __init__(self,path):
+        self.path = path
+        self.data = _map_file(path)
+        (code,) = struct.unpack(">i",self.data[:4])
+        if code != 9994:
+            raise ValueError("%s is not a shapefile" % path)
+        (shape_type,) = struct.unpack("<i",self.data[32:36])
+        self.shape_type = SHAPE_TYPES.get(shape_type)
+        self.offsets = self._shx_offsets(os.path.splitext(path)[0]) or self._scan_offsets()
+
+    def _shx_offsets(self,base):
+        for ext in (".shx",".SHX"):
+            if os.path.isfile(base + ext):
+                shx = _read_file(base + ext)
+                n = (len(shx) - 100) // 8
+                words = struct.unpack(">%ii" % (2 * n),shx[100:100 + 8 * n])
+                return [2 * w for w in words[0::2]]
+        return None
+
+    def _scan_offsets(self):
+        offsets = []
+        pos = 100
+        end = len(self.data)
+        while pos + 8 <= end:
+            offsets.append(pos)
+            (number,length) = struct.unpack(">ii",self.data[pos:pos + 8])
+            pos += 8 + 2 * length
+        return offsets
+
+    def geometry(self,i):
+        """ Geometry object for record i """
+        pos = self.offsets[i]
+        (number,length) = struct.unpack(">ii",self.data[pos:pos + 8])
+        return Geometry(self.data[pos + 8:pos + 8 + 2 * length])
+
+
+class Geometry(object):
+    """ Represents the geometry of a shapefile record (as an ArcGIS geometry object)
+
+    Attributes:
+    type -- ArcGIS shape type name, or None for a null shape
+    Area -- polygon area (0 for other shapes)
+    Length -- polyline length or polygon perimeter (0 for other shapes)
+
+    """
+    def __init__(self,content):
+        self.content = content
+        (shape_type,) = struct.unpack("<i",content[:4])
+        self.type = SHAPE_TYPES.get(shape_type)
+        self._parts = None
+
+    def parts(self):
+        """ List of parts (rings or lines), each a tuple of (xs, ys) arrays """
+        if self._parts is None:
+            self._parts = []
+            if self.type in ("Polygon","Polyline"):
+                (num_parts,num_points) = struct.unpack("<ii",self.content[36:44])
+                starts = list(struct.unpack("<%ii" % num_parts,self.content[44:44 + 4 * num_parts]))
+                pos = 44 + 4 * num_parts
+                points = array.array('d')
+                points.fromstring(self.content[pos:pos + 16 * num_points])
+                if sys.byteorder != "little":
+                    points.byteswap()
+                for (start,end) in zip(starts,starts[1:] + [num_points]):
+                    self._parts.append((points[2 * start:2 * end:2],points[2 * start + 1:2 * end:2]))
+        return self._parts
+
+    @property
+    def Area(self):
+        if self.type != "Polygon":
+            return 0.0
+        # Outer rings are clockwise and holes counterclockwise,
+        #  so the signed ring areas add up to the polygon area
+        return abs(sum([_ring_area(xs,ys) for (xs,ys) in self.parts()]))
+
+    @property
+    def Length(self):
+        if self.type not in ("Polygon","Polyline"):
+            return 0.0
+        return sum([_line_length(xs,ys) for (xs,ys) in self.parts()])
+
+def _ring_area(xs,ys):
+    """ Signed area of a ring (shoelace formula), relative to its first point for precision """
+    if len(xs) < 3:
+        return 0.0
+    x0 = xs[0]
+    y0 = ys[0]
+    dx = [x - x0 for x in xs]
+    dy = [y - y0 for y in ys]
+    twice_area = sum([x1 * y2 - x2 * y1 for (x1,y1,x2,y2) in zip(dx,dy,dx[1:],dy[1:])])
+    return -twice_area / 2.0
+
+def _line_length(xs,ys):
+    """ Sum of the segment lengths of a line """
+    return sum([math.hypot(x2 - x1,y2 - y1) for (x1,y1,x2,y2) in zip(xs,ys,xs[1:],ys[1:])])
+
+
+class Table(object):
+    """ Represents a shapefile or dBASE table, with the fields as the
+    ArcGIS geoprocessor lists them (object id, shape and dBASE fields)
+
+    Attributes:
+    path -- full path to the .shp or .dbf file
+    dbf -- DbfTable
+    shapes -- ShapeFile (None for a dBASE table)
+    fields -- list of field objects
+
+    """
+    def __init__(self,path):
+        self.path = path
+        base = os.path.splitext(path)[0]
+        if path.lower().endswith(".shp"):
+            self.shapes = ShapeFile(path)
+            self.oid_field = SHAPEFILE_OID
+            dbf_path = base + ".dbf"
+            if not os.path.isfile(dbf_path):
+                dbf_path = base + ".DBF"
+        else:
+            self.shapes = None
+            self.oid_field = TABLE_OID
+            dbf_path = path
+        self.dbf = DbfTable(dbf_path)
+        self.fields = [DbfField(self.oid_field,"OID",0,0,0)]
+        self.fields[0].Type = "OID"
+        if self.shapes is not None:
+            shape = DbfField(SHAPE_FIELD,"SHAPE",0,0,0)
+            shape.Type = "Geometry"
+            self.fields.append(shape)
+        self.fields.extend(self.dbf.fields)
+        # Field lookup by upper case name (field names are not case sensitive)
+        self._field_lookup = {}
+        for field in self.dbf.fields:
+            self._field_lookup[field.Name.upper()] = field
+
+    def field(self,name):
+        """ DbfField object, or the object id or shape field name """
+        upper = name.upper()
+        if upper == self.oid_field.upper():
+            return self.oid_field
+        if self.shapes is not None and upper == SHAPE_FIELD.upper():
+            return SHAPE_FIELD
+        try:
+            return self._field_lookup[upper]
+        except KeyError:
+            raise ValueError("The field, %s, does not exist in %s" % (name,self.path))
+
+    def rows(self,query=""):
+        """ Generator of the Row objects that match a query ("where" clause) """
+        where = parse_where(query)
+        dbf = self.dbf
+        for i in xrange(dbf.count):
+            record = dbf.record(i)
+            if dbf.deleted(record):
+                continue
+            row = Row(self,i,record)
+            if where is None or where(row.getValue):
+                yield row
+
+    def columns(self,names,query=""):
+        """ Columns of the named fields for the records that match a query
+            Only the named fields and the fields in the query are read
+        """
+        where = parse_where(query)
+        names = list(names)
+        for name in (where and where.fields or []):
+            if name.upper() not in [n.upper() for n in names]:
+                names.append(name)
+        dbf_fields = []
+        for name in names:
+            field = self.field(name)
+            if isinstance(field,DbfField) and field not in dbf_fields:
+                dbf_fields.append(field)
+        (numbers,values) = self.dbf.columns(dbf_fields)
+        columns = {}
+        for (field,column) in zip(dbf_fields,values):
+            columns[field.Name.upper()] = column
+        result = Columns(self,numbers,columns)
+        if where is not None:
+            result = result.select(where)
+        return result
+
+
+class Columns(object):
+    """ Values of some fields of a table, by column
+
+    Attributes:
+    table -- Table
+    numbers -- list of the record numbers
+    columns -- dictionary of columns (array or list of values) by upper case field name
+
+    """
+    def __init__(self,table,numbers,columns):
+        self.table = table
+        self.numbers = numbers
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def column(self,name):
+        """ Values of a field (object id and shape fields are made when first used) """
+        upper = name.upper()
+        try:
+            return self.columns[upper]
+        except KeyError:
+            field = self.table.field(name)
+            if field == SHAPE_FIELD:
+                column = [self.table.shapes.geometry(i) for i in self.numbers]
+            elif isinstance(field,str):
+                column = self.numbers
+            else:
+                raise ValueError("The field, %s, was not read from %s" % (name,self.table.path))
+            self.columns[upper] = column
+            return column
+
+    def select(self,where):
+        """ Columns of the records that match a Predicate (parse_where) """
+        keep = where.select(self.column,len(self.numbers))
+        if len(keep) == len(self.numbers):
+            return self
+        columns = {}
+        for (name,values) in self.columns.items():
+            columns[name] = _take(values,keep)
+        return Columns(self.table,[self.numbers[i] for i in keep],columns)
+
+    def rows(self):
+        """ Generator of the ColumnRow objects """
+        for i in xrange(len(self.numbers)):
+            yield ColumnRow(self,i)
+
+def _take(values,indices):
+    """ Values at indices, of the same type (array or list) """
+    taken = [values[i] for i in indices]
+    if isinstance(values,array.array):
+        return array.array(values.typecode,taken)
+    return taken
+
+
+class Row(object):
+    """ Represents a record of a shapefile or dBASE table (as an ArcGIS row object) """
+    def __init__(self,table,index,record):
+        self.table = table
+        self.index = index
+        self.record = record
+
+    def getValue(self,name):
+        field = self.table.field(name)
+        if field == SHAPE_FIELD:
+            return self.table.shapes.geometry(self.index)
+        elif isinstance(field,str):
+            return self.index
+        return field.value(self.record)
+
+    GetValue = getValue
+
+
+class ColumnRow(object):
+    """ Represents a record in Columns (as an ArcGIS row object) """
+    def __init__(self,columns,index):
+        self.columns = columns
+        self.index = index
+
+    def getValue(self,name):
+        return self.columns.column(name)[self.index]
+
+    GetValue = getValue
+
+
+class Cursor(object):
+    """ Search cursor over the rows of a table (as an ArcGIS cursor) """
+    def __init__(self,rows):
+        self.rows = rows
+
+    def Next(self):
+        try:
+            return self.rows.next()
+        except StopIteration:
+            return None
+
+    next = Next
+
+
+##------------------------------------------------------------------------------
+## ------------- READER (geoprocessor interface) ------------------------------
+##------------------------------------------------------------------------------
+class SpatialReference(object):
+    """ Spatial reference of a shapefile, from its .prj file """
+    def __init__(self,path):
+        self.Type = "Unknown"
+        self.LinearUnitName = ""
+        prj_path = os.path.splitext(path)[0] + ".prj"
+        if os.path.isfile(prj_path):
+            wkt = _read_file(prj_path)
+            if wkt.startswith("PROJCS"):
+                self.Type = "Projected"
+                # Linear unit is the last UNIT of the projected coordinate system
+                units = re.findall(r'UNIT\["([^"]+)"',wkt)
+                if units:
+                    self.LinearUnitName = units[-1]
+            elif wkt.startswith("GEOGCS"):
+                self.Type = "Geographic"
+
+class Description(object):
+    """ Description of a shapefile or dBASE table (as gp.Describe) """
+    def __init__(self,table):
+        self.DataType = table.shapes is not None and "ShapeFile" or "DbaseTable"
+        if table.shapes is not None:
+            self.ShapeType = table.shapes.shape_type
+            self.ShapeFieldName = SHAPE_FIELD
+        self.OIDFieldName = table.oid_field
+        self.SpatialReference = SpatialReference(table.path)
+
+class ShapefileReader(object):
+    """ Reads shapefiles and dBASE tables with the parts of the
+    ArcGIS geoprocessor interface used by svmp_spatial_93 queries
+    """
+    def table(self,path):
+        if not is_shapefile(path):
+            raise ValueError("%s is not a shapefile or dBASE table" % path)
+        return Table(path)
+
+    def ListFields(self,path):
+        return self.table(path).fields
+
+    def Describe(self,path):
+        return Description(self.table(path))
+
+    def SearchCursor(self,path,query="",spatial_reference=None,fields=None):
+        """ Cursor of the rows that match a query
+            fields -- [optional] field names, separated by semicolons: only these
+                      fields are read (the values of other fields are not available)
+        """
+        table = self.table(path)
+        if fields is None:
+            return Cursor(table.rows(query))
+        names = [name.strip() for name in fields.split(";") if name.strip()]
+        return Cursor(table.columns(names,query).rows())
+
+    def Exists(self,path):
+        return is_shapefile(path)
+
+# Reader used by svmp_spatial_93 queries
+reader = ShapefileReader()
+
+
+class HeadlessGP(ShapefileReader):
+    """ Stand-in for the ArcGIS geoprocessor where ArcGIS is not available
+
+    Tool parameters are taken from the command line, messages are
+    written to standard output (errors and warnings to standard error),
+    and only shapefile and dBASE table inputs can be read.
+
+    """
+    def __init__(self,args):
+        self.args = list(args)
+        self.OverWriteOutput = False
+
+    def GetParameterAsText(self,i):
+        if i < len(self.args):
+            return self.args[i]
+        return ""
+
+    def AddMessage(self,msg):
+        print msg
+
+    def AddWarning(self,msg):
+        sys.stderr.write("WARNING: %s\n" % msg)
+
+    def AddError(self,msg):
+        sys.stderr.write("ERROR: %s\n" % msg)
+
+    def GetMessages(self,severity=0):
+        return ""
+
+
+##------------------------------------------------------------------------------
+## ------------- QUERY EXPRESSIONS ("where" clause) ------------------------------
+##------------------------------------------------------------------------------
+""" Query expressions are compiled into a Predicate: Python functions
+   that test a record with a field value function (e.g. Row.getValue),
+   or select the matching records from columns of values.  Supported:
+   comparisons (=, <>, <, <=, >, >=), [NOT] IN (...), [NOT] LIKE,
+   [NOT] BETWEEN ... AND ..., IS [NOT] NULL, AND, OR, NOT and parentheses.
+   Fields are "quoted", [bracketed] or plain names; values are 'strings',
+   numbers and dates (#mm-dd-yyyy# or date 'yyyy-mm-dd').  As in SQL,
+   comparisons with null values are unknown, and only records where the
+   expression is true match.  String comparisons are case sensitive (as
+   in shapefiles and file geodatabases).  QueryError is raised for an
+   expression that can't be read, or date values that can't be compared
+   without guessing their format (only yyyy-mm-dd text is read).
+"""
+
+class QueryError(ValueError):
+    """ Query expression, or a value in it, that can't be evaluated """
+    pass
+
+_TOKEN = re.compile(r"""\s*(?:
+    (?P<string>'(?:[^']|'')*')|
+    (?P<date>\#[^\#]*\#)|
+    (?P<field>"[^"]*"|\[[^\]]*\])|
+    (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|
+    (?P<op><>|!=|>=|<=|=|<|>|\(|\)|,)|
+    (?P<word>[A-Za-z_][A-Za-z0-9_.]*))""",re.VERBOSE)
+
+_KEYWORDS = ("AND","OR","NOT","IN","LIKE","BETWEEN","IS","NULL","DATE")
+
+def tokenize(query):
+    """ List of (kind, value) tokens in a query expression
+        kinds: value, field, op, keyword
+    """
+    tokens = []
+    pos = 0
+    query = query.rstrip()
+    while pos < len(query):
+        match = _TOKEN.match(query,pos)
+        if match is None:
+            raise QueryError("Query expression, %s, can't be read at: %s" % (query,query[pos:]))
+        pos = match.end()
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == "string":
+            tokens.append(("value",text[1:-1].replace("''","'")))
+        elif kind == "date":
+            tokens.append(("value",parse_date(text[1:-1])))
+        elif kind == "field":
+            tokens.append(("field",text[1:-1]))
+        elif kind == "number":
+            if "." in text or "e" in text or "E" in text:
+                tokens.append(("value",float(text)))
+            else:
+                tokens.append(("value",int(text)))
+        elif kind == "op":
+            if text == "!=":
+                text = "<>"
+            tokens.append(("op",text))
+        elif text.upper() in _KEYWORDS:
+            tokens.append(("keyword",text.upper()))
+        else:
+            tokens.append(("field",text))
+    return tokens
+
+def where_fields(query):
+    """ Names of the fields in a query expression """
+    if not query:
+        return []
+    return [value for (kind,value) in tokenize(query) if kind == "field"]
+
+# Query dates: mm-dd-yyyy, mm/dd/yyyy or yyyy-mm-dd, with optional
+#  hh:mm[:ss] [AM|PM]
+_QUERY_DATE = re.compile(r"""(?:(?P<month>\d{1,2})(?P<sep>[-/])(?P<day>\d{1,2})(?P=sep)(?P<year>\d{4})|
+    (?P<iso_year>\d{4})-(?P<iso_month>\d{1,2})-(?P<iso_day>\d{1,2}))
+    (?:[ T](?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2})(?:\.\d*)?)?
+    (?:\s*(?P<ampm>[AaPp][Mm]))?)?$""",re.VERBOSE)
+
+# Date text values: yyyy-mm-dd, with optional hh:mm[:ss]
+_ISO_DATE = re.compile(r"(\d{4})-(\d{2})-(\d{2})(?:[ T](\d{2}):(\d{2})(?::(\d{2})(?:\.\d*)?)?)?$")
+
+def parse_date(text):
+    """ datetime from a query date: mm-dd-yyyy (or mm/dd/yyyy, as in personal
+        geodatabase queries) or yyyy-mm-dd, with optional hh:mm:ss and AM or PM
+
+    >>> parse_date("12-31-2008"), parse_date("2008-07-01 12:30:00 AM")
+    (datetime.datetime(2008, 12, 31, 0, 0), datetime.datetime(2008, 7, 1, 0, 30))
+    >>> parse_date("7/1/2008 12:00:00 PM"), parse_date("07-01-2008 11:59 pm")
+    (datetime.datetime(2008, 7, 1, 12, 0), datetime.datetime(2008, 7, 1, 23, 59))
+
+    """
+    match = _QUERY_DATE.match(text.strip())
+    if match is None:
+        raise QueryError("Query date, %s, must be mm-dd-yyyy or yyyy-mm-dd" % text)
+    fields = match.groupdict()
+    if fields["year"]:
+        (year,month,day) = (fields["year"],fields["month"],fields["day"])
+    else:
+        (year,month,day) = (fields["iso_year"],fields["iso_month"],fields["iso_day"])
+    time = [int(fields[name] or 0) for name in ("hour","minute","second")]
+    if fields["ampm"]:
+        if not 1 <= time[0] <= 12:
+            raise QueryError("Query date, %s, has an hour outside 1 to 12 with AM or PM" % text)
+        # 12 AM is midnight, 12 PM is noon
+        time[0] = time[0] % 12
+        if fields["ampm"].upper() == "PM":
+            time[0] += 12
+    try:
+        return datetime.datetime(int(year),int(month),int(day),time[0],time[1],time[2])
+    except ValueError, err:
+        raise QueryError("Query date, %s: %s" % (text,err))
+
+def as_datetime(value):
+    """ datetime from a date value: datetime, yyyy-mm-dd text (as from some
+        geoprocessor cursors) or an object with year, month and day
+        Other date text (e.g. in a locale's format) raises QueryError, as
+        its day and month order isn't known
+    """
+    if value is None or isinstance(value,datetime.datetime):
+        return value
+    if isinstance(value,basestring):
+        match = _ISO_DATE.match(value.strip())
+        if match is None:
+            raise QueryError("Date value, %s, isn't in yyyy-mm-dd format" % value)
+        try:
+            return datetime.datetime(*[int(n or 0) for n in match.groups()])
+        except ValueError, err:
+            raise QueryError("Date value, %s: %s" % (value,err))
+    if hasattr(value,"year"):
+        return datetime.datetime(value.year,value.month,value.day,getattr(value,"hour",0),
+                                 getattr(value,"minute",0),getattr(value,"second",0))
+    return value
+
+def parse_where(query):
+    """ Predicate for a query expression, or None for an empty query
+        (compiled once for each expression)
+
+    >>> where = parse_where('"NAME" <> \\'\\' and "focus_stra" not in (\\'c\\',\\'pfl\\')')
+    >>> [where({"NAME":"fl01","focus_stra":f}.get) for f in ("x","pfl",None)]
+    [True, False, False]
+    >>> where = parse_where("(Y2008 = 1 or Y2008 = 8) and d >= #01-01-2008# and d <= #12-31-2008#")
+    >>> where({"Y2008":8,"d":datetime.datetime(2008,7,1)}.get), where({"Y2008":8,"d":None}.get)
+    (True, False)
+    >>> where({"Y2008":1,"d":"2008-07-01 00:00:00"}.get)
+    True
+    >>> parse_where("n like 'fl%' and not x is null")({"n":"fl01","x":0}.get)
+    True
+    >>> columns = {"n":["fl01","fr02",None],"Y2008":[1,8,0]}
+    >>> parse_where("not (n like 'fl%' or Y2008 = 0)").select(columns.get,3)
+    [1]
+
+    """
+    if not query or not query.strip():
+        return None
+    if query not in _predicates:
+        parser = _Parser(tokenize(query),query)
+        _predicates[query] = Predicate(parser.parse(),query)
+    return _predicates[query]
+
+# Compiled predicates, by query expression
+_predicates = {}
+
+class Predicate(object):
+    """ Represents a compiled query expression
+
+    The expression is translated to Python source, with one variable
+    for each field, and compiled into two functions: one for a record
+    and one for columns of values.
+
+    Attributes:
+    query -- the query expression
+    fields -- names of the fields in the expression
+    source -- Python source of the functions
+
+    """
+    def __init__(self,expression,query):
+        self.query = query
+        names = _Names()
+        test = expression.true(names)
+        self.fields = names.fields
+        variables = ["v%i" % i for i in range(len(self.fields))]
+        lines = ["def row(get):"]
+        for (variable,name) in zip(variables,self.fields):
+            lines.append("    %s = get(%r)" % (variable,name))
+        lines.append("    return %s" % test)
+        lines.append("def select(n,columns):")
+        lines.append("    return [i for (%s) in izip(xrange(n),*columns) if %s]" % (",".join(["i"] + variables),test))
+        self.source = "\n".join(lines) + "\n"
+        namespace = names.constants
+        namespace["izip"] = itertools.izip
+        namespace["as_datetime"] = as_datetime
+        exec compile(self.source,"<query: %s>" % query,"exec") in namespace
+        self._row = namespace["row"]
+        self._select = namespace["select"]
+
+    def __call__(self,get):
+        """ True if the record matches
+            get -- function of a field name that returns the record's value
+        """
+        return self._row(get)
+
+    def select(self,column,n):
+        """ List of the positions (0 to n - 1) of the records that match
+            column -- function of a field name that returns a sequence of n values
+        """
+        return self._select(n,[column(name) for name in self.fields])
+
+class _Names(object):
+    """ Python names for the fields (v0, v1 ...) and constants (k0, k1 ...) of an expression """
+    def __init__(self):
+        self.fields = []
+        self.constants = {}
+
+    def field(self,name):
+        if name not in self.fields:
+            self.fields.append(name)
+        return "v%i" % self.fields.index(name)
+
+    def constant(self,value):
+        name = "k%i" % len(self.constants)
+        self.constants[name] = value
+        return name
+
+# Expression objects:  true(names) and false(names) give the Python source
+#  for the expression being true, and false (not unknown, for nulls)
+
+class _Field(object):
+    def __init__(self,name):
+        self.name = name
+
+    def source(self,names,dates=False):
+        return _date_source(names.field(self.name),dates)
+
+    def not_null(self,names):
+        return ["%s is not None" % names.field(self.name)]
+
+class _Constant(object):
+    def __init__(self,value):
+        self.value = value
+
+    def source(self,names,dates=False):
+        return names.constant(self.value)
+
+    def not_null(self,names):
+        if self.value is None:
+            return ["False"]
+        return []
+
+def _join(op,terms):
+    if len(terms) == 1:
+        return terms[0]
+    return "(%s)" % (" %s " % op).join(terms)
+
+class _Logical(object):
+    """ AND or OR of several conditions """
+    def __init__(self,op,terms):
+        self.op = op
+        self.terms = terms
+
+    def true(self,names):
+        return _join(self.op,[term.true(names) for term in self.terms])
+
+    def false(self,names):
+        other = {"and":"or","or":"and"}[self.op]
+        return _join(other,[term.false(names) for term in self.terms])
+
+class _Not(object):
+    def __init__(self,term):
+        self.term = term
+
+    def true(self,names):
+        return self.term.false(names)
+
+    def false(self,names):
+        return self.term.true(names)
+
+class _Comparison(object):
+    """ Comparison of two operands (fields or constants), with a Python operator """
+    def __init__(self,left,op,right):
+        self.left = left
+        self.op = op
+        self.right = right
+
+    def _test(self,names,negate):
+        # Field values are compared to date constants as dates
+        dates = _dates([operand.value for operand in (self.left,self.right) if isinstance(operand,_Constant)])
+        test = "%s %s %s" % (self.left.source(names,dates),self.op,self.right.source(names,dates))
+        if negate:
+            test = "not (%s)" % test
+        return _join("and",self.left.not_null(names) + self.right.not_null(names) + [test])
+
+    def true(self,names):
+        return self._test(names,False)
+
+    def false(self,names):
+        return self._test(names,True)
+
+class _Condition(object):
+    """ Condition on an operand (IN, LIKE, BETWEEN)
+        test -- function of the operand source and names that gives the
+                source of the condition, for a value that isn't null
+    """
+    def __init__(self,operand,test,negate=False):
+        self.operand = operand
+        self.test = test
+        self.negate = negate
+
+    def _test(self,names,negate):
+        test = self.test(self.operand.source(names),names)
+        if negate:
+            test = "not (%s)" % test
+        return _join("and",self.operand.not_null(names) + [test])
+
+    def true(self,names):
+        return self._test(names,self.negate)
+
+    def false(self,names):
+        return self._test(names,not self.negate)
+
+class _IsNull(object):
+    def __init__(self,operand,negate=False):
+        self.operand = operand
+        self.negate = negate
+
+    def _test(self,names,negate):
+        if negate:
+            return "%s is not None" % self.operand.source(names)
+        return "%s is None" % self.operand.source(names)
+
+    def true(self,names):
+        return self._test(names,self.negate)
+
+    def false(self,names):
+        return self._test(names,not self.negate)
+
+class _Parser(object):
+    """ Recursive descent parser for query expressions """
+    def __init__(self,tokens,query):
+        self.tokens = tokens
+        self.query = query
+        self.pos = 0
+
+    def error(self,text):
+        raise QueryError("Query expression, %s: %s" % (self.query,text))
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None,None)
+
+    def take(self,kind=None,value=None):
+        token = self.peek()
+        if (kind is not None and token[0] != kind) or (value is not None and token[1] != value):
+            self.error("expected %s" % (value or kind))
+        self.pos += 1
+        return token
+
+    def accept(self,kind,value):
+        if self.peek() == (kind,value):
+            self.pos += 1
+            return True
+        return False
+
+    def parse(self):
+        expression = self.or_expr()
+        if self.pos != len(self.tokens):
+            self.error("unexpected %s" % (self.peek()[1],))
+        return expression
+
+    def or_expr(self):
+        terms = [self.and_expr()]
+        while self.accept("keyword","OR"):
+            terms.append(self.and_expr())
+        if len(terms) == 1:
+            return terms[0]
+        return _Logical("or",terms)
+
+    def and_expr(self):
+        terms = [self.not_expr()]
+        while self.accept("keyword","AND"):
+            terms.append(self.not_expr())
+        if len(terms) == 1:
+            return terms[0]
+        return _Logical("and",terms)
+
+    def not_expr(self):
+        if self.accept("keyword","NOT"):
+            return _Not(self.not_expr())
+        if self.accept("op","("):
+            expression = self.or_expr()
+            self.take("op",")")
+            return expression
+        return self.comparison()
+
+    def operand(self):
+        """ Field or constant """
+        if self.accept("keyword","DATE"):
+            return _Constant(parse_date(self.take("value")[1]))
+        (kind,value) = self.take()
+        if kind == "field":
+            return _Field(value)
+        elif kind == "value":
+            return _Constant(value)
+        self.error("expected a field or value, not %s" % value)
+
+    def constant(self):
+        if self.accept("keyword","DATE"):
+            return parse_date(self.take("value")[1])
+        return self.take("value")[1]
+
+    def comparison(self):
+        left = self.operand()
+        negate = self.accept("keyword","NOT")
+        (kind,value) = self.peek()
+        if (kind,value) == ("keyword","IN"):
+            self.pos += 1
+            self.take("op","(")
+            values = [self.constant()]
+            while self.accept("op",","):
+                values.append(self.constant())
+            self.take("op",")")
+            dates = _dates(values)
+            return _Condition(left,lambda v,names: "%s in %s" % (_date_source(v,dates),
+                                                                 names.constant(frozenset(values))),negate)
+        elif (kind,value) == ("keyword","LIKE"):
+            self.pos += 1
+            pattern = like_pattern(self.take("value")[1])
+            return _Condition(left,lambda v,names: "%s.match(%s) is not None" % (names.constant(pattern),v),negate)
+        elif (kind,value) == ("keyword","BETWEEN"):
+            self.pos += 1
+            low = self.constant()
+            self.take("keyword","AND")
+            high = self.constant()
+            dates = _dates([low,high])
+            return _Condition(left,lambda v,names: "%s <= %s <= %s" % (names.constant(low),_date_source(v,dates),
+                                                                       names.constant(high)),negate)
+        elif (kind,value) == ("keyword","IS") and not negate:
+            self.pos += 1
+            is_not = self.accept("keyword","NOT")
+            self.take("keyword","NULL")
+            return _IsNull(left,is_not)
+        elif kind == "op" and value in _COMPARE and not negate:
+            self.pos += 1
+            return _Comparison(left,_COMPARE[value],self.operand())
+        self.error("expected a comparison")
+
+def _dates(values):
+    """ True if any of the values is a date """
+    for value in values:
+        if isinstance(value,datetime.datetime):
+            return True
+    return False
+
+def _date_source(source,dates):
+    """ Source for a value, as a date if compared to dates """
+    if dates:
+        return "as_datetime(%s)" % source
+    return source
+
+# Python operators for the comparison operators
+_COMPARE = {"=":"==","<>":"!=","<":"<","<=":"<=",">":">",">=":">="}
+
+def like_pattern(text):
+    """ Regular expression for a LIKE pattern (% any characters, _ one character) """
+    pattern = ""
+    for c in text:
+        if c == "%":
+            pattern += ".*"
+        elif c == "_":
+            pattern += "."
+        else:
+            pattern += re.escape(c)
+    return re.compile(pattern + "$",re.DOTALL)
@@ -8,7 +8,206 @@
     Requires: Python 2.5.1
 """
 
-import arcgisscripting
+import os
+import sys
+try:
+    import arcgisscripting
+except ImportError:
+    arcgisscripting = None
+import svmp_shapefile
+
+# Aggregates for TableQuery.aggregate
+COUNT = "count"
+SUM = "sum"
+MIN = "min"
+MAX = "max"
+ROWS = "rows"
+
+# Read shapefile and dBASE table inputs directly (svmp_shapefile),
+#  rather than through the ArcGIS geoprocessor.  By default, only when
+#  ArcGIS isn't installed; set to True to use the reader with ArcGIS
+READ_SHAPEFILES = (arcgisscripting is None)
+
+def query_source(gp,tbl):
+    """ Object used to list the fields, describe and search a table:
+        the shapefile reader for shapefiles and dBASE tables (if READ_SHAPEFILES)
+        otherwise the geoprocessing object
+    """
+    if READ_SHAPEFILES and svmp_shapefile.is_shapefile(tbl):
+        return svmp_shapefile.reader
+    return gp
+
+def create_gp(version=9.3):
+    """ Creates the geoprocessing object
+        Without ArcGIS, a headless geoprocessor takes the tool parameters from
+        the command line, and reads shapefile and dBASE table inputs
+    """
+    if arcgisscripting is not None:
+        return arcgisscripting.create(version)
+    return svmp_shapefile.HeadlessGP(sys.argv[1:])
+
+# Queries on tables read with the shapefile reader use in-memory snapshots
+#  (TableSnapshot), so repeated queries on a table don't read it again.
+#  Set to True to also keep snapshots of tables read through the
+#  geoprocessor (e.g. personal and file geodatabase tables).  Snapshot
+#  queries are evaluated by svmp_shapefile, not by the database, so
+#  string comparisons are case sensitive (not as in personal geodatabases)
+SNAPSHOT_TABLES = False
+# Field types that aren't read into snapshots, except when queried
+SNAPSHOT_SKIP_TYPES = ("Geometry","Blob","Raster")
+
+def feature_class_stamp(fc):
+    """ Modification time and size of the files for a feature class 
+        Returns (shapefile or geodatabase path, modification time, size),
+        or None if the feature class isn't in a shapefile, dBASE table, 
+        personal geodatabase (.mdb) or file geodatabase (.gdb)
+    """
+    path = fc
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if not parent or parent == path:
+            return None
+        path = parent
+    extension = os.path.splitext(path)[1].lower()
+    if path == fc and extension == ".shp":
+        base = os.path.splitext(path)[0]
+        files = [path] + [base + ext for ext in (".dbf",".DBF",".shx",".SHX") if os.path.exists(base + ext)]
+    elif path == fc and extension == ".dbf":
+        files = [path]
+    elif extension == ".mdb" and os.path.isfile(path):
+        files = [path]
+    elif extension == ".gdb" and os.path.isdir(path):
+        files = [os.path.join(path,f) for f in os.listdir(path)]
+    else:
+        return None
+    stats = [os.stat(f) for f in files if os.path.isfile(f)]
+    return (path,max([st.st_mtime for st in stats]),sum([st.st_size for st in stats]))
+
+
+class TableSnapshot(object):
+    """ Represents an in-memory copy of some fields of a table
+    
+    A snapshot is read with one cursor.  Queries on a snapshot are 
+    compiled (svmp_shapefile.parse_where) and evaluated over the 
+    columns of values, without opening cursors.
+    
+    Attributes:
+    tbl -- full path to the table
+    stamp -- feature_class_stamp of the table when it was read
+    fields -- list of the field names in the snapshot
+    columns -- dictionary of the lists of values, by upper case field name
+    count -- number of records
+    selections -- dictionary of the record positions that match a query, by query
+    
+    """
+    def __init__(self,tbl,stamp,fields,columns):
+        self.tbl = tbl
+        self.stamp = stamp
+        self.fields = list(fields)
+        self.columns = dict(zip([fld.upper() for fld in fields],columns))
+        if columns:
+            self.count = len(columns[0])
+        else:
+            self.count = 0
+        self.selections = {}
+        
+    def __repr__(self):
+        return repr((self.tbl,self.fields,self.count))
+    
+    def has_fields(self,fields):
+        for fld in fields:
+            if fld.upper() not in self.columns:
+                return False
+        return True
+    
+    def column(self,fld):
+        return self.columns[fld.upper()]
+    
+    def select(self,query):
+        """ List of the positions of the records that match a query """
+        if query not in self.selections:
+            where = svmp_shapefile.parse_where(query)
+            if where is None:
+                self.selections[query] = range(self.count)
+            else:
+                self.selections[query] = where.select(self.column,self.count)
+        return self.selections[query]
+    
+    def cursor(self,query=""):
+        """ Cursor of the records that match a query """
+        return SnapshotCursor(self,self.select(query))
+
+class SnapshotRow(object):
+    """ Represents a record of a TableSnapshot (as an ArcGIS row object) """
+    def __init__(self,snapshot,index):
+        self.snapshot = snapshot
+        self.index = index
+        
+    def getValue(self,fld):
+        return self.snapshot.column(fld)[self.index]
+    
+    GetValue = getValue
+
+class SnapshotCursor(object):
+    """ Cursor of records of a TableSnapshot (as an ArcGIS search cursor) """
+    def __init__(self,snapshot,indices):
+        self.snapshot = snapshot
+        self.indices = iter(indices)
+        
+    def Next(self):
+        for index in self.indices:
+            return SnapshotRow(self.snapshot,index)
+        return None
+    
+    next = Next
+
+class TableSnapshots(object):
+    """ Cache of table snapshots
+    
+    Snapshots are kept for the life of the process, by table path (with
+    separate snapshots for feature queries, which have geometry sizes 
+    for the shape field).  A snapshot is read again when the table's 
+    files change (the feature_class_stamp changes), or when a query 
+    needs fields that aren't in it (then with all of the table's fields).
+    
+    Attributes:
+    snapshots -- dictionary of TableSnapshot objects, by (table path, feature query flag)
+    reads -- count of snapshots read
+    
+    """
+    def __init__(self):
+        self.snapshots = {}
+        self.reads = 0
+        
+    def snapshot(self,query,fields,stamp):
+        """ Snapshot with fields and the query fields, for a TableQuery """
+        key = (os.path.abspath(query.tbl),hasattr(query,'geom_type'))
+        where = svmp_shapefile.parse_where(query.query)
+        if where is not None:
+            fields = list(fields) + where.fields
+        current = self.snapshots.get(key)
+        if current is not None and current.stamp == stamp:
+            if current.has_fields(fields):
+                return current
+            # Read all of the value fields this time, so the snapshot 
+            #  isn't read again for other fields
+            fields = current.fields + list(fields) + [f.Name for f in query.source.ListFields(query.tbl)
+                                                      if getattr(f,'Type',None) not in SNAPSHOT_SKIP_TYPES]
+        # Unique field names (not case sensitive)
+        names = []
+        for fld in fields:
+            if fld.upper() not in [n.upper() for n in names]:
+                names.append(fld)
+        snapshot = TableSnapshot(query.tbl,stamp,names,query._snapshot_columns(names))
+        self.snapshots[key] = snapshot
+        self.reads += 1
+        return snapshot
+    
+    def clear(self):
+        self.snapshots = {}
+
+# Table snapshots used by TableQuery
+table_snapshots = TableSnapshots()
 
 
 class TableQuery(object):
@@ -22,6 +221,7 @@ class TableQuery(object):
     tbl -- full path to an ArcGIS table
     query -- [optional] an ArcGIS query string (the "where" clause)
     fields -- list of fields in feature class
+    source -- geoprocessing object or shapefile reader used for the queries
 
     """
     
@@ -29,6 +229,7 @@ class TableQuery(object):
         self.gp = gp
         self.tbl = tbl
         self.query = query 
+        self.source = query_source(gp,tbl)
         self.fields = self.get_field_list()
         
     def __repr__(self):
@@ -36,7 +237,7 @@ class TableQuery(object):
     
     def get_field_list(self):
         """ Fetch a list of the fields in the table """
-        fields = self.gp.ListFields(self.tbl)
+        fields = self.source.ListFields(self.tbl)
         field_list = [f.Name for f in fields]
         return field_list
     
@@ -44,14 +245,7 @@ class TableQuery(object):
     def record_count(self):
         """ Counts the number of queried records
         or all records if no query is provided """
-        rec_count = 0 # initialize count
-        records = self.gp.SearchCursor(self.tbl,self.query)
-        record = records.Next()
-        while record:
-            rec_count = rec_count + 1
-            record = records.Next()         
-        del record, records
-        return rec_count
+        return self.aggregate([(COUNT,)])[0]
     
     def field_results(self,field_list,unique=None):
         """ Gets the query results from the specified fields 
@@ -60,36 +254,158 @@ class TableQuery(object):
         the key, or a default automatically-generated numeric key
         
         """
-        results = {}  # initialize dictionary for all results       
-        records = self.gp.SearchCursor(self.tbl,self.query)
+        return self.aggregate([(ROWS,field_list,unique)])[0]
+    
+    def aggregate(self,aggregates):
+        """ Calculates several summaries of the queried records 
+        in one pass through the records
+        
+        aggregates -- list of tuples, one for each summary:
+          (COUNT,) -- count of records
+          (SUM,field), (MIN,field), (MAX,field) -- sum, minimum or maximum 
+                  of a numeric field, or of the shape field (area or length)
+          (COUNT,None,group_field), (SUM,field,group_field), ... -- 
+                  the same, as a dictionary by the value of group_field
+          (ROWS,field_list,key_field) -- a list of the field values for 
+                  each record, as a dictionary by key field (as field_results)
+        
+        Returns a list of the results, in the same order as aggregates.
+        Null values are left out of sums, minimums and maximums (as in SQL).
+        Minimum and maximum are None if there are no records.
+        
+        """
+        specs = []
+        results = []
+        for agg in aggregates:
+            (kind,field,group) = (tuple(agg) + (None,None))[:3]
+            if kind == ROWS:
+                fields = list(field)
+            elif kind in (SUM,MIN,MAX):
+                fields = [field]
+            elif kind == COUNT:
+                fields = []
+            else:
+                raise ValueError("Aggregate type, %s, is not available" % kind)
+            # Raise error if a field does not exist in the feature class
+            for fld in fields + [group]:
+                if fld is not None and fld not in self.fields:
+                    raise ValueError("The field, %s, does not exist in feature class, %s" % (fld,self.tbl))
+            specs.append((kind,field,group))
+            if group is not None or kind == ROWS:
+                results.append({})
+            elif kind == MIN or kind == MAX:
+                results.append(None)
+            else:
+                results.append(0)
+        
+        # Fields used by the aggregates
+        used = []
+        for (kind,field,group) in specs:
+            if kind == ROWS:
+                used.extend(field)
+            elif field is not None:
+                used.append(field)
+            if group is not None:
+                used.append(group)
+        records = self._records(used)
         record = records.Next()
         # initialize counter to use if no unique field provided for dictionary key
         row_id = 1 
         # Loop through all records in cursor
         while record:
-            if unique:
-                row_id = record.getValue(unique)
-            else:
-                row_id = row_id + 1
-            # loop through all fields in list
-            row_data = [] 
-            # Query each field for that row and add values to a list
-            for fld in field_list:
-                # Raise error if a field does not exist in the feature class
-                if fld not in self.fields:
-                    raise ValueError("The field, %s, does not exist in feature class, %s" % (fld,self.tbl))
-                # Geometry field query
-                if hasattr(self,'geom_type') and fld == self.shape_field:
-                    val = self._geometry_size(record)
-                # All other non-geometry fields
+            row_id = row_id + 1
+            values = {}   # field values for this record, each fetched once
+            for (i,(kind,field,group)) in enumerate(specs):
+                if kind == ROWS:
+                    if group:
+                        key = str(self._value(record,group,values))
+                    else:
+                        key = str(row_id)
+                    results[i][key] = [self._value(record,fld,values) for fld in field]
+                    continue
+                if group is None:
+                    current = results[i]
                 else:
-                    val = record.getValue(fld)
-                row_data.append(val)
-            # Add row results to complete query results list
-            results[str(row_id)] = row_data
+                    key = self._value(record,group,values)
+                    current = results[i].get(key)
+                    if current is None and kind != MIN and kind != MAX:
+                        current = 0
+                if kind == COUNT:
+                    current = current + 1
+                else:
+                    val = self._value(record,field,values)
+                    if val is None:
+                        pass
+                    elif kind == SUM:
+                        current = current + val
+                    elif current is None or (kind == MIN and val < current) or (kind == MAX and val > current):
+                        current = val
+                if group is None:
+                    results[i] = current
+                else:
+                    results[i][key] = current
             record = records.Next()
         del record, records
         return results
+    
+    def _records(self,fields):
+        """ Cursor of the queried records, with (at least) the values of fields
+        From a table snapshot for the shapefile reader (or any table, if
+        SNAPSHOT_TABLES) when the table's files can be checked for changes,
+        otherwise from a search cursor.  A search cursor is also used if the
+        query can't be evaluated on a snapshot (e.g. dates that aren't in 
+        yyyy-mm-dd format), so the geoprocessor evaluates it.
+        """
+        if SNAPSHOT_TABLES or isinstance(self.source,svmp_shapefile.ShapefileReader):
+            stamp = feature_class_stamp(self.tbl)
+            if stamp is not None:
+                try:
+                    return table_snapshots.snapshot(self,fields,stamp).cursor(self.query)
+                except svmp_shapefile.QueryError:
+                    pass
+        return self._search_cursor(self.query,fields)
+
+    def _search_cursor(self,query,fields):
+        if isinstance(self.source,svmp_shapefile.ShapefileReader):
+            # Read only the fields used
+            return self.source.SearchCursor(self.tbl,query,None,";".join(fields))
+        return self.source.SearchCursor(self.tbl,query)
+
+    def _snapshot_columns(self,fields):
+        """ Lists of the values of fields for all records, read with one cursor
+        (geometry sizes for the shape field)
+        """
+        if isinstance(self.source,svmp_shapefile.ShapefileReader):
+            # Shapefiles and dBASE tables are read by column
+            table_columns = self.source.table(self.tbl).columns(fields)
+            columns = []
+            for fld in fields:
+                if hasattr(self,'geom_type') and fld == self.shape_field:
+                    columns.append([self._geometry_size(row) for row in table_columns.rows()])
+                else:
+                    columns.append(table_columns.column(fld))
+            return columns
+        columns = [[] for fld in fields]
+        records = self._search_cursor("",fields)
+        record = records.Next()
+        while record:
+            values = {}
+            for (column,fld) in zip(columns,fields):
+                column.append(self._value(record,fld,values))
+            record = records.Next()
+        del record, records
+        return columns
+
+    def _value(self,record,fld,values):
+        """ Value of a field in the current record (saved in the values dictionary) """
+        if fld not in values:
+            # Geometry field query (snapshots have the geometry size)
+            if hasattr(self,'geom_type') and fld == self.shape_field and not isinstance(record,SnapshotRow):
+                values[fld] = self._geometry_size(record)
+            # All other non-geometry fields
+            else:
+                values[fld] = record.getValue(fld)
+        return values[fld]
 
     
 class FeatureQuery(TableQuery):
@@ -112,14 +428,14 @@ class FeatureQuery(TableQuery):
     def __init__(self,gp,fc,query=""):
         TableQuery.__init__(self,gp,fc,query)
         self.fc = self.tbl
-        self.geom_type = self.gp.Describe(self.fc).ShapeType
-        self.shape_field = self.gp.Describe(self.fc).ShapeFieldName
+        self.geom_type = self.source.Describe(self.fc).ShapeType
+        self.shape_field = self.source.Describe(self.fc).ShapeFieldName
                 
     def get_linear_units(self): 
         """ Fetches the linear units of the feature class """
-        prjType = self.gp.Describe(self.fc).SpatialReference.Type
+        prjType = self.source.Describe(self.fc).SpatialReference.Type
         if prjType == "Projected":
-            return self.gp.Describe(self.fc).SpatialReference.LinearUnitName
+            return self.source.Describe(self.fc).SpatialReference.LinearUnitName
         elif prjType == "Geographic":
             return "Degrees"
         else:
@@ -128,16 +444,7 @@ class FeatureQuery(TableQuery):
     @property
     def geometry_sum(self):
         """ Sums the values for the geometry (Area or Length)"""
-        geom_sum = 0 # initialize sum
-        # Create a Search Cursor with the feature class and query text
-        records = self.gp.SearchCursor(self.fc,self.query)
-        record = records.Next()
-        # loop through all records and sum the geometry value
-        while record:
-            geom_sum = geom_sum + self._geometry_size(record)
-            record = records.Next()
-        del record,records  # get rid of cursors      
-        return geom_sum
+        return self.aggregate([(SUM,self.shape_field)])[0]
         
     def _geometry_size(self,record):
         """ Gets a size value from the current record in the geometry field for 
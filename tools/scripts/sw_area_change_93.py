@@ -12,7 +12,8 @@ Requires: Python 2.5.1
 
 This script calculates soundwide Zostera marina area change estimates
 between two (usually) consecutive survey years.
-Calculates Monte Carlo 95% Confidence Intervals (20,000 iterations)
+Calculates Monte Carlo 95% Confidence Intervals (20,000 iterations, 
+or fewer when an adaptive stopping tolerance is given)
 
 # Parameters:
 INPUT
@@ -22,19 +23,50 @@ INPUT
 (4) fringeFC -- ArcGIS feature class for fringe sites (full path)
 (5) year1 -- First Survey year for data to be processed
 (6) year2 -- Second survey year for the data to be processed
+(7) sample_group -- soundwide or other data grouping.  soundwide is only option currently implemented
 OUTPUT
-(7) outFileStratum -- Output file name for Area Estimates by Stratum (full path)
-(8) outFileAll -- Output file name for Area Estimates for All Strata Combined (full path)
-(9) outFileRC -- Output file name for Monte Carlo Relative Change values (full path) -- not currently being used
+(8) outFileStratum -- Output file name for Area Estimates by Stratum (full path)
+(9) outFileAll -- Output file name for Area Estimates for All Strata Combined (full path)
+(10) outFileRC -- [optional] Output file name for Monte Carlo Relative Change values (full path)
+                  Binary NumPy .npy file, one record per iteration (the name must end in .npy)
+MONTE CARLO OPTIONS
+(11) mc_engine -- [optional] Monte Carlo engine: classic, vectorized, vectorized-legacy or kernel
+                  (default is vectorized if NumPy is available, otherwise kernel)
+(12) mc_seed -- [optional] Random number seed, for repeatable Monte Carlo results
+(13) mc_workers -- [optional] Number of worker processes for the vectorized engine
+                   (default 1; 0 uses one worker per processor)
+(14) mc_tolerance -- [optional] Adaptive stopping tolerance: stop when the standard error
+                   of the 95% CI, relative to the CI, is at or below this value (e.g. 0.01)
+                   (default: no adaptive stopping)
+(15) mc_max_iterations -- [optional] Maximum number of Monte Carlo iterations (default 20,000)
+(16) mc_resume -- [optional] true to resume an interrupted Monte Carlo run from its checkpoint
+                  file (default false).  The checkpoint is saved next to outFileAll, with
+                  the extension .mcchk, and deleted when the run is complete.
+(17) outFileRC_detail -- [optional] true to include the slope and area change for each
+                  stratum in outFileRC (default false)
+(18) mc_variance_reduction -- [optional] Variance reduction scheme for the vectorized engine:
+                  plain, antithetic or sobol (default plain).  See mc_benchmark.py
+                  for a comparison of the schemes.
+(19) outFileTiming -- [optional] Output file name for a Monte Carlo timing log (full path)
+                  Comma-delimited text, one line per block of iterations: elapsed time,
+                  block time, iterations, iterations per second, running CI, peak memory
+(20) mc_cache_bypass -- [optional] true to recalculate the Monte Carlo CI even if a cached
+                  result is available (default false).  Results of runs with a seed
+                  (and without outFileRC) are cached in the svmp_mc_cache folder in
+                  the temporary folder, and reused by runs with the same inputs.
+(21) stratum_cache -- [optional] true to save the stratum constants (Ni, A2, LT) in a sidecar
+                  file next to the flats and fringe feature classes (extension .svmpconst),
+                  and reuse them in later runs while the feature classes are unchanged
+                  (default false)
 
 
 
 """
 
 import sys
-import arcgisscripting
 import svmp_93 as svmp 
 import svmp_spatial_93 as spatial
+import svmp_mc_93 as mc
 import svmpUtils as utils
 from svmp_exceptions import SvmpToolsError
 
@@ -100,7 +132,7 @@ def sites_data(gp,sites,year,table):
     results = query_results(gp,table,return_fields,query_string,siteid_field)
     return results
 
-def missing_site_check(master_list,sites2check,table,year):
+def missing_site_check(e,master_list,sites2check,table,year):
     """ Checks for missing sites based on a master list 
         Generates error text and calls error object if missing
     """
@@ -115,13 +147,217 @@ def strata_lookup(sites_strata,lookup_dict):
     """Create dictionary of extrapolation type by site id
        using lookup from analysis/geo stratum to 
        determine analysis and extrapolation type
+       (site lists are sorted by site id, so they do not depend on query order)
     """
     site_extrap = {}
     for (siteid,data) in sites_strata.items():
         site_extrap[siteid] = lookup_dict[tuple(data)]
     # invert this dictionary to get sites by extrapolation/analysis stratum
     extrap_site = invert_dict(site_extrap)
+    for site_list in extrap_site.values():
+        site_list.sort()
     return extrap_site
+
+def stratum_cache(stratum_cache):
+    """ StratumConstants cache from the stratum_cache parameter text
+        (saved to sidecar files if "true", otherwise in memory only)
+    """
+    return svmp.StratumConstants(persist=(stratum_cache.lower() == "true"))
+
+def query_list(sites):
+    """ List of site ids for use in query strings: 'site1','site2','site5' """
+    return "'" + "\',\'".join(sites) + "'" 
+
+def flats_sample_areas(gp,flatsFC,fl_sites):
+    """ Dictionary of rotational flats sites with their sample area from flats.shp """
+    siteid_field = utils.sitePtIDCol   # NAME    
+    # query will look something like this: NAME in ('site1','site2','site5')
+    query_string = "%s in (%s)" % (siteid_field, query_list(fl_sites))
+    flats_query = spatial.FeatureQuery(gp,flatsFC,query_string)
+    return flats_query.field_results([flats_query.shape_field],siteid_field)
+
+def add_samplearea(flats_data,flats_a2j):
+    """ Append the sample area to the rest of the site data (rotational flats only) """
+    for site in flats_data:
+        a2j = flats_a2j[site[0]][0]
+        site.append(a2j)
+    return flats_data
+
+class YearSites(object):
+    """ Site data for all sites sampled in one survey year
+    
+    The queries are done once, when the object is created.  Site data for 
+    the matching sites in a pair of years is taken from the YearSites
+    objects for the two years (see pair_site_data)
+    
+    Attributes:
+    year -- survey year
+    sites_strata -- dictionary of [geo stratum, sample stratum] by site id
+    sites -- sorted list of site ids
+    data -- dictionary of [site id, Zm area, Zm area variance] by site id
+    flats_a2j -- dictionary of sample area by site id (rotational flats sites)
+    
+    """
+    def __init__(self,gp,year,allsitesFC,siteTable,flatsFC,sample_group):
+        self.year = year
+        gp.AddMessage("-- Site Queries for %s" % year)
+        gp.AddMessage(" Querying the All Sites Feature Class:\n  %s" % allsitesFC)
+        self.sites_strata = sites_strata(gp,allsitesFC,sample_group,year)
+        self.sites = sorted(self.sites_strata.keys())
+        # Get data from site stats database table
+        gp.AddMessage(" Querying the Sites Statistics Table:\n  %s" % siteTable)
+        self.data = sites_data(gp,query_list(self.sites),year,siteTable)
+        # Get the sample area (from flats shapefile) for rotational flats sites
+        gp.AddMessage(" Querying flats shapefile for sample area:\n  %s" % flatsFC)
+        extrap_sites = strata_lookup(self.sites_strata,svmp.sw_Stratum4AreaChgCalcs)
+        self.flats_a2j = flats_sample_areas(gp,flatsFC,extrap_sites[svmp.fl_extrap])
+
+    def grouped_data(self,extrap_sites,strata=None):
+        """ Copies of the site data, grouped into lists by analysis/extrapolation type
+            (rotational flats sites have their sample area appended)
+            strata -- analysis/extrapolation types (default CHANGE_STRATA)
+        """
+        if strata is None:
+            strata = CHANGE_STRATA
+        grouped = {}
+        for extrap in strata:
+            dat = [vals[:] for vals in group_data_by_extrap(extrap_sites,extrap,self.data)]
+            if extrap == svmp.fl_extrap:
+                dat = add_samplearea(dat,self.flats_a2j)
+            grouped[extrap] = dat
+        return grouped
+
+def pair_site_data(e,siteTable,y1_sites,y2_sites):
+    """ Site data by analysis stratum for the change analysis between two years
+    
+    e -- SvmpToolsError object
+    siteTable -- Site statistics table (for error messages)
+    y1_sites -- YearSites object for Year 1
+    y2_sites -- YearSites object for Year 2
+    
+    Returns a dictionary with a tuple of site data lists for each
+    analysis/extrapolation type: (Year 1 all sites, Year 1 matching sites,
+    Year 2 matching sites)
+    
+    """
+    year1 = y1_sites.year
+    year2 = y2_sites.year
+    #----------------- MATCHING SITES sampled in YEARS 1 & 2 -----------------------
+    # Sites sampled in both years and their strata
+    sites_strata_2yr = {}
+    for site in y1_sites.sites:
+        if site in y2_sites.sites_strata:
+            sites_strata_2yr[site] = y1_sites.sites_strata[site]
+    sites2yr = sorted(sites_strata_2yr.keys())
+    # Check for missing sites in sites stats DB query results
+    missing_site_check(e,sites2yr,y1_sites.data.keys(),siteTable,year1)
+    missing_site_check(e,sites2yr,y2_sites.data.keys(),siteTable,year2)
+    # Sites grouped by extrapolation type
+    extrap_sites2yr = strata_lookup(sites_strata_2yr,svmp.sw_Stratum4AreaChgCalcs)
+    y1m = y1_sites.grouped_data(extrap_sites2yr)
+    y2m = y2_sites.grouped_data(extrap_sites2yr)
+    #----------------------- ALL SITES sampled in YEAR 1 ---------------------------
+    missing_site_check(e,y1_sites.sites,y1_sites.data.keys(),siteTable,year1)
+    extrap_sites_y1 = strata_lookup(y1_sites.sites_strata,svmp.sw_Stratum4AreaChgCalcs)
+    y1 = y1_sites.grouped_data(extrap_sites_y1)
+    
+    site_data = {}
+    for extrap in CHANGE_STRATA:
+        site_data[extrap] = (y1[extrap],y1m[extrap],y2m[extrap])
+    return site_data
+
+#-------------- CALCULATIONS ---------------------------------
+# Analysis strata for change calculations, in output order
+CHANGE_STRATA = (svmp.core_extrap,svmp.fl_extrap,svmp.fr_extrap,svmp.frw_extrap)
+CHANGE_STRATA_LABELS = ("Core","Rotational Flats","Fringe","Wide Fringe")
+
+def change_strata(gp,flatsFC,fringeFC,unit_convert,cache=None):
+    """ Stratum objects for core, rotational flats, fringe and wide fringe
+        The stratum constants are queried once, and shared by all samples
+        cache -- [optional] svmp.StratumConstants cache (default: in memory only)
+    """
+    coreStratum = svmp.BaseStratum(svmp.core_extrap[0],svmp.core_extrap[1])
+    flatsStratum = svmp.FlatsStratum(svmp.fl_extrap[0],svmp.fl_extrap[1],gp,flatsFC,unit_convert,cache)
+    fringeStratum = svmp.FringeStratum(svmp.fr_extrap[0],svmp.fr_extrap[1],gp,fringeFC,unit_convert,cache)
+    fringewideStratum = svmp.FringeStratum(svmp.frw_extrap[0],svmp.frw_extrap[1],gp,fringeFC,unit_convert,cache)
+    return [coreStratum,flatsStratum,fringeStratum,fringewideStratum]
+
+def change_calcs(gp,strata,site_data,year1,year2,unit_convert):
+    """ Area change for each stratum and all strata combined
+    
+    strata -- list of stratum objects (change_strata)
+    site_data -- dictionary of site data by stratum (pair_site_data)
+    
+    Returns a tuple: (list of ChangeStats objects, ChangeStatsTotal object)
+    
+    """
+    # Performs Sample Calculations for 
+    # Year 1 matching sites, Year 2 matching sites, and Year 1 all sites
+    # This is necessary input to Change Analysis Calculations
+    changes = []
+    for stratum,label in zip(strata,CHANGE_STRATA_LABELS):
+        gp.AddMessage("Calculating Area Change for %s stratum, %s to %s" % (label,year1,year2))
+        (y1,y1m,y2m) = site_data[(stratum.analysis,stratum.extrapolation)]
+        samp_y1m = svmp.SampleStats(y1m,stratum,unit_convert)
+        samp_y2m = svmp.SampleStats(y2m,stratum,unit_convert)
+        samp_y1 = svmp.SampleStats(y1,stratum,unit_convert)
+        changes.append(svmp.ChangeStats(samp_y1m,samp_y2m,samp_y1))
+    # Annual Estimate for Year 1, All strata combined
+    gp.AddMessage("Calculating Area Change for all strata combined, %s to %s" % (year1,year2))
+    y1annualCalc = svmp.AnnualEstimate([c.y1 for c in changes])
+    # Area Change for all strata combined, Year 1 to Year 2
+    zmChangeAll = svmp.ChangeStatsTotal(changes,y1annualCalc)
+    return (changes,zmChangeAll)
+
+def mc_site_strata(strata,site_data,unit_convert):
+    """ Site data for each stratum, in the form used by the Monte Carlo engines """
+    return [mc.StratumMC(site_data[(s.analysis,s.extrapolation)][0],
+                         site_data[(s.analysis,s.extrapolation)][1],
+                         site_data[(s.analysis,s.extrapolation)][2],s,unit_convert)
+            for s in strata]
+
+#-------------- OUTPUT ---------------------------------
+def output_string(v1,*vals):
+    """ Creates the comma-delimited output string 
+        using formatting based on object type 
+    """
+    out_string = "%s" % v1
+    for v in vals:
+        if type(v) == str or type(v) == unicode:
+            out_string = out_string + ",%s" % v
+        elif type(v) == int:
+            out_string = out_string + ",%i" % v
+        else:
+            out_string = out_string + ",%r" % v
+    out_string = out_string + "\n"
+    return out_string
+
+def stratum_output_strings(year1,year2,sample_group,changes):
+    """ Output lines for the area change by stratum (swAreaChgStratumCols) """
+    return [output_string(year1,year2,c.y1m.stratum.analysis,sample_group,
+                          c.y1m.ni,c.m,c.m_se,
+                          c.change_prop,c.area_change,c.area_change_se)
+            for c in changes]
+
+def all_strata_output_string(year1,year2,sample_group,zmChangeAll,mc_ci,mc_ci_se,mc_iterations):
+    """ Output line for the area change for all strata combined (swAreaChgAllCols) """
+    return output_string(year1,year2,sample_group,zmChangeAll.change_prop,
+                         zmChangeAll.area_change,zmChangeAll.area_change_se,mc_ci,
+                         mc_ci_se,mc_iterations)
+
+def write_output(e,out_file,columns,lines):
+    """ Writes the column names and output lines to a comma-delimited file """
+    try:
+        outFile = open(out_file,'w')
+        colnames_text = ",".join(columns)
+        outFile.write(colnames_text + "\n")
+        for line in lines:
+            outFile.write(line)
+        outFile.close()
+    except:
+        errtext = "There was an error while opening or writing to the output file:"
+        errtext += "%s" % out_file
+        e.call(errtext)
 #------------------------------------------------------------
 
 #--------------------------------------------------------------------------    
@@ -133,7 +369,7 @@ if __name__ == "__main__":
     try:
 
         #---- Create the Geoprocessing Object ----------------------
-        gp = arcgisscripting.create(9.3)
+        gp = spatial.create_gp(9.3)
         
         #----- Create the Custom Error Object ----------------------
         e = SvmpToolsError(gp)
@@ -178,10 +414,45 @@ if __name__ == "__main__":
         sample_group = gp.GetParameterAsText(6)
         outFileStratum = gp.GetParameterAsText(7)
         outFileAll = gp.GetParameterAsText(8)
-        #outFileRC = gp.GetParameterAsText(9)   #not being used currently
-        
-
-        unit_convert = "sf2m"   # unit conversion flag  -- survey feet to meters
+        outFileRC = gp.GetParameterAsText(9)
+        mc_engine = gp.GetParameterAsText(10)
+        mc_seed = gp.GetParameterAsText(11)
+        mc_workers = gp.GetParameterAsText(12)
+        mc_tolerance = gp.GetParameterAsText(13)
+        mc_max_iterations = gp.GetParameterAsText(14)
+        mc_resume = gp.GetParameterAsText(15)
+        outFileRC_detail = gp.GetParameterAsText(16)
+        mc_scheme = gp.GetParameterAsText(17)
+        outFileTiming = gp.GetParameterAsText(18)
+        mc_cache_bypass = gp.GetParameterAsText(19)
+        strata_cache = stratum_cache(gp.GetParameterAsText(20))
+        
+        # Seed from the parameters (otherwise a new seed is chosen)
+        mc_seeded = bool(mc_seed) and mc_seed != "#"
+        try:
+            (mc_engine,mc_seed,mc_workers,mc_tolerance,mc_max_iterations) = mc.mc_options(mc_engine,
+                mc_seed,mc_workers,mc_tolerance,mc_max_iterations,msg)
+            mc_scheme = mc.scheme_option(mc_scheme,mc_engine,msg)
+        except ValueError, err:
+            e.call("%s" % err)
+        # Resume from checkpoint
+        mc_resume = (mc_resume.lower() == "true")
+        mc_checkpoint = mc.Checkpoint(mc.checkpoint_path(outFileAll))
+        # Relative change values output file
+        if not outFileRC or outFileRC == "#":
+            outFileRC = None
+        try:
+            mc.rc_file_option(outFileRC)
+        except ValueError, err:
+            e.call("%s" % err)
+        outFileRC_detail = (outFileRC_detail.lower() == "true")
+        # Monte Carlo timing log file
+        if not outFileTiming or outFileTiming == "#":
+            outFileTiming = None
+        # Cached Monte Carlo results -- only for runs with a seed
+        mc_cache = None
+        if mc_seeded:
+            mc_cache = mc.ResultCache(bypass=(mc_cache_bypass.lower() == "true"))
         
         #------- Delete output files if they already exist -----------------
         #def outfile_exists(file):
@@ -193,162 +464,24 @@ if __name__ == "__main__":
         
         #------------------   DATA QUERIES AND GROUPING --------------------------------
         #-------------------------------------------------------------------------------
-        #----------------- MATCHING SITES sampled in YEARS 1 & 2 -----------------------
-        #-------------------------------------------------------------------------------
-        # Get list of sites sampled in both years and their strata
-        msg("-- Matching Sites Queries for %s and %s" % (year1,year2))
-        msg(" Querying the All Sites Feature Class:\n  %s" % allsitesFC)
-        sites_strata_2yr = sites_strata(gp,allsitesFC,sample_group,year1,year2)
-        sites2yr = sorted(sites_strata_2yr.keys())
-        # For use in query strings
-        sites2yr_string = "'" + "\',\'".join(sites2yr) + "'" 
-        
-        # Get data from site stats database table for the matching sites
-        msg(" Querying the Sites Statistics Table:\n  %s" % siteTable)
-        data_y1m = sites_data(gp,sites2yr_string,year1,siteTable)
-        data_y2m = sites_data(gp,sites2yr_string,year2,siteTable)
-        
-        # Check for missing sites in sites stats DB query results
-        msg(" Comparing site list from All Sites Feature Class and Sites Database Table")
-        missing_site_check(sites2yr,data_y1m.keys(),siteTable,year1)
-        missing_site_check(sites2yr,data_y2m.keys(),siteTable,year2)
-        
-        ## Sites grouped by extrapolation type
-        extrap_sites2yr = strata_lookup(sites_strata_2yr,svmp.sw_Stratum4AreaChgCalcs)
-        
-        # Group matching site data into lists by analysis/extrapolation type
-        core_y1m = group_data_by_extrap(extrap_sites2yr,svmp.core_extrap,data_y1m)
-        fl_y1m = group_data_by_extrap(extrap_sites2yr,svmp.fl_extrap,data_y1m)
-        fr_y1m = group_data_by_extrap(extrap_sites2yr,svmp.fr_extrap,data_y1m)
-        frw_y1m = group_data_by_extrap(extrap_sites2yr,svmp.frw_extrap,data_y1m)
-        
-        core_y2m = group_data_by_extrap(extrap_sites2yr,svmp.core_extrap,data_y2m)
-        fl_y2m = group_data_by_extrap(extrap_sites2yr,svmp.fl_extrap,data_y2m)
-        fr_y2m = group_data_by_extrap(extrap_sites2yr,svmp.fr_extrap,data_y2m)
-        frw_y2m = group_data_by_extrap(extrap_sites2yr,svmp.frw_extrap,data_y2m)
-        
-        # Get the sample area (from flats shapefile) for rotational flats sites
-        # and append to rotational flats data
-        def add_samplearea(flats_data,extrap_sites):
-            fl_sites = extrap_sites[svmp.fl_extrap]
-            fl_sites_string = "'" + "\',\'".join(fl_sites) + "'" 
-            siteid_field = utils.sitePtIDCol   # NAME    
-            # query will look something like this: NAME in ('site1','site2','site5')
-            query_string = "%s in (%s)" % (siteid_field, fl_sites_string)
-            flats_query = spatial.FeatureQuery(gp,flatsFC,query_string)
-            # Dictionary of rotational flats sites with their sample area from flats.shp
-            flats_a2j = flats_query.field_results([flats_query.shape_field],siteid_field)
-            
-            # Append the sample area to the rest of the site data (rotational flats only)
-            for site in flats_data:
-                a2j = flats_a2j[site[0]][0]
-                site.append(a2j)
-                
-            return flats_data
-        
-        msg(" Querying flats shapefile for sample area:\n  %s" % flatsFC)
-        fl_y1m = add_samplearea(fl_y1m,extrap_sites2yr)
-        fl_y2m = add_samplearea(fl_y2m,extrap_sites2yr)
-        
-        #--------------------- End MATCHING SITES --------------------------------------
-            
-        #----------------------- ALL SITES sampled in YEAR 1 ---------------------------
-        # Get list of sites from Year 1 and associated strata
-        msg("-- Year 1 Queries for %s" % year1)
-        msg(" Querying the All Sites Feature Class:\n  %s" % allsitesFC)
-        
-        sites_strata_y1 = sites_strata(gp,allsitesFC,sample_group,year1)
-        sites_y1 = sorted(sites_strata_y1.keys())
-        # For use in query strings
-        sites_y1_string = "'" + "\',\'".join(sites_y1) + "'" 
-        
-        # Get data from site stats database table
-        msg(" Querying the Sites Statistics Table:\n  %s" % siteTable)
-        data_y1 = sites_data(gp,sites_y1_string,year1,siteTable)
-        
-        # Check for missing sites in sites stats DB query results
+        # Site data for all sites sampled in each year
+        y1_sites = YearSites(gp,year1,allsitesFC,siteTable,flatsFC,sample_group)
+        y2_sites = YearSites(gp,year2,allsitesFC,siteTable,flatsFC,sample_group)
+        # Site data for Year 1 all sites and the matching sites in Years 1 & 2,
+        #  grouped by analysis stratum
         msg(" Comparing site list from All Sites Feature Class and Sites Database Table")
-        missing_site_check(sites_y1,data_y1.keys(),siteTable,year1)
-        
-        # Sites grouped by extrapolation type
-        extrap_sites_y1 = strata_lookup(sites_strata_y1,svmp.sw_Stratum4AreaChgCalcs)
-        
-        # Group site data into lists by analysis/extrapolation type
-        core_y1 = group_data_by_extrap(extrap_sites_y1,svmp.core_extrap,data_y1)
-        fl_y1 = group_data_by_extrap(extrap_sites_y1,svmp.fl_extrap,data_y1)
-        fr_y1 = group_data_by_extrap(extrap_sites_y1,svmp.fr_extrap,data_y1)
-        frw_y1 = group_data_by_extrap(extrap_sites_y1,svmp.frw_extrap,data_y1)
-        
-        msg(" Querying flats shapefile for sample area:\n  %s" % flatsFC)
-        fl_y1 = add_samplearea(fl_y1,extrap_sites_y1)
-        
-        #----------------------- End SITES sampled in YEAR 1 ---------------------------
+        site_data = pair_site_data(e,siteTable,y1_sites,y2_sites)
         
         #------------------   End DATA QUERIES AND GROUPING ----------------------------
         #-------------------------------------------------------------------------------
         
         #-------------------------------- CALCULATIONS ---------------------------------
-        #---------------------------------- Strata -------------------------------------
-        # Performs Sample Calculations for 
-        # Year 1 matching sites, Year 2 matching sites, and Year 1 all sites
-        # This is necessary input to Change Analysis Calculations
-        
-        def core_sample_calc(data):
-            coreStratum = svmp.BaseStratum(svmp.core_extrap[0],svmp.core_extrap[1])
-            coreSamp = svmp.SampleStats(data,coreStratum,unit_convert)
-            return coreSamp
-        msg("Calculating Area Change for Core stratum, %s to %s" % (year1,year2))
-        coreSamp_y1m = core_sample_calc(core_y1m)
-        coreSamp_y2m = core_sample_calc(core_y2m)
-        coreSamp_y1 = core_sample_calc(core_y1)
-        coreChange = svmp.ChangeStats(coreSamp_y1m,coreSamp_y2m,coreSamp_y1)
-        
-        def flats_sample_calc(data):
-            flatsStratum = svmp.FlatsStratum(svmp.fl_extrap[0],svmp.fl_extrap[1],gp,flatsFC,unit_convert)
-            flatsSamp = svmp.SampleStats(data,flatsStratum,unit_convert)
-            return flatsSamp
-        msg("Calculating Area Change for Rotational Flats stratum, %s to %s" % (year1,year2))
-        flSamp_y1m = flats_sample_calc(fl_y1m)
-        flSamp_y2m = flats_sample_calc(fl_y2m)
-        flSamp_y1 = flats_sample_calc(fl_y1)
-        flChange = svmp.ChangeStats(flSamp_y1m,flSamp_y2m,flSamp_y1)
-        
-        def fringe_sample_calc(data):
-            fringeStratum = svmp.FringeStratum(svmp.fr_extrap[0],svmp.fr_extrap[1],gp,fringeFC,unit_convert)
-            fringeSamp = svmp.SampleStats(data,fringeStratum,unit_convert)
-            return fringeSamp
-        msg("Calculating Area Change for Fringe stratum, %s to %s" % (year1,year2))
-        frSamp_y1m = fringe_sample_calc(fr_y1m)
-        frSamp_y2m = fringe_sample_calc(fr_y2m)
-        frSamp_y1 = fringe_sample_calc(fr_y1)
-        frChange = svmp.ChangeStats(frSamp_y1m,frSamp_y2m,frSamp_y1)
-        
-        def wide_fringe_sample_calc(data):
-            fringewideStratum = svmp.FringeStratum(svmp.frw_extrap[0],svmp.frw_extrap[1],gp,fringeFC,unit_convert)
-            fringewideSamp = svmp.SampleStats(data,fringewideStratum,unit_convert)
-            return fringewideSamp
-        msg("Calculating Area Change for Wide Fringe stratum, %s to %s" % (year1,year2))
-        frwSamp_y1m = wide_fringe_sample_calc(frw_y1m)
-        frwSamp_y2m = wide_fringe_sample_calc(frw_y2m)
-        frwSamp_y1 = wide_fringe_sample_calc(frw_y1)
-        frwChange = svmp.ChangeStats(frwSamp_y1m,frwSamp_y2m,frwSamp_y1)
-        
-        #--------------------------- Totals ALL STRATA Combined ------------------------
         #-------------------------------------------------------------------------------
-        def annual_sample_calc(samples):
-            annual = svmp.AnnualEstimate(samples)
-            #print "****** Annual Estimate, Year 1 *********"
-            #print "Area: %r" % annual.zm_area
-            #print "Variance: %r" % annual.zm_area_var
-            #print "s.e.: %r" % annual.se
-            #print "cv: %r" % annual.cv
-            return annual
-        
-        # Annual Estimate for Year 1, All strata combined
-        msg("Calculating Area Change for all strata combined, %s to %s" % (year1,year2))
-        y1annualCalc = annual_sample_calc((coreSamp_y1,flSamp_y1,frSamp_y1,frwSamp_y1))
-        # Area Change for all strata combined, Year 1 to Year 2
-        zmChangeAll = svmp.ChangeStatsTotal((coreChange,flChange,frChange,frwChange),y1annualCalc)
+        # Stratum constants
+        strata = change_strata(gp,flatsFC,fringeFC,unit_convert,strata_cache)
+        # Area change by stratum and for all strata combined, Year 1 to Year 2
+        (changes,zmChangeAll) = change_calcs(gp,strata,site_data,year1,year2,unit_convert)
+        (coreChange,flChange,frChange,frwChange) = changes
         
         #------------------------------ End CALCULATIONS -------------------------------
         #-------------------------------------------------------------------------------
@@ -357,108 +490,45 @@ if __name__ == "__main__":
         #------------------------------ MONTE CARLO CI ---------------------------------
         #-------------------------------------------------------------------------------
         
-        def mc_stratum(y1_data,y1match_data,y2match_data,stratum,unit_convert=None):
-            """ 
-            Perform sampling error (bootstrap) and measurement error simulations
-            to calculate area change statistics with simulated data from a single stratum
-            """
-            # Bootstrap Sample (Sampling Error)
-            # Don't do bootstrap for core sites (non-subsampled) or strata with < 8 sites 
-            if len(y1_data) < 8 or stratum.analysis == "core":
-                y1 = y1_data[:]
-                y1m = y1match_data[:]
-                y2m = y2match_data[:]
-            else:
-                y1 = svmp.bootstrap(y1_data)
-                y1m = svmp.bootstrap(y1match_data)
-                y2m = svmp.match_sites(y1m,y2match_data)
-            # Measurement Error - Simulated Zm area
-            me1 = svmp.measurement_error(y1)
-            me1m = svmp.measurement_error(y1m)
-            me2m = svmp.measurement_error(y2m)
-            # Printng for DEBUG only
-            #for d in me1:
-                #yr1_string = ','.join(["%s" % i for i in d[0:2]])
-                #yr1_string = "%s,%s" % ("Y1",yr1_string)
-                ## print yr1_string  # for debug only
-            #for c,d in zip(me1m,me2m):
-                #yr1m_string = ','.join(["%s" % i for i in c[0:2]])
-                #yr1m_string = "%s,%s" % ("Y1m",yr1m_string)
-                #yr2m_string = ','.join(["%s" % i for i in d[0:2]])
-                #yr2m_string = "%s,%s" % ("Y2m",yr2m_string)
-                #allmatch_string = "%s,%s" % (yr1m_string,yr2m_string)
-                ## print allmatch_string # for debug only
-                
-             # Calculate Change Analysis stats with Simulated Data
-            y1Samp  = svmp.SampleStats(me1,stratum,unit_convert)
-            y1mSamp = svmp.SampleStats(me1m,stratum,unit_convert)
-            y2mSamp = svmp.SampleStats(me2m,stratum,unit_convert)  
-            change = svmp.ChangeStats(y1mSamp,y2mSamp,y1Samp)
-            # Relative Change
-            return (y1Samp,y1mSamp,y2mSamp,change)
-        
-        # For debugging only
-        def mc_sites_out(i,label,changeObj):
-            for s1,s2,a1,a2 in zip(changeObj.y1m.site_ids,changeObj.y2m.site_ids,changeObj.y1m.zm_areas,changeObj.y2m.zm_areas):
-                # iteration, stratum, Year1 site, Year2 site, Year1 simulated Zm area, Year2 simulated Zm area
-                print "%i,%s,%s,%s,%r,%r" % (i,label,s1,s2,a1,a2)
-
-        
-        def mc_relative_change(iterations,outFile=None):
-            """
-            Calculates relative change values using Monte Carlo analysis
-            iterations -- number of Monte Carlo iterations (usually 20,000)
-            outFile -- optional output file for list of Relative change values
-            """
-                
-            if outFile:
-                output = open(outFile,'w')
-                output.write("run,RC\n")
-                
-            rel_changes = []
-            for i in range(iterations):
-                #--------- Monte Carlo Change calculations by Stratum
-                # Core
-                (core_y1_mcSamp,core_y1m_mcSamp,core_y2m_mcSamp,core_mcChange) = mc_stratum(core_y1,core_y1m,core_y2m,coreSamp_y1.stratum,unit_convert)
-                # Rotational Flats
-                (fl_y1_mcSamp,fl_y1m_mcSamp,fl_y2m_mcSamp,fl_mcChange) = mc_stratum(fl_y1,fl_y1m,fl_y2m,flSamp_y1.stratum,unit_convert)        
-                # Fringe Sites
-                (fr_y1_mcSamp,fr_y1m_mcSamp,fr_y2m_mcSamp,fr_mcChange) = mc_stratum(fr_y1,fr_y1m,fr_y2m,frSamp_y1.stratum,unit_convert)
-                # Wide Fringe
-                (frw_y1_mcSamp,frw_y1m_mcSamp,frw_y2m_mcSamp,frw_mcChange) = mc_stratum(frw_y1,frw_y1m,frw_y2m,frwSamp_y1.stratum,unit_convert)
-                
-                # For debugging
-                #mc_sites_out(i,"Core",core_mcChange)
-                #mc_sites_out(i,"Flats",fl_mcChange)
-                #mc_sites_out(i,"Fringe",fr_mcChange)
-                #mc_sites_out(i,"Wide Fringe",frw_mcChange)
-                
-                #-- Monte Carlo All strata calculations - annual estimate and area change
-                # Annual Estimate for Year 1, All strata combined
-                y1_mcAnnualCalc = annual_sample_calc((core_y1_mcSamp,fl_y1_mcSamp,fr_y1_mcSamp,frw_y1_mcSamp))
-                # Area Change for all strata combined, Year 1 to Year 2
-                mc_zmChangeAll = svmp.ChangeStatsTotal((core_mcChange,fl_mcChange,fr_mcChange,frw_mcChange),y1_mcAnnualCalc)
-                rc = mc_zmChangeAll.change_prop
-                
-                #--- Store Relative Change value for each iteration
-                rel_changes.append(rc)
-                
-                if outFile:
-                    out_string = "%i,%r\n" % (i,rc)
-                    output.write(out_string) 
-                
-            if outFile:
-                output.close()
-                
-            return rel_changes
-
+        # Site data for each stratum, in the form used by the Monte Carlo engines
+        mc_strata = mc_site_strata(strata,site_data,unit_convert)
         
         msg("Calculating Monte Carlo Confidence Intervals.  This may take a couple minutes...")
-        # Calculate Relative Change list - 20,000 iterations
-        #rel_changes = mc_relative_change(20000,outFileRC)
-        rel_changes = mc_relative_change(20000)
+        msg(" Monte Carlo engine: %s, seed: %s, worker processes: %i" % (mc_engine,mc_seed,mc_workers))
+        if mc_scheme != mc.PLAIN:
+            msg(" Variance reduction: %s" % mc_scheme)
+        if mc_tolerance:
+            msg(" Adaptive stopping: tolerance %r, maximum %i iterations" % (mc_tolerance,mc_max_iterations))
+        if outFileRC:
+            msg(" Writing Monte Carlo relative change values to:\n %s" % outFileRC)
         # Calculate Monte Carlo 95% confidence interval
-        mc_ci = svmp.conf_int(rel_changes,0.95)
+        #  relative change values are accumulated as they are calculated
+        #  the state of the run is saved to the checkpoint file after each block
+        if mc_resume and not mc_checkpoint.exists():
+            msg(" No Monte Carlo checkpoint file found, starting from the first iteration")
+        # Progress messages during the run, and the optional timing log
+        if outFileTiming:
+            msg(" Writing Monte Carlo timing log to:\n %s" % outFileTiming)
+        mc_progress = mc.MCProgress(msg,mc_max_iterations,log_file=outFileTiming)
+        try:
+            (mc_accumulator,mc_ci_se) = mc.mc_conf_int_adaptive(mc_strata,mc_tolerance,mc_max_iterations,
+                                                                0.95,mc_engine,mc_seed,mc_workers,
+                                                                checkpoint=mc_checkpoint,resume=mc_resume,
+                                                                outFile=outFileRC,detail=outFileRC_detail,
+                                                                scheme=mc_scheme,progress=mc_progress,
+                                                                cache=mc_cache)
+        except ValueError, err:
+            e.call("Monte Carlo error: %s" % err)
+        if mc_cache is not None and mc_cache.hit:
+            msg(" Monte Carlo result from cache:\n %s" % mc_cache.folder)
+        if mc_checkpoint.seed is not None:
+            msg(" Resumed from checkpoint after %i iterations, seed: %s" % 
+                (min(mc_checkpoint.blocks * mc.BLOCK_SIZE,mc_max_iterations),mc_checkpoint.seed))
+        mc_ci = mc_accumulator.ci()
+        mc_iterations = mc_accumulator.count
+        msg(" Monte Carlo iterations: %i, 95%% CI: %r, standard error of CI: %r" % (mc_iterations,mc_ci,mc_ci_se))
+        if mc_ci_se is None:
+            mc_ci_se = ""
                 
         #------------------------------ End MONTE CARLO CI -----------------------------
         #-------------------------------------------------------------------------------
@@ -508,69 +578,20 @@ if __name__ == "__main__":
         #sites_out("Flats",flChange)
         #sites_out("Fringe",frChange)
         #sites_out("Wide Fringe",frwChange)
-                
-        # Creates the comma-delimited output string 
-        #  using formatting based on object type 
-        def output_string(v1,*vals):
-            out_string = "%s" % v1
-            for v in vals:
-                if type(v) == str or type(v) == unicode:
-                    out_string = out_string + ",%s" % v
-                elif type(v) == int:
-                    out_string = out_string + ",%i" % v
-                else:
-                    out_string = out_string + ",%r" % v
-            out_string = out_string + "\n"
-            return out_string
         
         # ----------------------- Text File OUTPUT ------------------------------------
-        coreString = output_string(year1,year2,coreChange.y1m.stratum.analysis,sample_group,
-                                   coreChange.y1m.ni,coreChange.m,coreChange.m_se,
-                                   coreChange.change_prop,coreChange.area_change,coreChange.area_change_se)
-        flString =output_string(year1,year2,flChange.y1m.stratum.analysis,sample_group,
-                                flChange.y1m.ni,flChange.m,flChange.m_se,
-                                flChange.change_prop,flChange.area_change,flChange.area_change_se)
-        frString = output_string(year1,year2,frChange.y1m.stratum.analysis,sample_group,
-                                 frChange.y1m.ni,frChange.m,frChange.m_se,
-                                 frChange.change_prop,frChange.area_change,frChange.area_change_se)
-        frwString = output_string(year1,year2,frwChange.y1m.stratum.analysis,sample_group,
-                                  frwChange.y1m.ni,frwChange.m,frwChange.m_se,
-                                  frwChange.change_prop,frwChange.area_change,frwChange.area_change_se)
-
-        
         # Stratum calcs - populate Output File
         msg("Writing stratum area change results to output file:\n %s" % outFileStratum)
-        try:
-            outFile = open(outFileStratum,'w')
-            colnames_text = ",".join(utils.swAreaChgStratumCols)
-            outFile.write(colnames_text + "\n")
-            outFile.write(coreString)
-            outFile.write(flString)
-            outFile.write(frString)
-            outFile.write(frwString)
-            outFile.close()
-        except:
-            errtext = "There was an error while opening or writing to the output file:"
-            errtext += "%s" % outFileStratum
-            e.call(errtext)
-            
-        
-        
-        allStrataString = output_string(year1,year2,sample_group,zmChangeAll.change_prop,
-                                        zmChangeAll.area_change,zmChangeAll.area_change_se,mc_ci)
+        write_output(e,outFileStratum,utils.swAreaChgStratumCols,
+                     stratum_output_strings(year1,year2,sample_group,changes))
         
         # All sites calcs - populate Output File
         msg("Writing soundwide area change results to output file:\n %s" % outFileAll)
-        try:
-            outFile = open(outFileAll,'w')
-            colnames_text = ",".join(utils.swAreaChgAllCols)
-            outFile.write(colnames_text + "\n")
-            outFile.write(allStrataString)
-            outFile.close()   
-        except:
-            errtext = "There was an error while opening or writing to the output file:"
-            errtext += "%s" % outFileAll
-            e.call(errtext)
+        write_output(e,outFileAll,utils.swAreaChgAllCols,
+                     [all_strata_output_string(year1,year2,sample_group,zmChangeAll,
+                                               mc_ci,mc_ci_se,mc_iterations)])
+        # Run is complete, checkpoint no longer needed
+        mc_checkpoint.remove()
         
         
         #--------------------------------- End  OUTPUT ---------------------------------
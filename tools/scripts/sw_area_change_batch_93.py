@@ -0,0 +1,177 @@
+""" Calculates Soundwide Zostera marina area change and error estimates for a series of year pairs """
+
+"""
+Tool Name:  SWAreaChangeBatch
+Tool Label: SW Area Change (Multiple Years)
+Source Name: sw_area_change_batch_93.py
+Version: ArcGIS 9.3
+For: Washington DNR, Submerged Vegetation Monitoring Program (SVMP)
+Requires: Python 2.5.1
+
+This script calculates soundwide Zostera marina area change estimates
+for a list of year pairs (e.g. a time series of consecutive years),
+with the same calculations as the SW Area Change tool (sw_area_change_93.py).
+
+The site data for each year are queried once, and shared by all of the
+year pairs that include that year.  The stratum constants are also
+queried once.  Results for all year pairs are written to one stratum
+output file and one all strata output file.
+
+# Parameters:
+INPUT
+(1) siteTable -- Site statistics geodatabase table (full path)
+(2) allsitesFC -- Feature Class containing point locations for all sites (full path)
+(3) flatsFC -- ArcGIS feature class for flats sites (full path)
+(4) fringeFC -- ArcGIS feature class for fringe sites (full path)
+(5) year_pairs -- List of year pairs, separated by semicolons, with a dash
+                  between the years of each pair.  Example: 2007-2008;2008-2009;2009-2010
+(6) sample_group -- soundwide or other data grouping.  soundwide is only option currently implemented
+OUTPUT
+(7) outFileStratum -- Output file name for Area Change by Stratum, all year pairs (full path)
+(8) outFileAll -- Output file name for Area Change for All Strata Combined, all year pairs (full path)
+MONTE CARLO OPTIONS -- same as the SW Area Change tool
+(9) mc_engine -- [optional] Monte Carlo engine: classic, vectorized, vectorized-legacy or kernel
+                  (default is vectorized if NumPy is available, otherwise kernel)
+(10) mc_seed -- [optional] Random number seed, for repeatable Monte Carlo results
+                  The same seed is used for each year pair, so each pair's results
+                  match a SW Area Change run with that seed
+(11) mc_workers -- [optional] Number of worker processes for the vectorized engine
+                   (default 1; 0 uses one worker per processor)
+(12) mc_tolerance -- [optional] Adaptive stopping tolerance (default: no adaptive stopping)
+(13) mc_max_iterations -- [optional] Maximum number of Monte Carlo iterations (default 20,000)
+(14) stratum_cache -- [optional] true to save the stratum constants (Ni, A2, LT) in a sidecar
+                  file next to the flats and fringe feature classes (extension .svmpconst),
+                  and reuse them in later runs while the feature classes are unchanged
+                  (default false)
+
+"""
+
+import sys
+import svmp_mc_93 as mc
+import svmp_spatial_93 as spatial
+import svmpUtils as utils
+import sw_area_change_93 as chg
+from svmp_exceptions import SvmpToolsError
+
+#-------------- FUNCTIONS ---------------------------------
+def parse_year_pairs(year_pairs):
+    """ List of (year1, year2) tuples from the year_pairs parameter text
+        Example: "2007-2008;2008-2009" -- [(2007,2008),(2008,2009)]
+    """
+    pairs = []
+    for pair_text in year_pairs.split(";"):
+        pair_text = pair_text.strip().strip("'")
+        if not pair_text:
+            continue
+        years = pair_text.split("-")
+        if len(years) != 2:
+            raise ValueError("Year pair, %s, must be two years separated by a dash (e.g. 2007-2008)" % pair_text)
+        pairs.append((int(years[0]),int(years[1])))
+    if not pairs:
+        raise ValueError("No year pairs were specified")
+    return pairs
+#------------------------------------------------------------
+
+#--------------------------------------------------------------------------
+#--------------------------------------------------------------------------
+#MAIN
+
+if __name__ == "__main__":
+
+    try:
+
+        #---- Create the Geoprocessing Object ----------------------
+        gp = spatial.create_gp(9.3)
+
+        #----- Create the Custom Error Object ----------------------
+        e = SvmpToolsError(gp)
+        # Set some basic defaults for error handling
+        e.debug = True
+        e.full_tb = True
+
+        #-------- unit conversion flag --------------------
+        unit_convert = "sf2m"
+
+        def msg(msg):
+            gp.AddMessage(msg)
+
+        # ----------- PARAMETERS ----------------------------------
+        # Get parameters from ArcToolbox input or command line
+        siteTable = gp.GetParameterAsText(0)
+        allsitesFC = gp.GetParameterAsText(1)
+        flatsFC = gp.GetParameterAsText(2)
+        fringeFC = gp.GetParameterAsText(3)
+        year_pairs = gp.GetParameterAsText(4)
+        sample_group = gp.GetParameterAsText(5)
+        outFileStratum = gp.GetParameterAsText(6)
+        outFileAll = gp.GetParameterAsText(7)
+        mc_engine = gp.GetParameterAsText(8)
+        mc_seed = gp.GetParameterAsText(9)
+        mc_workers = gp.GetParameterAsText(10)
+        mc_tolerance = gp.GetParameterAsText(11)
+        mc_max_iterations = gp.GetParameterAsText(12)
+        strata_cache = chg.stratum_cache(gp.GetParameterAsText(13))
+
+        try:
+            year_pairs = parse_year_pairs(year_pairs)
+            (mc_engine,mc_seed,mc_workers,mc_tolerance,mc_max_iterations) = mc.mc_options(mc_engine,
+                mc_seed,mc_workers,mc_tolerance,mc_max_iterations,msg)
+        except ValueError, err:
+            e.call("%s" % err)
+
+        #------------------   DATA QUERIES ---------------------------------------------
+        #-------------------------------------------------------------------------------
+        # Site data for each year, queried once
+        years = []
+        for pair in year_pairs:
+            for year in pair:
+                if year not in years:
+                    years.append(year)
+        year_sites = {}
+        for year in years:
+            year_sites[year] = chg.YearSites(gp,year,allsitesFC,siteTable,flatsFC,sample_group)
+        # Stratum constants, queried once
+        msg("-- Stratum Queries")
+        strata = chg.change_strata(gp,flatsFC,fringeFC,unit_convert,strata_cache)
+
+        #--------------------- CALCULATIONS FOR EACH YEAR PAIR -------------------------
+        #-------------------------------------------------------------------------------
+        stratum_strings = []
+        all_strata_strings = []
+        for (year1,year2) in year_pairs:
+            msg("-- Area Change for %s to %s" % (year1,year2))
+            site_data = chg.pair_site_data(e,siteTable,year_sites[year1],year_sites[year2])
+            (changes,zmChangeAll) = chg.change_calcs(gp,strata,site_data,year1,year2,unit_convert)
+
+            # Monte Carlo 95% confidence interval
+            mc_strata = chg.mc_site_strata(strata,site_data,unit_convert)
+            msg("Calculating Monte Carlo Confidence Intervals.  This may take a couple minutes...")
+            msg(" Monte Carlo engine: %s, seed: %s, worker processes: %i" % (mc_engine,mc_seed,mc_workers))
+            try:
+                (mc_accumulator,mc_ci_se) = mc.mc_conf_int_adaptive(mc_strata,mc_tolerance,mc_max_iterations,
+                                                                    0.95,mc_engine,mc_seed,mc_workers,
+                                                                    progress=mc.MCProgress(msg,mc_max_iterations))
+            except ValueError, err:
+                e.call("Monte Carlo error: %s" % err)
+            mc_ci = mc_accumulator.ci()
+            mc_iterations = mc_accumulator.count
+            msg(" Monte Carlo iterations: %i, 95%% CI: %r, standard error of CI: %r" % (mc_iterations,mc_ci,mc_ci_se))
+            if mc_ci_se is None:
+                mc_ci_se = ""
+
+            stratum_strings.extend(chg.stratum_output_strings(year1,year2,sample_group,changes))
+            all_strata_strings.append(chg.all_strata_output_string(year1,year2,sample_group,zmChangeAll,
+                                                                   mc_ci,mc_ci_se,mc_iterations))
+
+        #-----------------------------------   OUTPUT ----------------------------------
+        #-------------------------------------------------------------------------------
+        msg("Writing stratum area change results to output file:\n %s" % outFileStratum)
+        chg.write_output(e,outFileStratum,utils.swAreaChgStratumCols,stratum_strings)
+        msg("Writing soundwide area change results to output file:\n %s" % outFileAll)
+        chg.write_output(e,outFileAll,utils.swAreaChgAllCols,all_strata_strings)
+
+    except SystemExit:
+        pass
+    except:
+        e.call()
+        del gp
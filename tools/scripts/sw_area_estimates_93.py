@@ -12,6 +12,9 @@ Requires: Python 2.5.1
 
 This script calculates soundwide Zostera marina area estimates
 for a single survey year.
+Optionally calculates a Monte Carlo 95% Confidence Interval for the
+soundwide estimate (bootstrap and measurement error simulation, 20,000 
+iterations, or fewer when an adaptive stopping tolerance is given)
 
 # Parameters:
 INPUT
@@ -24,13 +27,30 @@ INPUT
 OUTPUT
 (7) outFileStratum -- Output file name for Area Estimates by Stratum (full path)
 (8) outFileAll -- Ouptut file name for Area Estimates for All Strata Combined (full path)
+MONTE CARLO OPTIONS
+(9) mc_ci -- [optional] true to calculate a Monte Carlo 95% confidence interval for the
+             soundwide area estimate (default false).  The interval (+/- square meters), 
+             its standard error and the number of iterations are written to outFileAll
+(10) mc_engine -- [optional] Monte Carlo engine: classic, vectorized, vectorized-legacy or kernel
+                  (default is vectorized if NumPy is available, otherwise kernel)
+(11) mc_seed -- [optional] Random number seed, for repeatable Monte Carlo results
+(12) mc_workers -- [optional] Number of worker processes for the vectorized engine
+                   (default 1; 0 uses one worker per processor)
+(13) mc_tolerance -- [optional] Adaptive stopping tolerance: stop when the standard error
+                   of the 95% CI, relative to the CI, is at or below this value (e.g. 0.01)
+                   (default: no adaptive stopping)
+(14) mc_max_iterations -- [optional] Maximum number of Monte Carlo iterations (default 20,000)
+(15) stratum_cache -- [optional] true to save the stratum constants (Ni, A2, LT) in a sidecar
+                  file next to the flats and fringe feature classes (extension .svmpconst),
+                  and reuse them in later runs while the feature classes are unchanged
+                  (default false)
 
 """
 
 import sys
-import arcgisscripting
 import svmp_93 as svmp 
 import svmp_spatial_93 as spatial
+import svmp_mc_93 as mc
 import svmpUtils as utils
 from svmp_exceptions import SvmpToolsError
 
@@ -66,7 +86,7 @@ if __name__ == "__main__":
 
     try:
         #---- Create the Geoprocessing Object, v.9.3 ----------------------
-        gp = arcgisscripting.create(9.3)
+        gp = spatial.create_gp(9.3)
         gp.OverWriteOutput = True
         
         #----- Create the Custom Error Object ----------------------
@@ -106,9 +126,28 @@ if __name__ == "__main__":
         sample_group = gp.GetParameterAsText(5)
         outFileStratum = gp.GetParameterAsText(6)
         outFileAll = gp.GetParameterAsText(7)
+        mc_ci = gp.GetParameterAsText(8)
+        mc_engine = gp.GetParameterAsText(9)
+        mc_seed = gp.GetParameterAsText(10)
+        mc_workers = gp.GetParameterAsText(11)
+        mc_tolerance = gp.GetParameterAsText(12)
+        mc_max_iterations = gp.GetParameterAsText(13)
+        stratum_cache = gp.GetParameterAsText(14)
+        
+        # Monte Carlo confidence interval options
+        mc_ci = (mc_ci.lower() == "true")
+        if mc_ci:
+            try:
+                (mc_engine,mc_seed,mc_workers,mc_tolerance,mc_max_iterations) = mc.mc_options(mc_engine,
+                    mc_seed,mc_workers,mc_tolerance,mc_max_iterations,msg)
+            except ValueError, err:
+                e.call("%s" % err)
         
         unit_convert = "sf2m"   # unit conversion flag  -- survey feet to meters
         
+        # Stratum constants cache (saved to sidecar files if requested)
+        strata_cache = svmp.StratumConstants(persist=(stratum_cache.lower() == "true"))
+        
         
         #----- Get  site list and strata from svmp_all_sites feature class
         #---------------------------------------------------------------------------
@@ -240,7 +279,7 @@ if __name__ == "__main__":
         # -- Rotational Flats Stratum
         def rotational_flats_sample_calc():
             msg("Calculating Area Estimates for Rotational Flats stratum, %s" % surveyYear)
-            flStratum = svmp.FlatsStratum(svmp.fl_extrap[0],svmp.fl_extrap[1],gp,flatsFC,unit_convert)
+            flStratum = svmp.FlatsStratum(svmp.fl_extrap[0],svmp.fl_extrap[1],gp,flatsFC,unit_convert,strata_cache)
             flSamp = svmp.SampleStats(fl_dat,flStratum,unit_convert)
             for site in sorted(flSamp.site_ids):
                 msg("  %s" % site)
@@ -249,7 +288,7 @@ if __name__ == "__main__":
         # -- Fringe Stratum
         def fringe_sample_calc():
             msg("Calculating Area Estimates for Fringe stratum, %s" % surveyYear)
-            frStratum = svmp.FringeStratum(svmp.fr_extrap[0],svmp.fr_extrap[1],gp,fringeFC,unit_convert)
+            frStratum = svmp.FringeStratum(svmp.fr_extrap[0],svmp.fr_extrap[1],gp,fringeFC,unit_convert,strata_cache)
             frSamp = svmp.SampleStats(fr_dat,frStratum,unit_convert)
             for site in sorted(frSamp.site_ids):
                 msg("  %s" % site)
@@ -258,7 +297,7 @@ if __name__ == "__main__":
         # -- Wide Fringe Stratum    
         def wide_fringe_sample_calc():
             msg("Calculating Area Estimates for Wide Fringe stratum, %s" % surveyYear)
-            frwStratum = svmp.FringeStratum(svmp.frw_extrap[0],svmp.frw_extrap[1],gp,fringeFC,unit_convert)
+            frwStratum = svmp.FringeStratum(svmp.frw_extrap[0],svmp.frw_extrap[1],gp,fringeFC,unit_convert,strata_cache)
             frwSamp = svmp.SampleStats(frw_dat,frwStratum,unit_convert)
             for site in sorted(frwSamp.site_ids):
                 msg("  %s" % site)
@@ -331,8 +370,34 @@ if __name__ == "__main__":
             return annual
         
         annualCalc = annual_sample_calc()
+        
+        # -- Monte Carlo 95% Confidence Interval for the soundwide estimate
+        mc_area_ci = ""
+        mc_area_ci_se = ""
+        mc_iterations = ""
+        if mc_ci:
+            msg("Calculating Monte Carlo Confidence Interval.  This may take a minute...")
+            msg(" Monte Carlo engine: %s, seed: %s, worker processes: %i" % (mc_engine,mc_seed,mc_workers))
+            mc_strata = [mc.estimate_stratum_mc(core_dat,coreSamp.stratum,unit_convert),
+                         mc.estimate_stratum_mc(pfl_dat,pflSamp.stratum,unit_convert),
+                         mc.estimate_stratum_mc(fl_dat,flSamp.stratum,unit_convert),
+                         mc.estimate_stratum_mc(fr_dat,frSamp.stratum,unit_convert),
+                         mc.estimate_stratum_mc(frw_dat,frwSamp.stratum,unit_convert)]
+            try:
+                (mc_accumulator,mc_area_ci_se) = mc.mc_estimate_conf_int(mc_strata,mc_tolerance,mc_max_iterations,
+                                                                         0.95,mc_engine,mc_seed,mc_workers,
+                                                                         progress=mc.MCProgress(msg,mc_max_iterations))
+            except ValueError, err:
+                e.call("Monte Carlo error: %s" % err)
+            mc_area_ci = mc_accumulator.ci()
+            mc_iterations = mc_accumulator.count
+            msg(" Monte Carlo iterations: %i, 95%% CI: %r, standard error of CI: %r" % (mc_iterations,mc_area_ci,mc_area_ci_se))
+            if mc_area_ci_se is None:
+                mc_area_ci_se = ""
+        
         annualString = output_string(surveyYear,sample_group,
-                            annualCalc.zm_area,annualCalc.zm_area_var,annualCalc.se,annualCalc.cv)
+                            annualCalc.zm_area,annualCalc.zm_area_var,annualCalc.se,annualCalc.cv,
+                            mc_area_ci,mc_area_ci_se,mc_iterations)
         
         # Open the file for output
         msg("Writing combined area results to output file:\n %s" % outFileAll)
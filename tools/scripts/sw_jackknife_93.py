@@ -0,0 +1,195 @@
+""" Jackknife influence of each site on the Soundwide Zostera marina area and area change estimates """
+
+"""
+Tool Name:  SWJackknife
+Tool Label: SW Jackknife Influence
+Source Name: sw_jackknife_93.py
+Version: ArcGIS 9.3
+For: Washington DNR, Submerged Vegetation Monitoring Program (SVMP)
+Requires: Python 2.5.1
+
+This script calculates leave-one-site-out (jackknife) estimates of the
+soundwide Zostera marina area for a survey year and, when a second year
+is given, of the soundwide proportion change between the two years.
+
+For each estimate, the summary output file has the estimate with all
+sites, the number of sites left out, and the jackknife mean, bias, 
+variance and standard error.  The site output file has the estimate with 
+each site left out and the site's influence (the change in the estimate 
+when the site is left out), with the sites ranked by the size of their 
+influence.
+
+The variance and bias are stratified (summed over the strata, each with
+its own number of sites).  Core and persistent flats sites are a census
+rather than a sample, so they are not left out.
+
+Site data are queried the same way as the SW Area Estimates tool
+(area estimate) and the SW Area Change tool (proportion change).
+The leave-one-out estimates are updated from the stratum sums
+(see svmp_93.annual_jackknife and svmp_93.change_jackknife), so all of
+the sites in a survey year take well under a second.
+
+# Parameters:
+INPUT
+(1) siteTable -- Site statistics geodatabase table (full path)
+(2) allsitesFC -- Feature Class containing point locations for all sites (full path)
+(3) flatsFC -- ArcGIS feature class for flats sites (full path)
+(4) fringeFC -- ArcGIS feature class for fringe sites (full path)
+(5) year1 -- Survey year for the area estimate (first year for the change)
+(6) year2 -- [optional] Second survey year for the proportion change
+             (default: area estimate only)
+(7) sample_group -- soundwide or other data grouping.  soundwide is only option currently implemented
+OUTPUT
+(8) outFileSummary -- Output file name for the jackknife summary of each estimate (full path)
+(9) outFileSites -- Output file name for the ranked site influence table (full path)
+OPTIONS
+(10) stratum_cache -- [optional] true to save the stratum constants (Ni, A2, LT) in a sidecar
+                     file next to the flats and fringe feature classes (extension .svmpconst),
+                     and reuse them in later runs while the feature classes are unchanged
+                     (default false)
+
+"""
+
+import sys
+import time
+import svmp_93 as svmp
+import svmp_spatial_93 as spatial
+import svmpUtils as utils
+import sw_area_change_93 as chg
+from svmp_exceptions import SvmpToolsError
+
+#-------------- FUNCTIONS ---------------------------------
+# Analysis strata for area estimates, in output order
+AREA_STRATA = (svmp.core_extrap,svmp.pfl_extrap,svmp.fl_extrap,svmp.fr_extrap,svmp.frw_extrap)
+
+# Estimate labels for the output files
+AREA_ESTIMATE = utils.swareaCol
+CHANGE_ESTIMATE = utils.propChgCol
+
+def area_strata(change_strata):
+    """ Stratum objects for the area estimate strata (AREA_STRATA)
+        change_strata -- core, rotational flats, fringe and wide fringe strata (chg.change_strata)
+    """
+    (coreStratum,flatsStratum,fringeStratum,fringewideStratum) = change_strata
+    pflStratum = svmp.BaseStratum(svmp.pfl_extrap[0],svmp.pfl_extrap[1])
+    return [coreStratum,pflStratum,flatsStratum,fringeStratum,fringewideStratum]
+
+def area_samples(e,siteTable,year_sites,strata,unit_convert):
+    """ SampleStats objects for each area estimate stratum
+
+    e -- SvmpToolsError object
+    siteTable -- Site statistics table (for error messages)
+    year_sites -- chg.YearSites object for the survey year
+    strata -- stratum objects (area_strata)
+
+    """
+    chg.missing_site_check(e,year_sites.sites,year_sites.data.keys(),siteTable,year_sites.year)
+    extrap_sites = chg.strata_lookup(year_sites.sites_strata,svmp.sw_Stratum4AreaCalcs)
+    grouped = year_sites.grouped_data(extrap_sites,AREA_STRATA)
+    return [svmp.SampleStats(grouped[(s.analysis,s.extrapolation)],s,unit_convert) for s in strata]
+
+def summary_output_string(year1,year2,sample_group,label,jk):
+    """ Output line for the jackknife summary of an estimate (swJackknifeCols) """
+    return chg.output_string(year1,year2,sample_group,label,jk.estimate,jk.n,
+                             jk.mean,jk.bias,jk.variance,jk.se)
+
+def site_output_strings(year1,year2,label,jk):
+    """ Output lines for the ranked site influence of an estimate (swJackknifeSiteCols) """
+    return [chg.output_string(year1,year2,label,rank,site_id,stratum,value,influence)
+            for (rank,site_id,stratum,value,influence) in jk.ranked()]
+#------------------------------------------------------------
+
+#--------------------------------------------------------------------------
+#--------------------------------------------------------------------------
+#MAIN
+
+if __name__ == "__main__":
+
+    try:
+
+        #---- Create the Geoprocessing Object ----------------------
+        gp = spatial.create_gp(9.3)
+
+        #----- Create the Custom Error Object ----------------------
+        e = SvmpToolsError(gp)
+        # Set some basic defaults for error handling
+        e.debug = True
+        e.full_tb = True
+
+        #-------- unit conversion flag --------------------
+        unit_convert = "sf2m"
+
+        def msg(msg):
+            gp.AddMessage(msg)
+
+        # ----------- PARAMETERS ----------------------------------
+        # Get parameters from ArcToolbox input or command line
+        siteTable = gp.GetParameterAsText(0)
+        allsitesFC = gp.GetParameterAsText(1)
+        flatsFC = gp.GetParameterAsText(2)
+        fringeFC = gp.GetParameterAsText(3)
+        year1 = int(gp.GetParameterAsText(4))
+        year2 = gp.GetParameterAsText(5)
+        sample_group = gp.GetParameterAsText(6)
+        outFileSummary = gp.GetParameterAsText(7)
+        outFileSites = gp.GetParameterAsText(8)
+        strata_cache = chg.stratum_cache(gp.GetParameterAsText(9))
+
+        if not year2 or year2 == "#":
+            year2 = ""
+        else:
+            year2 = int(year2)
+
+        #------------------   DATA QUERIES ---------------------------------------------
+        #-------------------------------------------------------------------------------
+        y1_sites = chg.YearSites(gp,year1,allsitesFC,siteTable,flatsFC,sample_group)
+        if year2:
+            y2_sites = chg.YearSites(gp,year2,allsitesFC,siteTable,flatsFC,sample_group)
+        msg("-- Stratum Queries")
+        strata = chg.change_strata(gp,flatsFC,fringeFC,unit_convert,strata_cache)
+
+        #------------------------------ JACKKNIFE ---------------------------------------
+        #-------------------------------------------------------------------------------
+        summary_strings = []
+        site_strings = []
+
+        # Soundwide Zm area, Year 1
+        msg("Calculating jackknife estimates of the soundwide Zm area, %s" % year1)
+        samples = area_samples(e,siteTable,y1_sites,area_strata(strata),unit_convert)
+        start = time.time()
+        try:
+            jk_area = svmp.annual_jackknife(samples)
+        except ValueError, err:
+            e.call("Jackknife error: %s" % err)
+        msg(" %i sites left out, %.3f seconds" % (jk_area.n,time.time() - start))
+        msg(" Zm area: %r, jackknife standard error: %r" % (jk_area.estimate,jk_area.se))
+        summary_strings.append(summary_output_string(year1,year2,sample_group,AREA_ESTIMATE,jk_area))
+        site_strings.extend(site_output_strings(year1,year2,AREA_ESTIMATE,jk_area))
+
+        # Soundwide proportion change, Year 1 to Year 2
+        if year2:
+            msg("Calculating jackknife estimates of the soundwide proportion change, %s to %s" % (year1,year2))
+            site_data = chg.pair_site_data(e,siteTable,y1_sites,y2_sites)
+            (changes,zmChangeAll) = chg.change_calcs(gp,strata,site_data,year1,year2,unit_convert)
+            start = time.time()
+            try:
+                jk_change = svmp.change_jackknife(changes)
+            except ValueError, err:
+                e.call("Jackknife error: %s" % err)
+            msg(" %i sites left out, %.3f seconds" % (jk_change.n,time.time() - start))
+            msg(" Proportion change: %r, jackknife standard error: %r" % (jk_change.estimate,jk_change.se))
+            summary_strings.append(summary_output_string(year1,year2,sample_group,CHANGE_ESTIMATE,jk_change))
+            site_strings.extend(site_output_strings(year1,year2,CHANGE_ESTIMATE,jk_change))
+
+        #-----------------------------------   OUTPUT ----------------------------------
+        #-------------------------------------------------------------------------------
+        msg("Writing jackknife summary to output file:\n %s" % outFileSummary)
+        chg.write_output(e,outFileSummary,utils.swJackknifeCols,summary_strings)
+        msg("Writing site influence to output file:\n %s" % outFileSites)
+        chg.write_output(e,outFileSites,utils.swJackknifeSiteCols,site_strings)
+
+    except SystemExit:
+        pass
+    except:
+        e.call()
+        del gp
@@ -0,0 +1,98 @@
+""" Tests for the leave-one-site-out jackknife (svmp_93.annual_jackknife, change_jackknife) """
+"""
+    test_svmp_jackknife.py
+    For: Washington DNR, Submerged Vegetation Monitoring Program (SVMP)
+    Requires: Python 2.5.1, NumPy (synthetic site data from mc_benchmark)
+
+    Run from the scripts folder:  python test_svmp_jackknife.py
+    The leave-one-out estimates, updated from the stratum sums, are
+    checked against a full recalculation with each site removed, and the
+    stratified variance and bias against the same formulas applied to the
+    recalculated estimates.
+"""
+
+import unittest
+import svmp_93 as svmp
+import svmp_mc_93 as mc
+import mc_benchmark
+
+def without_site(data,site_id):
+    """ Site data list without one site """
+    return [row for row in data if row[0] != site_id]
+
+def stratified_variance_bias(estimate,strata,values):
+    """ Jackknife variance and bias, summed over the strata """
+    groups = {}
+    for (stratum,value) in zip(strata,values):
+        groups.setdefault(stratum,[]).append(value)
+    variance = 0.0
+    bias = 0.0
+    for vals in groups.values():
+        n = len(vals)
+        mean = sum(vals) / float(n)
+        variance += (n - 1) / float(n) * sum([(v - mean) ** 2 for v in vals])
+        bias += (n - 1) * (mean - estimate)
+    return (variance,bias)
+
+class JackknifeTest(unittest.TestCase):
+    def setUp(self):
+        self.strata = mc_benchmark.synthetic_strata(1)
+        # Persistent flats census with a single site
+        pfl = svmp.BaseStratum(svmp.pfl_extrap[0],svmp.pfl_extrap[1])
+        data = [["pfl000",2.5e5,1e9]]
+        self.strata.insert(1,mc.StratumMC(data,data,[["pfl000",3e5,1e9]],pfl,"sf2m"))
+
+    def samples(self,drop=None):
+        return [svmp.SampleStats(without_site(s.y1_data,drop),s.stratum,"sf2m") for s in self.strata]
+
+    def changes(self,drop=None):
+        return [svmp.ChangeStats(svmp.SampleStats(without_site(s.y1m_data,drop),s.stratum,"sf2m"),
+                                 svmp.SampleStats(without_site(s.y2m_data,drop),s.stratum,"sf2m"),
+                                 svmp.SampleStats(without_site(s.y1_data,drop),s.stratum,"sf2m"))
+                for s in self.strata]
+
+    def replicate_sites(self):
+        sites = []
+        for s in self.strata:
+            if s.extrapolation != "none":
+                sites.extend([row[0] for row in s.y1_data])
+        return sites
+
+    def assertClose(self,a,b,tolerance=1e-12):
+        self.assert_(abs(a - b) <= tolerance * abs(b),"%r != %r" % (a,b))
+
+    def test_census_sites_fixed(self):
+        jk = svmp.annual_jackknife(self.samples())
+        self.assertEqual(jk.site_ids,self.replicate_sites())
+        self.failIf("core" in jk.strata or svmp.pfl_extrap[0] in jk.strata)
+
+    def test_annual_recalculation(self):
+        jk = svmp.annual_jackknife(self.samples())
+        self.assertClose(jk.estimate,svmp.AnnualEstimate(self.samples()).zm_area)
+        values = [svmp.AnnualEstimate(self.samples(site_id)).zm_area for site_id in jk.site_ids]
+        for (value,expected) in zip(jk.values,values):
+            self.assertClose(value,expected)
+        (variance,bias) = stratified_variance_bias(jk.estimate,jk.strata,values)
+        self.assertClose(jk.variance,variance,1e-9)
+        self.assertClose(jk.bias,bias,1e-6)
+        self.assertClose(jk.se,variance ** 0.5,1e-9)
+
+    def test_change_recalculation(self):
+        changes = self.changes()
+        jk = svmp.change_jackknife(changes)
+        self.assertEqual(jk.site_ids,self.replicate_sites())
+        total = svmp.ChangeStatsTotal(changes,svmp.AnnualEstimate([c.y1 for c in changes]))
+        self.assertClose(jk.estimate,total.change_prop)
+        values = []
+        for site_id in jk.site_ids:
+            changes = self.changes(site_id)
+            total = svmp.ChangeStatsTotal(changes,svmp.AnnualEstimate([c.y1 for c in changes]))
+            values.append(total.change_prop)
+        for (value,expected) in zip(jk.values,values):
+            self.assertClose(value,expected,1e-9)
+        (variance,bias) = stratified_variance_bias(jk.estimate,jk.strata,values)
+        self.assertClose(jk.variance,variance,1e-6)
+        self.assertClose(jk.se,variance ** 0.5,1e-6)
+
+if __name__ == "__main__":
+    unittest.main()
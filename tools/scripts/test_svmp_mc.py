@@ -0,0 +1,96 @@
+""" Tests for the Monte Carlo confidence interval engines (svmp_mc_93) """
+"""
+    test_svmp_mc.py
+    For: Washington DNR, Submerged Vegetation Monitoring Program (SVMP)
+    Requires: Python 2.5.1, NumPy (multiprocessing for the worker test)
+
+    Run from the scripts folder:  python test_svmp_mc.py
+    The site data are the synthetic strata of the benchmark script
+    (mc_benchmark.synthetic_strata).  The iteration counts aren't multiples
+    of the block size, so the short last block is included.
+    The checkpoint test writes its files to a temporary folder.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import svmp_mc_93 as mc
+import mc_benchmark
+
+SEED = 20100414
+
+class EngineTest(unittest.TestCase):
+    """ Engines that give the same result for a seed """
+    def setUp(self):
+        self.strata = mc_benchmark.synthetic_strata(1)
+        self.iterations = mc.BLOCK_SIZE + 500
+
+    def conf_int(self,engine,workers=1):
+        return mc.mc_conf_int(self.strata,self.iterations,0.95,engine,SEED,workers)
+
+    def test_random_module_engines(self):
+        # classic, vectorized-legacy and kernel use the same random numbers
+        expected = self.conf_int(mc.CLASSIC)
+        self.assertEqual(expected.count,self.iterations)
+        for engine in (mc.VECTORIZED_LEGACY,mc.KERNEL):
+            accumulator = self.conf_int(engine)
+            self.assertEqual(accumulator.count,self.iterations)
+            self.assertEqual(accumulator.ci(),expected.ci())
+
+    def test_seed_repeats(self):
+        self.assertEqual(self.conf_int(mc.VECTORIZED).ci(),self.conf_int(mc.VECTORIZED).ci())
+
+    def test_workers(self):
+        # Each block has its own random number stream, so the number of
+        #  worker processes doesn't change the result
+        if mc.multiprocessing is None:
+            return
+        self.assertEqual(self.conf_int(mc.VECTORIZED,3).ci(),self.conf_int(mc.VECTORIZED,1).ci())
+
+class Interrupted(Exception):
+    pass
+
+class InterruptedCheckpoint(mc.Checkpoint):
+    """ Checkpoint that stops the run after saving a number of blocks """
+    def __init__(self,path,blocks):
+        mc.Checkpoint.__init__(self,path)
+        self.stop_blocks = blocks
+
+    def save(self,fingerprint,state,new_blocks):
+        mc.Checkpoint.save(self,fingerprint,state,new_blocks)
+        if state['blocks'] == self.stop_blocks:
+            raise Interrupted()
+
+class CheckpointTest(unittest.TestCase):
+    """ A run resumed from a checkpoint has the same result as an uninterrupted run """
+    def setUp(self):
+        self.strata = mc_benchmark.synthetic_strata(1)
+        self.iterations = 2 * mc.BLOCK_SIZE + 500
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder,"mc_test" + mc.CHECKPOINT_EXT)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def run_mc(self,engine,seed,checkpoint=None,resume=False):
+        return mc.mc_conf_int_adaptive(self.strata,0,self.iterations,0.95,engine,seed,
+                                       checkpoint=checkpoint,resume=resume)
+
+    def test_resume(self):
+        for engine in mc.ENGINES:
+            (expected,expected_se) = self.run_mc(engine,SEED)
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.assertRaises(Interrupted,self.run_mc,engine,SEED,
+                              InterruptedCheckpoint(self.path,2))
+            # The seed is read from the checkpoint
+            checkpoint = mc.Checkpoint(self.path)
+            (accumulator,ci_se) = self.run_mc(engine,None,checkpoint,True)
+            self.assertEqual(checkpoint.blocks,2)
+            self.assertEqual(accumulator.count,self.iterations)
+            self.assertEqual(accumulator.ci(),expected.ci())
+            self.assertEqual(ci_se,expected_se)
+
+if __name__ == "__main__":
+    unittest.main()
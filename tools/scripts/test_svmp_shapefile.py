@@ -0,0 +1,356 @@
+""" Tests for the Shapefile and dBASE Table Reader (svmp_shapefile) """
+"""
+    test_svmp_shapefile.py
+    For: Washington DNR, Submerged Vegetation Monitoring Program (SVMP)
+    Requires: Python 2.5.1
+
+    Run from the scripts folder:  python test_svmp_shapefile.py
+    The test files are in the test_data folder:
+      beds.shp -- polygons (flats): fl01 is a 10 x 10 square with a 4 x 4
+                  hole (area 84), fl02 has two parts (area 9 + 6), fl03
+                  is marked as deleted, fl04 has area 1 and the last
+                  record (area 25) has no name
+      shore.shp -- polylines (fringe), lengths 11 (two segments), 7 (two
+                  parts), 1, 10 and a deleted record
+      allsites.dbf, sitestats.dbf -- dBASE tables with a deleted record
+                  and blank numeric values
+"""
+
+import os
+import array
+import shutil
+import tempfile
+import unittest
+import datetime
+import svmp_shapefile
+import svmp_spatial_93 as spatial
+import svmp_93 as svmp
+import svmpUtils as utils
+import sw_area_change_93
+
+test_data = os.path.join(os.path.dirname(os.path.abspath(__file__)),"test_data")
+
+def test_file(name):
+    return os.path.join(test_data,name)
+
+class GeometryTest(unittest.TestCase):
+    """ Geometry sizes from the shapefile coordinates """
+    def setUp(self):
+        self.beds = svmp_shapefile.Table(test_file("beds.shp"))
+        self.shore = svmp_shapefile.Table(test_file("shore.shp"))
+
+    def test_polygon_area_with_hole(self):
+        geometry = self.beds.shapes.geometry(0)
+        self.assertEqual(geometry.type,"Polygon")
+        self.assertEqual(len(geometry.parts()),2)
+        self.assertAlmostEqual(geometry.Area,84.0,9)
+        # Perimeter includes the hole
+        self.assertAlmostEqual(geometry.Length,56.0,9)
+
+    def test_polygon_area_with_parts(self):
+        self.assertAlmostEqual(self.beds.shapes.geometry(1).Area,15.0,9)
+
+    def test_polyline_length(self):
+        lengths = [self.shore.shapes.geometry(i).Length for i in range(4)]
+        for (length,expected) in zip(lengths,[11.0,7.0,1.0,10.0]):
+            self.assertAlmostEqual(length,expected,9)
+        self.assertEqual(self.shore.shapes.geometry(0).Area,0.0)
+
+    def test_shape_offsets(self):
+        # Record positions from the .shx file and from reading the .shp file
+        self.assertEqual(self.beds.shapes.offsets,self.beds.shapes._scan_offsets())
+
+class DeletedRecordsTest(unittest.TestCase):
+    """ Records marked as deleted in the .dbf file are skipped """
+    def test_rows(self):
+        table = svmp_shapefile.Table(test_file("beds.shp"))
+        rows = list(table.rows())
+        self.assertEqual([row.getValue("FID") for row in rows],[0,1,3,4])
+        self.assertEqual([row.getValue("NAME") for row in rows],["fl01","fl02","fl04",""])
+        area = sum([row.getValue("Shape").Area for row in rows])
+        self.assertAlmostEqual(area,125.0,9)
+
+    def test_polyline_rows(self):
+        table = svmp_shapefile.Table(test_file("shore.shp"))
+        length = sum([row.getValue("Shape").Length for row in table.rows()])
+        self.assertAlmostEqual(length,29.0,9)
+
+    def test_table_rows(self):
+        table = svmp_shapefile.Table(test_file("allsites.dbf"))
+        self.assertEqual(table.dbf.count,6)
+        names = [row.getValue("NAME") for row in table.rows()]
+        self.assertEqual(names,["core001","core002","flr001","frr001","frr002"])
+
+    def test_search_cursor(self):
+        cursor = svmp_shapefile.reader.SearchCursor(test_file("sitestats.dbf"))
+        codes = []
+        row = cursor.Next()
+        while row:
+            codes.append(row.GetValue("site_code"))
+            row = cursor.Next()
+        self.assertEqual(codes,["core001","core001","core002","flr001","frr001","frr002"])
+
+class ColumnsTest(unittest.TestCase):
+    """ Values read by column (DbfTable.columns, Table.columns) """
+    def test_typed_arrays(self):
+        field = svmp_shapefile.DbfField("Y2008","N",1,4,0)
+        column = field.column(["   1","   8","   0"])
+        self.assert_(isinstance(column,array.array))
+        self.assertEqual((column.typecode,list(column)),("l",[1,8,0]))
+        field = svmp_shapefile.DbfField("AREA","N",1,8,2)
+        column = field.column(["  100.50","   -0.25"])
+        self.assertEqual((column.typecode,list(column)),("d",[100.5,-0.25]))
+
+    def test_blank_numbers(self):
+        # Blank (null) values give a list, with None for the blanks
+        field = svmp_shapefile.DbfField("Y2008","N",1,4,0)
+        self.assertEqual(field.column(["   1","    ","   8"]),[1,None,8])
+        field = svmp_shapefile.DbfField("AREA","N",1,8,2)
+        self.assertEqual(field.column(["  100.50","********"]),[100.5,None])
+
+    def test_table_columns(self):
+        table = svmp_shapefile.Table(test_file("allsites.dbf"))
+        columns = table.columns(["NAME","Y2007","Y2008"])
+        self.assertEqual(columns.numbers,[0,1,2,3,4])
+        self.assertEqual(columns.column("name"),["core001","core002","flr001","frr001","frr002"])
+        self.assertEqual(columns.column("Y2007"),[1,1,0,8,None])
+        self.assertEqual(columns.column("Y2008"),[1,8,1,None,0])
+        self.assertEqual(columns.column("OID"),[0,1,2,3,4])
+        self.assertRaises(ValueError,columns.column,"STRATUM")
+
+    def test_deleted_records(self):
+        table = svmp_shapefile.Table(test_file("sitestats.dbf"))
+        columns = table.columns(["zm_area_ft","date_samp_"])
+        self.assertEqual(columns.numbers,[0,1,2,3,5,6])
+        self.assertEqual(columns.column("zm_area_ft"),[100.5,120.0,50.25,75.0,80.0,None])
+        self.assertEqual(columns.column("date_samp_")[2],datetime.datetime(2008,1,1))
+        self.assertEqual(columns.column("date_samp_")[-1],None)
+        # Only the deleted record has a value for this field
+        columns = table.columns(["site_code","zm_area_va"])
+        self.assertEqual(columns.column("zm_area_va"),[10.25,12.0,None,7.5,8.0,None])
+
+    def test_shape_column(self):
+        table = svmp_shapefile.Table(test_file("beds.shp"))
+        columns = table.columns(["NAME","Shape"])
+        areas = [geometry.Area for geometry in columns.column("Shape")]
+        self.assertEqual([round(area,9) for area in areas],[84.0,15.0,1.0,25.0])
+
+    def test_search_cursor_fields(self):
+        cursor = svmp_shapefile.reader.SearchCursor(test_file("allsites.dbf"),"",None,"NAME; Y2008")
+        row = cursor.Next()
+        self.assertEqual((row.getValue("NAME"),row.getValue("Y2008")),("core001",1))
+        # Fields not in the list are not read
+        self.assertRaises(ValueError,row.getValue,"STRATUM")
+
+    def test_truncated_file(self):
+        folder = tempfile.mkdtemp()
+        try:
+            path = os.path.join(folder,"cut.dbf")
+            table = svmp_shapefile.DbfTable(test_file("allsites.dbf"))
+            f = open(path,"wb")
+            f.write(table.data[:table.header_length + 2 * table.record_length + 5])
+            f.close()
+            cut = svmp_shapefile.Table(path)
+            self.assertEqual(cut.dbf.count,2)
+            self.assertEqual(cut.columns(["NAME"]).column("NAME"),["core001","core002"])
+            del cut
+        finally:
+            shutil.rmtree(folder,True)
+
+class DateTest(unittest.TestCase):
+    """ Dates in query expressions and date values """
+    def test_query_dates(self):
+        parse_date = svmp_shapefile.parse_date
+        self.assertEqual(parse_date("01-07-2008"),datetime.datetime(2008,1,7))
+        self.assertEqual(parse_date("01/07/2008"),datetime.datetime(2008,1,7))
+        self.assertEqual(parse_date("2008-07-01"),datetime.datetime(2008,7,1))
+        self.assertEqual(parse_date("01-07-2008 12:00:00 AM"),datetime.datetime(2008,1,7,0,0))
+        self.assertEqual(parse_date("01-07-2008 12:15:00 PM"),datetime.datetime(2008,1,7,12,15))
+        self.assertEqual(parse_date("01-07-2008 1:15:30 PM"),datetime.datetime(2008,1,7,13,15,30))
+        self.assertEqual(parse_date("2008-01-07 23:59:59"),datetime.datetime(2008,1,7,23,59,59))
+
+    def test_bad_query_dates(self):
+        for text in ("01.07.2008","13-01-2008","2008/01/07","01-07-08","01-07-2008 13:00:00 PM"):
+            self.assertRaises(svmp_shapefile.QueryError,svmp_shapefile.parse_date,text)
+        self.assertRaises(svmp_shapefile.QueryError,svmp_shapefile.parse_where,"d > #01.07.2008#")
+
+    def test_date_values(self):
+        as_datetime = svmp_shapefile.as_datetime
+        self.assertEqual(as_datetime("2008-01-07 00:00:00"),datetime.datetime(2008,1,7))
+        self.assertEqual(as_datetime(datetime.date(2008,1,7)),datetime.datetime(2008,1,7))
+        self.assertEqual(as_datetime(None),None)
+        # Day and month order of other text isn't known
+        for text in ("01/07/2008","7/1/2008 12:00:00 AM","01.07.2008"):
+            self.assertRaises(svmp_shapefile.QueryError,as_datetime,text)
+
+class TextDateCursor(object):
+    """ Cursor with date values as text (m/d/yyyy), as from some geoprocessors """
+    def __init__(self,cursor):
+        self.cursor = cursor
+
+    def Next(self):
+        row = self.cursor.Next()
+        if row is None:
+            return None
+        return TextDateRow(row)
+
+class TextDateRow(object):
+    def __init__(self,row):
+        self.row = row
+
+    def getValue(self,name):
+        value = self.row.getValue(name)
+        if isinstance(value,datetime.datetime):
+            return "%i/%i/%i 12:00:00 AM" % (value.month,value.day,value.year)
+        return value
+
+class TextDateGP(object):
+    """ Stand-in geoprocessor: queries are evaluated by the reader, and 
+        cursors give dates as text
+    """
+    def __init__(self):
+        self.queries = []
+
+    def ListFields(self,path):
+        return svmp_shapefile.reader.ListFields(path)
+
+    def SearchCursor(self,path,query=""):
+        self.queries.append(query)
+        return TextDateCursor(svmp_shapefile.reader.SearchCursor(path,query))
+
+class SnapshotTest(unittest.TestCase):
+    """ Snapshot queries (svmp_spatial_93.TableQuery) """
+    def setUp(self):
+        self.settings = (spatial.SNAPSHOT_TABLES,spatial.READ_SHAPEFILES)
+        # Read the test tables with the stand-in geoprocessor
+        spatial.READ_SHAPEFILES = False
+        spatial.table_snapshots.clear()
+
+    def tearDown(self):
+        (spatial.SNAPSHOT_TABLES,spatial.READ_SHAPEFILES) = self.settings
+        spatial.table_snapshots.clear()
+
+    def test_geoprocessor_tables(self):
+        # Tables read by the geoprocessor aren't in snapshots by default
+        gp = TextDateGP()
+        query = spatial.TableQuery(gp,test_file("sitestats.dbf"),"site_code = 'core002'")
+        self.assertEqual(query.field_results(["zm_area_ft"]),{"2":[50.25]})
+        self.assertEqual(gp.queries,["site_code = 'core002'"])
+        spatial.SNAPSHOT_TABLES = True
+        self.assertEqual(query.field_results(["zm_area_ft"]),{"2":[50.25]})
+        self.assertEqual(gp.queries[1:],[""])
+
+    def test_date_text_fallback(self):
+        # Date text from the cursor can't be compared on the snapshot, 
+        #  so the query is evaluated by the geoprocessor
+        spatial.SNAPSHOT_TABLES = True
+        gp = TextDateGP()
+        query_string = "date_samp_ >= #01-01-2008# and date_samp_ <= #12-31-2008#"
+        query = spatial.TableQuery(gp,test_file("sitestats.dbf"),query_string)
+        results = query.field_results(["site_code","zm_area_ft"],"site_code")
+        self.assertEqual(results,{"core001":["core001",120.0],"core002":["core002",50.25],
+                                  "flr001":["flr001",75.0]})
+        self.assertEqual(gp.queries,["",query_string])
+
+class ToolQueryTest(unittest.TestCase):
+    """ The query expressions of the SVMP tools, on the test files """
+    def setUp(self):
+        self.gp = svmp_shapefile.reader
+        self.cache = svmp.StratumConstants()
+        spatial.table_snapshots.clear()
+        # dBASE field names are at most 10 characters
+        self.columns = (utils.samplestartdateCol,utils.est_basalcovCol,utils.estvar_basalcovCol)
+        (utils.samplestartdateCol,utils.est_basalcovCol,utils.estvar_basalcovCol) = ("date_samp_","zm_area_ft","zm_area_va")
+
+    def tearDown(self):
+        (utils.samplestartdateCol,utils.est_basalcovCol,utils.estvar_basalcovCol) = self.columns
+        spatial.table_snapshots.clear()
+
+    def test_flats_stratum(self):
+        # "NAME" <> '' and "focus_stra" not in ('c','pfl') -- fl02 and fl04
+        stratum = svmp.FlatsStratum("flats","area",self.gp,test_file("beds.shp"),None,self.cache)
+        self.assertEqual(stratum.Ni,2)
+        self.assertAlmostEqual(stratum.A2,16.0,9)
+
+    def test_fringe_stratum(self):
+        # Fringe sites outside the "sps" region, with "orphans" for the length
+        stratum = svmp.FringeStratum("fringe","linear",self.gp,test_file("shore.shp"),None,self.cache)
+        self.assertEqual(stratum.Ni,1)
+        self.assertAlmostEqual(stratum.LT,18.0,9)
+        stratum = svmp.FringeStratum("wide fringe","linear",self.gp,test_file("shore.shp"),None,self.cache)
+        self.assertEqual(stratum.Ni,1)
+        self.assertAlmostEqual(stratum.LT,10.0,9)
+
+    def test_sites_strata(self):
+        # (Y2007 = 1 or Y2007 = 8) and (Y2008 = 1 or Y2008 = 8) -- a blank year doesn't match
+        results = sw_area_change_93.sites_strata(self.gp,test_file("allsites.dbf"),"soundwide",2007,2008)
+        self.assertEqual(results,{"core001":["core","core"],"core002":["core","core"]})
+        results = sw_area_change_93.sites_strata(self.gp,test_file("allsites.dbf"),"soundwide",2008)
+        self.assertEqual(sorted(results.keys()),["core001","core002","flr001"])
+
+    def test_sites_data(self):
+        # site_code in (...) and date_samp_ >= #01-01-2008# and date_samp_ <= #12-31-2008#
+        sites = sw_area_change_93.query_list(["core001","core002","flr001","frr001","frr002"])
+        results = sw_area_change_93.sites_data(self.gp,sites,2008,test_file("sitestats.dbf"))
+        self.assertEqual(results,{"core001":["core001",120.0,12.0],"core002":["core002",50.25,None],
+                                  "flr001":["flr001",75.0,7.5]})
+        results = sw_area_change_93.sites_data(self.gp,sites,2007,test_file("sitestats.dbf"))
+        self.assertEqual(results.keys(),["core001"])
+
+    def test_flats_sample_areas(self):
+        # NAME in ('fl01','fl03','fl04') -- fl03 is deleted
+        results = sw_area_change_93.flats_sample_areas(self.gp,test_file("beds.shp"),["fl01","fl03","fl04"])
+        self.assertEqual(sorted(results.keys()),["fl01","fl04"])
+        self.assertAlmostEqual(results["fl01"][0],84.0,9)
+        self.assertAlmostEqual(results["fl04"][0],1.0,9)
+
+    def test_null_values(self):
+        # Comparisons with null values are unknown, so NOT doesn't match them either
+        query = spatial.TableQuery(self.gp,test_file("allsites.dbf"),"not (Y2008 = 1 or Y2008 = 8)")
+        self.assertEqual(query.field_results(["NAME"],"NAME").keys(),["frr002"])
+        query = spatial.TableQuery(self.gp,test_file("allsites.dbf"),"Y2008 is null or Y2007 is null")
+        self.assertEqual(sorted(query.field_results(["NAME"],"NAME").keys()),["frr001","frr002"])
+
+    def test_null_aggregates(self):
+        # Blank numbers are left out of sums, minimums and maximums
+        query = spatial.TableQuery(self.gp,test_file("sitestats.dbf"))
+        results = query.aggregate([(spatial.SUM,"zm_area_ft"),(spatial.MIN,"zm_area_ft"),
+                                   (spatial.MAX,"zm_area_ft"),(spatial.SUM,"zm_area_va"),
+                                   (spatial.MIN,"zm_area_va"),(spatial.COUNT,)])
+        self.assertEqual(results,[425.75,50.25,120.0,37.75,7.5,6])
+        query = spatial.TableQuery(self.gp,test_file("sitestats.dbf"),"site_code = 'frr002'")
+        results = query.aggregate([(spatial.SUM,"zm_area_ft"),(spatial.MAX,"zm_area_ft"),
+                                   (spatial.SUM,"zm_area_va","site_code")])
+        self.assertEqual(results,[0,None,{"frr002":0}])
+
+    def test_string_case(self):
+        # String comparisons are case sensitive (as in shapefiles)
+        query = spatial.TableQuery(self.gp,test_file("sitestats.dbf"),"site_code in ('CORE001')")
+        self.assertEqual(query.record_count,0)
+
+class ReaderTest(unittest.TestCase):
+    """ Geoprocessor interface (ShapefileReader) """
+    def test_list_fields(self):
+        fields = svmp_shapefile.reader.ListFields(test_file("beds.shp"))
+        self.assertEqual([f.Name for f in fields],["FID","Shape","NAME","focus_stra"])
+        self.assertEqual([f.Type for f in fields],["OID","Geometry","String","String"])
+        fields = svmp_shapefile.reader.ListFields(test_file("sitestats.dbf"))
+        self.assertEqual([f.Type for f in fields],["OID","String","Date","Double","Double"])
+
+    def test_describe(self):
+        description = svmp_shapefile.reader.Describe(test_file("shore.shp"))
+        self.assertEqual(description.ShapeType,"Polyline")
+        self.assertEqual(description.ShapeFieldName,"Shape")
+        self.assertEqual(description.SpatialReference.LinearUnitName,"Foot_US")
+        description = svmp_shapefile.reader.Describe(test_file("allsites.dbf"))
+        self.assertEqual(description.DataType,"DbaseTable")
+        self.assertEqual(description.OIDFieldName,"OID")
+
+    def test_field_names_not_case_sensitive(self):
+        table = svmp_shapefile.Table(test_file("shore.shp"))
+        self.assertEqual(table.field("region").Name,"REGION")
+        self.assertEqual(table.field("fid"),"FID")
+        self.assertRaises(ValueError,table.field,"NAME")
+
+if __name__ == "__main__":
+    unittest.main()